@@ -0,0 +1,211 @@
+import azure.functions as func
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ..shared.azure_clients import get_blob_client, get_openai_client
+from ..shared.answer_cache import normalize_query
+from ..shared.indexing import embed_texts
+from ..shared.retry import call_with_retries, RateLimiter
+from ..shared.telemetry import start_trace
+from ..shared.chat_pipeline import (
+    SYSTEM_PROMPT, OPENAI_API_KEY, OPENAI_ENDPOINT, SEARCH_TOP, MAX_SEARCH_TOP, ROUTING_MODE, ANSWER_CACHE_ENABLED,
+    EMBEDDING_BATCH_SIZE, INDEXING_CONCURRENCY,
+    document_artifact_cache, chat_answer_cache, load_knowledge_map, route_queries, prepare_retriever, search_candidates, build_context
+)
+
+# Environment variables for Azure resources (to be set in Azure or local.settings.json)
+# Question answering settings (OpenAI, AI Search, routing, retrieval, context, answer cache) are read by shared/chat_pipeline.py
+BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', '100'))  # Maximum questions per batch request
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '4'))  # Answer completions in flight at once
+BATCH_REQUESTS_PER_MINUTE = int(os.environ.get('BATCH_REQUESTS_PER_MINUTE', '0'))  # Completions started per minute and request (0 = no limit)
+
+# Helper to check the 'queries' of a batch payload
+def parse_queries(queries):
+    """
+    Args:
+        queries: Value of the payload's 'queries'
+    Returns:
+        Tuple (queries, error): the list of questions, or None and an error message
+    """
+    if not isinstance(queries, list) or not queries:
+        return None, "Must provide 'queries', a non-empty list of questions."
+    if len(queries) > BATCH_MAX_QUERIES:
+        return None, f"At most {BATCH_MAX_QUERIES} queries per batch."
+    if not all(isinstance(q, str) and q.strip() for q in queries):
+        return None, "Every query must be a non-empty string."
+    return queries, None
+
+# Generates the answers of several prompts concurrently, within a rate limit
+def generate_answers(gpt_client, prompts, max_workers=BATCH_CONCURRENCY, requests_per_minute=BATCH_REQUESTS_PER_MINUTE):
+    """
+    Throttled completions (429/503) are retried with backoff; each retry waits for a new slot.
+    A failed completion only fails its own question.
+    Args:
+        gpt_client: OpenAI client wrapper
+        prompts: List of chat message lists
+        max_workers: Completions in flight at once
+        requests_per_minute: Completions started per minute (0 = no limit)
+    Returns:
+        List of (answer, error, latency_ms) tuples in the order of prompts; error is None or a message
+    """
+    limiter = RateLimiter(requests_per_minute)
+
+    def complete(messages):
+        limiter.acquire()
+        return gpt_client.chat_completion(messages=messages, model="gpt-4")
+
+    def answer(messages):
+        started = time.perf_counter()
+        try:
+            text, error = call_with_retries(lambda: complete(messages)), None
+        except Exception as e:
+            logging.exception("Batch answer generation failed")
+            text, error = None, str(e)
+        return text, error, round((time.perf_counter() - started) * 1000, 1)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(answer, prompts))
+
+# Main Azure Function entry point
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    HTTP POST endpoint answering many questions about one document in a single call.
+    Payload: {"queries": [...], "blob_name" or "blob_url", optional "top", "routing" and "cache"
+    (as for the chat function)}.
+    Steps:
+    1. Load the knowledge map once; repeated questions (same normalized text) are answered once.
+    2. Answer what the answer cache already knows, then embed the remaining questions in bulk requests.
+    3. Score the chapters for all questions together (one matrix product over the summary embeddings).
+    4. Chunk and index the union of the selected chapters once, then retrieve each question's candidates
+       from the shared retriever and assemble its context.
+    5. Generate the answers concurrently (BATCH_CONCURRENCY), within BATCH_REQUESTS_PER_MINUTE.
+    The response has one result per query, in order: {query, answer, references, context_sections,
+    routing, context, cache, latency_ms} or {query, error} if its completion failed. A "batch" block
+    counts unique questions, cache hits, indexed chapters, retrievals and completions, and "timings"
+    reports the time per stage and call (see shared/telemetry.py).
+    """
+    # A batch always reports its timings
+    trace = start_trace('batch', timings=True)
+    try:
+        try:
+            data = req.get_json()
+        except ValueError:
+            return func.HttpResponse("Invalid JSON payload.", status_code=400)
+        queries, error = parse_queries(data.get('queries'))
+        if error:
+            return func.HttpResponse(error, status_code=400)
+        blob_name = data.get('blob_name') or (data.get('blob_url') or '').split('/')[-1]
+        if not blob_name:
+            return func.HttpResponse("Must provide either 'blob_url' or 'blob_name' in payload.", status_code=400)
+        use_cache = ANSWER_CACHE_ENABLED and data.get('cache', True) is not False
+        routing_mode = data.get('routing', ROUTING_MODE)
+        if routing_mode not in ('embedding', 'llm'):
+            return func.HttpResponse("'routing' must be 'embedding' or 'llm'.", status_code=400)
+        try:
+            top = min(max(int(data.get('top', SEARCH_TOP)), 1), MAX_SEARCH_TOP)
+        except (TypeError, ValueError):
+            return func.HttpResponse("'top' must be an integer.", status_code=400)
+
+        # 1. Load the knowledge map once for all questions
+        with trace.span('load_map', stage=True) as span:
+            blob_client = get_blob_client(BLOB_CONN_STR)
+            artifact_cache = document_artifact_cache()
+            doc_name, knowledge_map, map_etag = load_knowledge_map(blob_client, blob_name, artifact_cache)
+            span.set(sections=len(knowledge_map))
+        # Questions that only differ in case, spacing or punctuation share one answer
+        unique = {}
+        for query in queries:
+            unique.setdefault(normalize_query(query), query)
+        answers = {}
+
+        # 2. Cached answers first (exact, then near-duplicate after embedding); the cache is shared with the chat function
+        cache = chat_answer_cache() if use_cache else None
+        cache_version = f"{map_etag}|{routing_mode}|{top}"
+        if cache is not None:
+            for key, query in unique.items():
+                cached, match = cache.get(doc_name, cache_version, query)
+                if cached is not None:
+                    answers[key] = {**cached, 'cache': {'hit': True, 'match': match}}
+        gpt_client = get_openai_client(OPENAI_API_KEY, OPENAI_ENDPOINT)
+        pending = [key for key in unique if key not in answers]
+        with trace.span('embed_queries', stage=True, queries=len(pending)):
+            embeddings = dict(zip(pending, embed_texts(
+                gpt_client, [unique[key] for key in pending], batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY
+            )))
+        if cache is not None:
+            for key in list(pending):
+                cached, match = cache.get(doc_name, cache_version, unique[key], embeddings[key])
+                if cached is not None:
+                    answers[key] = {**cached, 'cache': {'hit': True, 'match': match}}
+            pending = [key for key in pending if key not in answers]
+
+        # 3. Route all remaining questions together
+        with trace.span('route', stage=True, mode=routing_mode) as span:
+            routes = dict(zip(pending, route_queries(
+                [unique[key] for key in pending], [embeddings[key] for key in pending],
+                knowledge_map, gpt_client, routing_mode, max_workers=BATCH_CONCURRENCY
+            )))
+            span.set(selected=sum(len(indices) for indices, _ in routes.values()))
+
+        # 4. Index the chapters any question needs once, then retrieve and assemble each question's context
+        needed = sorted({i for indices, _ in routes.values() for i in indices})
+        retriever, embedding_index = None, None
+        if needed:
+            retriever, embedding_index = prepare_retriever(
+                [knowledge_map[i] for i in needed], doc_name, gpt_client, blob_client, artifact_cache, trace
+            )
+        prompts, prepared = [], {}
+        with trace.span('retrieve', stage=True, top=top) as span:
+            for key in pending:
+                query = unique[key]
+                indices, routing = routes[key]
+                sections = [knowledge_map[i] for i in indices]
+                entry = {'references': [], 'context_sections': [s['chapter_name'] for s in sections], 'routing': routing}
+                content = query
+                if sections:
+                    results = search_candidates(retriever, embedding_index, embeddings[key], sections, doc_name, top)
+                    context, entry['references'], entry['context'] = build_context(results, query, top)
+                    content = f"Context:\n{context}\n\nQuestion: {query}"
+                prepared[key] = entry
+                prompts.append([{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": content}])
+            span.set(retrievals=sum(1 for key in pending if routes[key][0]))
+
+        # 5. Generate the answers concurrently
+        with trace.span('generate', stage=True, completions=len(prompts)):
+            generated = generate_answers(gpt_client, prompts)
+        failed = 0
+        for key, (answer, error, latency_ms) in zip(pending, generated):
+            if error is not None:
+                answers[key] = {'error': error, 'latency_ms': latency_ms}
+                failed += 1
+                continue
+            payload = {'answer': answer, **prepared[key]}
+            if cache is not None:
+                cache.put(doc_name, cache_version, unique[key], embeddings[key], payload)
+            answers[key] = {**payload, 'cache': {'hit': False, 'match': None}, 'latency_ms': latency_ms}
+
+        results = [{'query': query, **answers[normalize_query(query)]} for query in queries]
+        summary = {
+            'queries': len(queries),
+            'unique_queries': len(unique),
+            'cache_hits': len(unique) - len(pending),
+            'chapters_indexed': len(needed),
+            'retrievals': sum(1 for key in pending if routes[key][0]),
+            'completions': len(pending),
+            'failed': failed
+        }
+        if cache is not None:
+            summary['cache'] = cache.stats()
+        body = trace.attach({'results': results, 'batch': summary})
+        return func.HttpResponse(json.dumps(body), mimetype="application/json", status_code=200)
+    except Exception as e:
+        # Log the traceback and report the failing stage; the trace id matches the exported spans
+        logging.exception("Batch request failed in stage %s", trace.stage)
+        trace.finish(e)
+        return func.HttpResponse(json.dumps(trace.error_payload(e)), mimetype="application/json", status_code=500)
+    finally:
+        trace.finish()
@@ -0,0 +1,105 @@
+import argparse
+import random
+import re
+import time
+from ..shared.document_analysis import detect_index, analyze_structure
+
+# Benchmarks TOC detection and segmentation on large synthetic documents.
+# Run from the repository root: python -m backend.benchmarks.document_analysis [--entries 100 1000 10000]
+
+# Entries per synthetic TOC page
+ENTRIES_PER_PAGE = 40
+
+# Builds a synthetic book with a multi-page TOC
+def synthetic_document(entries, pages_per_chapter=3, front_pages=4, seed=0):
+    """
+    Builds a document whose TOC lists chapters and numbered subsections with dot leaders,
+    with printed page 1 after the front matter and TOC, and noise lines that end in numbers.
+    Args:
+        entries: Number of TOC entries
+        pages_per_chapter: Body pages per chapter
+        front_pages: Pages before the TOC
+        seed: Random seed
+    Returns:
+        Tuple (pages, expected chapter start page indices)
+    """
+    rng = random.Random(seed)
+    toc_lines, chapters = [], []
+    printed = 1
+    for i in range(entries):
+        if i % 4 == 0:
+            chapters.append(printed)
+            toc_lines.append(f"Chapter {len(chapters)} {'Topic ' * rng.randint(1, 6)}{'.' * rng.randint(3, 40)} {printed}")
+        else:
+            toc_lines.append(f"{len(chapters)}.{i % 4} Subsection {i}{'.' * rng.randint(3, 40)}{printed}")
+            printed += pages_per_chapter // 3 or 1
+        if i % 4 == 3:
+            printed = chapters[-1] + pages_per_chapter
+    toc_pages = ['\n'.join(toc_lines[i:i + ENTRIES_PER_PAGE]) for i in range(0, len(toc_lines), ENTRIES_PER_PAGE)]
+    body_start = front_pages + len(toc_pages)
+    body = []
+    for p in range(1, chapters[-1] + pages_per_chapter):
+        number = next((n for n, start in enumerate(chapters, 1) if start == p), None)
+        head = f"Chapter {number} {'Topic'}" if number else f"Running header {p}"
+        body.append(f"{head}\nIn 2019 sales rose by {rng.randint(1, 99)}\n{'lorem ipsum ' * 60}\n{p}")
+    front = [f"Front matter page {i}\nCopyright 2024" for i in range(front_pages)]
+    return front + toc_pages + body, [body_start + start - 1 for start in chapters]
+
+# Builds pages of long prose lines that mention sections but hold no TOC
+def prose_document(pages, line_length, seed=0):
+    # Text layers extracted without layout often put a whole paragraph on one line
+    rng = random.Random(seed)
+    words = ['the', 'section', 'chapter', 'results', 'part', 'of', 'in', 'analysis', 'see']
+    return ['\n'.join(' '.join(rng.choice(words) for _ in range(line_length // 6)) for _ in range(5)) for _ in range(pages)]
+
+# Line-by-line detection with the lazy pattern used before the rewrite, as a baseline
+def legacy_detect_index(pages, max_toc_pages=50):
+    toc_pattern = re.compile(r'(chapter|section|part)\s+([\w\d\.\-]+).*?(\d+)', re.IGNORECASE)
+    index = []
+    for i, page in enumerate(pages[:max_toc_pages]):
+        for line in page.split('\n'):
+            match = toc_pattern.search(line)
+            if match:
+                index.append({'title': match.group(2), 'page_ref': int(match.group(3)), 'line': line, 'toc_page': i+1})
+    return index
+
+# Helper timing a function over several runs
+def best_of(fn, repeat):
+    # Returns (best seconds, last result)
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+# Runs the benchmarks and prints one row per document size
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks TOC detection and segmentation on synthetic documents.')
+    parser.add_argument('--entries', type=int, nargs='+', default=[100, 1000, 10000], help='TOC sizes to benchmark')
+    parser.add_argument('--line-lengths', type=int, nargs='+', default=[250, 1000, 2000], help='Prose line lengths to benchmark (the legacy pattern is quadratic in them)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (the best is reported)')
+    args = parser.parse_args()
+    print(f"{'entries':>8} {'pages':>7} {'MB':>6} {'legacy ms':>10} {'detect ms':>10} {'entries/s':>10} {'analyze ms':>11} {'chapters':>9} {'correct':>8}")
+    for entries in args.entries:
+        pages, expected = synthetic_document(entries)
+        toc_pages = len(pages) - len(expected) * 3
+        scan = max(50, toc_pages + 1)
+        size_mb = sum(len(p) for p in pages[:scan]) / 1e6
+        legacy_s, _ = best_of(lambda: legacy_detect_index(pages, max_toc_pages=scan), args.repeat)
+        detect_s, index = best_of(lambda: detect_index(pages, max_toc_pages=scan), args.repeat)
+        analyze_s, (sections, _) = best_of(lambda: analyze_structure(pages, max_toc_pages=scan), args.repeat)
+        correct = [s['start_page'] for s in sections] == expected
+        print(f"{entries:>8} {len(pages):>7} {size_mb:>6.2f} {legacy_s * 1000:>10.1f} {detect_s * 1000:>10.1f} "
+              f"{len(index) / detect_s:>10.0f} {analyze_s * 1000:>11.1f} {len(sections):>9} {str(correct):>8}")
+    print()
+    print(f"{'line chars':>10} {'MB':>6} {'legacy ms':>10} {'detect ms':>10}")
+    for line_length in args.line_lengths:
+        pages = prose_document(50, line_length)
+        size_mb = sum(len(p) for p in pages) / 1e6
+        legacy_s, _ = best_of(lambda: legacy_detect_index(pages), args.repeat)
+        detect_s, _ = best_of(lambda: detect_index(pages), args.repeat)
+        print(f"{line_length:>10} {size_mb:>6.2f} {legacy_s * 1000:>10.1f} {detect_s * 1000:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+import json
+import math
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from types import SimpleNamespace
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from ..shared.azure_clients import override_clients
+
+# In-memory stand-ins for the Azure clients created by shared/azure_clients.py, for offline
+# benchmarks. They implement only what the backend calls, record call counts and bytes
+# transferred per operation, and can sleep to model service latency.
+
+# Modelled service latencies in seconds (multiplied by the latency scale; 0 disables sleeping)
+LATENCIES = {
+    'blob_request': 0.005,  # Per Blob Storage request
+    'blob_mb': 0.01,  # Per MB transferred to or from Blob Storage
+    'analyze_request': 1.0,  # Per Document Intelligence analysis
+    'analyze_page': 0.05,  # Per analysed page
+    'chat': 1.5,  # Per chat completion
+    'embedding_request': 0.15,  # Per embedding request
+    'embedding_input': 0.002,  # Per embedded text
+    'search_request': 0.05,  # Per AI Search request
+    'queue_request': 0.01  # Per queue message
+}
+# Header of the synthetic "PDF" blobs the fake Document Intelligence client reads
+SYNTHETIC_PDF_HEADER = b'%PDF-synthetic\n'
+
+# Thread-safe counters shared by all fakes of a benchmark run
+class ServiceStats:
+    """
+    Per-operation counters, keyed like 'blob.download': calls, bytes_in (sent to the service),
+    bytes_out (returned by it) and seconds spent in the fake (including modelled latency).
+    """
+
+    def __init__(self, latency_scale=0.0):
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._ops = defaultdict(lambda: {'calls': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+
+    def record(self, op, bytes_in=0, bytes_out=0, seconds=0.0):
+        with self._lock:
+            entry = self._ops[op]
+            entry['calls'] += 1
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['seconds'] += seconds
+
+    def wait(self, seconds):
+        # Sleeps for a modelled latency
+        if seconds > 0 and self.latency_scale > 0:
+            time.sleep(seconds * self.latency_scale)
+
+    def snapshot(self):
+        # Returns a copy of the counters
+        with self._lock:
+            return {op: dict(entry) for op, entry in self._ops.items()}
+
+    @staticmethod
+    def diff(after, before):
+        # Counters of the operations between two snapshots
+        ops = {}
+        for op, entry in after.items():
+            base = before.get(op, {})
+            delta = {k: v - base.get(k, 0) for k, v in entry.items()}
+            if delta['calls']:
+                ops[op] = delta
+        return ops
+
+# Helper timing one fake operation
+class _Operation:
+    def __init__(self, stats, op):
+        self.stats = stats
+        self.op = op
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.op, self.bytes_in, self.bytes_out, time.perf_counter() - self.started)
+
+# Helper estimating the size of a request or response payload
+def _payload_size(value):
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return len(json.dumps(value, default=str))
+
+# In-memory Blob Storage (BlobServiceClient)
+class FakeBlobServiceClient:
+    def __init__(self, stats):
+        self.stats = stats
+        self._blobs = {}  # (container, name) -> (bytes, version)
+        self._version = 0  # Versions (ETags) are never reused, even after a delete
+        self._run = uuid.uuid4().hex[:8]  # ETags also differ between runs (local vector files are cached by ETag)
+        self._lock = threading.Lock()
+
+    def get_container_client(self, container):
+        return FakeContainerClient(self, container)
+
+    def put(self, container, name, data, etag=None):
+        # Stores a blob without counting it as a service call (test data setup); with an etag,
+        # only if the blob still has that ETag. Returns the new ETag
+        with self._lock:
+            if etag is not None:
+                current = self._blobs.get((container, name))
+                if current is None or f'"{self._run}-{current[1]}"' != etag:
+                    raise ResourceModifiedError(f"Blob changed: {name}")
+            self._version += 1
+            self._blobs[(container, name)] = (bytes(data), self._version)
+            return f'"{self._run}-{self._version}"'
+
+    def read(self, container, name):
+        # Returns (bytes, version) without counting a service call
+        with self._lock:
+            if (container, name) not in self._blobs:
+                raise ResourceNotFoundError(f"Blob not found: {name}")
+            data, version = self._blobs[(container, name)]
+            return data, f"{self._run}-{version}"
+
+    def names(self, container, prefix=''):
+        with self._lock:
+            return sorted(n for c, n in self._blobs if c == container and n.startswith(prefix))
+
+    def delete(self, container, name):
+        with self._lock:
+            if self._blobs.pop((container, name), None) is None:
+                raise ResourceNotFoundError(f"Blob not found: {name}")
+
+    def total_bytes(self, container=None):
+        with self._lock:
+            return sum(len(d) for (c, _), (d, _) in self._blobs.items() if container is None or c == container)
+
+# Container of the in-memory Blob Storage
+class FakeContainerClient:
+    def __init__(self, service, container):
+        self.service = service
+        self.container = container
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self.service, self.container, blob)
+
+    def list_blobs(self, name_starts_with=''):
+        with _Operation(self.service.stats, 'blob.list'):
+            self.service.stats.wait(LATENCIES['blob_request'])
+            return [SimpleNamespace(name=n) for n in self.service.names(self.container, name_starts_with or '')]
+
+    def delete_blob(self, blob):
+        self.get_blob_client(blob).delete_blob()
+
+# Blob of the in-memory Blob Storage
+class FakeBlobClient:
+    def __init__(self, service, container, name):
+        self.service = service
+        self.container = container
+        self.blob_name = name
+        self.url = f"https://fake.blob.core.windows.net/{container}/{name}"
+
+    def upload_blob(self, data, overwrite=False, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        elif not isinstance(data, (bytes, bytearray)):
+            data = data.read()
+        with _Operation(self.service.stats, 'blob.upload') as op:
+            if not overwrite:
+                try:
+                    self.service.read(self.container, self.blob_name)
+                    raise ResourceExistsError(f"Blob exists: {self.blob_name}")
+                except ResourceNotFoundError:
+                    pass
+            op.bytes_in = len(data)
+            self.service.stats.wait(LATENCIES['blob_request'] + LATENCIES['blob_mb'] * len(data) / 1e6)
+            conditional = kwargs.get('match_condition') == MatchConditions.IfNotModified
+            return {'etag': self.service.put(self.container, self.blob_name, data, kwargs['etag'] if conditional else None)}
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        with _Operation(self.service.stats, 'blob.download') as op:
+            data, version = self.service.read(self.container, self.blob_name)
+            if offset is not None:
+                data = data[offset:offset + length if length is not None else None]
+            op.bytes_out = len(data)
+            self.service.stats.wait(LATENCIES['blob_request'] + LATENCIES['blob_mb'] * len(data) / 1e6)
+            return FakeDownloader(data, f'"{version}"')
+
+    def get_blob_properties(self, **kwargs):
+        with _Operation(self.service.stats, 'blob.properties'):
+            data, version = self.service.read(self.container, self.blob_name)
+            self.service.stats.wait(LATENCIES['blob_request'])
+            return SimpleNamespace(etag=f'"{version}"', size=len(data))
+
+    def delete_blob(self, **kwargs):
+        with _Operation(self.service.stats, 'blob.delete'):
+            self.service.stats.wait(LATENCIES['blob_request'])
+            self.service.delete(self.container, self.blob_name)
+
+    def exists(self, **kwargs):
+        try:
+            self.get_blob_properties()
+            return True
+        except ResourceNotFoundError:
+            return False
+
+# Download stream of the in-memory Blob Storage
+class FakeDownloader:
+    def __init__(self, data, etag):
+        self._data = data
+        self.size = len(data)
+        self.properties = SimpleNamespace(etag=etag, size=len(data))
+
+    def readall(self):
+        return self._data
+
+    def readinto(self, stream):
+        stream.write(self._data)
+        return len(self._data)
+
+    def chunks(self):
+        return (self._data[i:i + 4 * 1024 * 1024] for i in range(0, len(self._data), 4 * 1024 * 1024))
+
+# Encodes page texts as a synthetic "PDF" blob
+def encode_synthetic_pdf(pages, headings=None):
+    """
+    Args:
+        pages: List of page texts
+        headings: Optional dict {page index: [heading texts]} reported as layout headings
+    Returns:
+        Bytes read back by FakeDocumentAnalysisClient
+    """
+    return SYNTHETIC_PDF_HEADER + json.dumps({'pages': pages, 'headings': headings or {}}).encode('utf-8')
+
+# Document Intelligence (DocumentAnalysisClient) reading synthetic PDFs from the fake Blob Storage
+class FakeDocumentAnalysisClient:
+    def __init__(self, stats, blob_service):
+        self.stats = stats
+        self.blob_service = blob_service
+
+    def begin_analyze_document_from_url(self, model, document_url, pages=None, **kwargs):
+        with _Operation(self.stats, 'document_intelligence.analyze') as op:
+            container, name = document_url.split('://', 1)[-1].split('/', 2)[1:]
+            data, _ = self.blob_service.read(container, name)
+            document = json.loads(data[len(SYNTHETIC_PDF_HEADER):])
+            first, last = 1, len(document['pages'])
+            if pages:
+                first, last = (int(p) for p in pages.split('-'))
+            if first > len(document['pages']):
+                error = HttpResponseError(message=f"InvalidArgument: pages {pages} out of range")
+                error.status_code = 400
+                raise error
+            texts = document['pages'][first - 1:last]
+            op.bytes_out = sum(len(t) for t in texts)
+            self.stats.wait(LATENCIES['analyze_request'] + LATENCIES['analyze_page'] * len(texts))
+            return SimpleNamespace(result=lambda: _analyze_result(texts, document['headings'], first))
+
+# Helper building a Document Intelligence result for a page range
+def _analyze_result(texts, headings, first):
+    result_pages = [
+        SimpleNamespace(page_number=first + i, lines=[SimpleNamespace(content=line) for line in text.split('\n')])
+        for i, text in enumerate(texts)
+    ]
+    paragraphs = [
+        SimpleNamespace(role='sectionHeading', content=heading, bounding_regions=[SimpleNamespace(page_number=first + i)])
+        for i in range(len(texts)) for heading in headings.get(str(first - 1 + i), [])
+    ]
+    return SimpleNamespace(pages=result_pages, paragraphs=paragraphs)
+
+# Deterministic embedding: hashed bag of words, L2-normalized
+def fake_embedding(text, dimensions=1536):
+    # Texts sharing words are similar; this is not a semantic model
+    vector = [0.0] * dimensions
+    for word in re.findall(r'\w+', text.lower()):
+        vector[zlib.crc32(word.encode('utf-8')) % dimensions] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+# OpenAI client with the interface the backend calls (chat_completion, create_embedding(s))
+class FakeOpenAIClient:
+    def __init__(self, stats, dimensions=1536):
+        self.stats = stats
+        self.dimensions = dimensions
+
+    def chat_completion(self, prompt=None, messages=None, model=None, stream=False, **kwargs):
+        with _Operation(self.stats, 'openai.chat') as op:
+            request = prompt if prompt is not None else messages
+            op.bytes_in = _payload_size(request)
+            self.stats.wait(LATENCIES['chat'])
+            answer = self._answer(prompt, messages)
+            op.bytes_out = _payload_size(answer)
+        if stream:
+            return iter([word + ' ' for word in answer.split(' ')])
+        return answer
+
+    def create_embedding(self, text):
+        return self.create_embeddings([text])[0]
+
+    def create_embeddings(self, texts):
+        with _Operation(self.stats, 'openai.embeddings') as op:
+            op.bytes_in = sum(_payload_size(t) for t in texts)
+            self.stats.wait(LATENCIES['embedding_request'] + LATENCIES['embedding_input'] * len(texts))
+            vectors = [fake_embedding(t, self.dimensions) for t in texts]
+            op.bytes_out = len(vectors) * self.dimensions * 4
+            return vectors
+
+    # Helper producing a deterministic completion
+    def _answer(self, prompt, messages):
+        if prompt is not None and 'Return a JSON list of numbers' in prompt:
+            # Chapter scoring: one score per numbered summary
+            count = len(re.findall(r'^\d+\. ', prompt, re.MULTILINE))
+            return json.dumps([5 - i % 5 for i in range(count)])
+        text = messages[-1]['content'] if messages else (prompt or '')
+        if text.startswith('Summarize: '):
+            # A summary: the first words of the sampled text
+            return ' '.join(text[len('Summarize: '):].split()[:60])
+        return 'This is a synthetic answer based on the retrieved context.'
+
+# Azure AI Search client over an in-memory document set
+class FakeSearchClient:
+    def __init__(self, stats):
+        self.stats = stats
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def merge_or_upload_documents(self, documents):
+        with _Operation(self.stats, 'search.upload') as op:
+            op.bytes_in = _payload_size(documents)
+            self.stats.wait(LATENCIES['search_request'])
+            with self._lock:
+                for doc in documents:
+                    self._docs[doc['id']] = dict(self._docs.get(doc['id'], {}), **doc)
+        return [SimpleNamespace(key=d['id'], succeeded=True) for d in documents]
+
+    def upload_documents(self, documents):
+        return self.merge_or_upload_documents(documents)
+
+    def delete_documents(self, documents):
+        with _Operation(self.stats, 'search.delete') as op:
+            op.bytes_in = _payload_size(documents)
+            self.stats.wait(LATENCIES['search_request'])
+            with self._lock:
+                for doc in documents:
+                    self._docs.pop(doc['id'], None)
+        return [SimpleNamespace(key=d['id'], succeeded=True) for d in documents]
+
+    def search(self, search_text=None, vector_queries=None, filter=None, top=None, **kwargs):
+        # Exact cosine search; the filter is applied to doc_id only
+        with _Operation(self.stats, 'search.query') as op:
+            self.stats.wait(LATENCIES['search_request'])
+            doc_id = re.search(r"doc_id eq '((?:[^']|'')*)'", filter or '')
+            doc_id = doc_id.group(1).replace("''", "'") if doc_id else None
+            with self._lock:
+                docs = [d for d in self._docs.values() if doc_id is None or d.get('doc_id') == doc_id]
+            results = []
+            if vector_queries:
+                query = vector_queries[0].vector
+                k = top or vector_queries[0].k_nearest_neighbors
+                scored = sorted(docs, key=lambda d: -sum(a * b for a, b in zip(query, d.get('embedding') or [])))
+                results = [dict(d, **{'@search.score': 1.0}) for d in scored[:k]]
+            op.bytes_out = _payload_size([{k: v for k, v in r.items() if k != 'embedding'} for r in results])
+            return results
+
+    def __len__(self):
+        return len(self._docs)
+
+# Azure AI Search index management client
+class FakeSearchIndexClient:
+    def __init__(self, stats):
+        self.stats = stats
+        self.indexes = {}
+
+    def create_or_update_index(self, index):
+        self.stats.record('search.create_index')
+        self.indexes[index.name] = index
+        return index
+
+# Azure Storage queue client
+class FakeQueueClient:
+    def __init__(self, stats):
+        self.stats = stats
+        self.messages = []
+
+    def create_queue(self):
+        self.stats.record('queue.create')
+
+    def send_message(self, content):
+        with _Operation(self.stats, 'queue.send') as op:
+            op.bytes_in = _payload_size(content)
+            self.stats.wait(LATENCIES['queue_request'])
+            self.messages.append(content)
+
+# A set of fakes sharing one Blob Storage and one ServiceStats
+class FakeAzure:
+    """
+    Creates the fakes and installs them behind the shared/azure_clients.py factories,
+    so the functions run unchanged against them.
+    """
+
+    def __init__(self, latency_scale=0.0, dimensions=1536):
+        self.stats = ServiceStats(latency_scale)
+        self.blob = FakeBlobServiceClient(self.stats)
+        self.openai = FakeOpenAIClient(self.stats, dimensions)
+        self.search = FakeSearchClient(self.stats)
+        self.search_index = FakeSearchIndexClient(self.stats)
+        self.document_intelligence = FakeDocumentAnalysisClient(self.stats, self.blob)
+        self.queue = FakeQueueClient(self.stats)
+
+    def install(self):
+        # Every factory returns the same fake, whatever its connection arguments
+        override_clients({
+            'blob': lambda *args: self.blob,
+            'openai': lambda *args: self.openai,
+            'search': lambda *args: self.search,
+            'search_index': lambda *args: self.search_index,
+            'document_intelligence': lambda *args: self.document_intelligence,
+            'queue': lambda *args: self.queue
+        })
+        return self
+
+    def uninstall(self):
+        override_clients({kind: None for kind in ('blob', 'openai', 'search', 'search_index', 'document_intelligence', 'queue')})
@@ -0,0 +1,213 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import azure.functions as func
+from .fakes import FakeAzure, ServiceStats, encode_synthetic_pdf
+
+# Benchmarks the upload and chat functions end to end against in-memory Azure fakes.
+# Run from the repository root: python -m backend.benchmarks.pipeline [--pages 10 100 1000 5000]
+
+# Container and account of the fake Blob Storage
+BENCHMARK_CONTAINER = 'readpilot-bench'
+BENCHMARK_ACCOUNT_URL = 'https://fake.blob.core.windows.net'
+# Topics of the synthetic chapters (each chapter's pages repeat its topic's words)
+TOPICS = [
+    'astronomy orbit telescope', 'botany leaf photosynthesis', 'chemistry molecule reaction', 'geology rock sediment',
+    'economics market inflation', 'history empire treaty', 'music harmony rhythm', 'medicine vaccine immune',
+    'computing algorithm compiler', 'ecology habitat species', 'physics energy momentum', 'linguistics grammar syntax'
+]
+FILLER = 'the of and a to in is that for it as with was on be by this are from or an which'.split()
+
+# Builds a synthetic book with a TOC and chapters
+def synthetic_book(page_count, seed=0):
+    """
+    Builds page texts of about 2 KB each: a title page, a TOC with dot leaders, and chapters
+    whose first page starts with a 'Chapter N' heading (also reported as a layout heading).
+    Args:
+        page_count: Total number of pages (at least 3)
+        seed: Random seed
+    Returns:
+        Tuple (pages, headings, chapter topics)
+    """
+    rng = random.Random(seed)
+    page_count = max(3, page_count)
+    chapter_pages = max(2, min(20, page_count // 8))
+    chapters = max(1, (page_count - 2) // chapter_pages)
+    toc_page_count = (chapters + 39) // 40
+    body_pages = page_count - 1 - toc_page_count
+    chapters = max(1, min(chapters, body_pages // chapter_pages))
+    topics = [TOPICS[i % len(TOPICS)] for i in range(chapters)]
+    toc_lines = [f"Chapter {i + 1} {topics[i].split()[0].title()} {'.' * 12} {i * chapter_pages + 1}" for i in range(chapters)]
+    pages = ['Synthetic Book\nBenchmark edition']
+    pages += ['Contents\n' + '\n'.join(toc_lines[i:i + 40]) for i in range(0, chapters, 40)]
+    headings = {}
+    for p in range(body_pages):
+        chapter = min(p // chapter_pages, chapters - 1)
+        words = topics[chapter].split()
+        paragraphs = []
+        for _ in range(4):
+            paragraphs.append(' '.join(rng.choice(words) if rng.random() < 0.2 else rng.choice(FILLER) for _ in range(80)).capitalize() + '.')
+        text = '\n\n'.join(paragraphs) + f"\n{p + 1}"
+        if p == chapter * chapter_pages:
+            heading = f"Chapter {chapter + 1} {words[0].title()}"
+            headings[str(len(pages))] = [heading]
+            text = heading + '\n' + text
+        pages.append(text)
+    return pages, headings, topics
+
+# Sets the environment read by the functions at import time
+def configure_environment(args):
+    os.environ.update({
+        'BLOB_CONN_STR': 'fake',
+        'BLOB_CONTAINER': BENCHMARK_CONTAINER,
+        'BLOB_ACCOUNT_URL': BENCHMARK_ACCOUNT_URL,
+        'OPENAI_API_KEY': 'fake',
+        'OPENAI_ENDPOINT': 'https://fake.openai.azure.com',
+        'FORMRECOGNIZER_ENDPOINT': 'https://fake.cognitiveservices.azure.com',
+        'FORMRECOGNIZER_KEY': 'fake',
+        'AI_SEARCH_ENDPOINT': 'https://fake.search.windows.net',
+        'AI_SEARCH_KEY': 'fake',
+        'EXTRACTOR': 'document_intelligence',
+        'JOB_QUEUE_BACKEND': 'local',
+        'RETRIEVER_BACKEND': args.retriever,
+        'EAGER_INDEXING': 'true' if args.eager else 'false',
+        'EMBEDDING_DIMENSIONS': str(args.dimensions),
+        # Fake embeddings are not semantic: route to the top chapters whatever their similarity
+        'ROUTING_MIN_SIMILARITY': '0'
+    })
+
+# Helper calling an HTTP function with a JSON body
+def call_function(module, payload):
+    request = func.HttpRequest(method='POST', url='/api/bench', body=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    response = module.main(request)
+    body = response.get_body()
+    if response.status_code >= 400:
+        raise RuntimeError(f"{module.__name__} returned {response.status_code}: {body[:200]!r}")
+    return response, body
+
+# Helper measuring one phase: wall time, service counters and peak traced memory
+def measure(fake, fn, trace_memory):
+    """
+    Args:
+        fake: FakeAzure whose counters are read
+        fn: Function running the phase
+        trace_memory: Whether to record the Python heap peak (slows the phase down)
+    Returns:
+        Tuple (fn result, metrics dict)
+    """
+    before = fake.stats.snapshot()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    ops = ServiceStats.diff(fake.stats.snapshot(), before)
+    return result, {
+        'wall_s': round(wall, 4),
+        'peak_mb': round(peak / 1e6, 2) if peak is not None else None,
+        'calls': {op: entry['calls'] for op, entry in ops.items()},
+        'bytes_in': sum(entry['bytes_in'] for entry in ops.values()),
+        'bytes_out': sum(entry['bytes_out'] for entry in ops.values()),
+        'service_s': {op: round(entry['seconds'], 4) for op, entry in ops.items()}
+    }
+
+# Runs the upload and a series of chat queries for one document size
+def run_document(page_count, args, functions):
+    """
+    Args:
+        page_count: Pages of the synthetic document
+        args: Parsed command line arguments
+        functions: Dict of imported function modules
+    Returns:
+        Result dict with the upload and chat phase metrics
+    """
+    fake = FakeAzure(latency_scale=args.latency_scale, dimensions=args.dimensions).install()
+    pages, headings, topics = synthetic_book(page_count, seed=page_count)
+    blob_name = f"bench-{page_count}.pdf"
+    fake.blob.put(BENCHMARK_CONTAINER, blob_name, encode_synthetic_pdf(pages, headings))
+
+    (_, body), upload = measure(fake, lambda: call_function(functions['upload'], {'blob_name': blob_name, 'sync': True}), args.memory)
+    result = json.loads(body)
+    job = json.loads(fake.blob.read(BENCHMARK_CONTAINER, f"jobs/{result['job_id']}.json")[0])
+    upload['stages_s'] = {
+        name: round(stage['finished_at'] - stage['started_at'], 4)
+        for name, stage in job['stages'].items() if stage.get('finished_at')
+    }
+    upload['sections'] = len(result['knowledge_map'])
+
+    # Cold query (chapters chunked and embedded on demand), another topic, then a repeat (answer cache)
+    queries = [
+        ('chat_cold', f"What does the book say about {topics[0].split()[1]}?"),
+        ('chat_other', f"Explain {topics[len(topics) // 2].split()[1]} in this book."),
+        ('chat_repeat', f"What does the book say about {topics[0].split()[1]}?")
+    ]
+    phases = {'upload': upload}
+    for name, query in queries:
+        (_, answer), metrics = measure(fake, lambda q=query: call_function(functions['chat'], {'query': q, 'blob_name': blob_name}), args.memory)
+        answer = json.loads(answer)
+        metrics['cache_hit'] = bool(answer.get('cache', {}).get('hit'))
+        metrics['routing_ms'] = (answer.get('routing') or {}).get('elapsed_ms')
+        phases[name] = metrics
+    fake.uninstall()
+    return {
+        'pages': len(pages),
+        'document_bytes': sum(len(p) for p in pages),
+        'stored_bytes': fake.blob.total_bytes(BENCHMARK_CONTAINER),
+        'phases': phases
+    }
+
+# Helper formatting a byte count
+def _mb(count):
+    return f"{count / 1e6:.2f}"
+
+# Prints the results as tables
+def print_report(results):
+    print(f"{'pages':>6} {'phase':<12} {'wall s':>8} {'peak MB':>8} {'MB in':>7} {'MB out':>7}  calls")
+    for result in results:
+        for phase, m in result['phases'].items():
+            calls = ', '.join(f"{op}={n}" for op, n in sorted(m['calls'].items()))
+            peak = f"{m['peak_mb']:.1f}" if m['peak_mb'] is not None else '-'
+            print(f"{result['pages']:>6} {phase:<12} {m['wall_s']:>8.3f} {peak:>8} {_mb(m['bytes_in']):>7} {_mb(m['bytes_out']):>7}  {calls}")
+        stages = ', '.join(f"{name}={seconds:.3f}s" for name, seconds in result['phases']['upload']['stages_s'].items())
+        print(f"{'':>6} {'stages':<12} {stages}")
+        print(f"{'':>6} {'storage':<12} {_mb(result['stored_bytes'])} MB stored for {_mb(result['document_bytes'])} MB of text, "
+              f"{result['phases']['upload']['sections']} sections")
+
+# Runs the benchmark for each document size
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks upload and chat against in-memory Azure fakes.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000, 5000], help='Document sizes in pages')
+    parser.add_argument('--latency-scale', type=float, default=0.0, help='Multiplier of the modelled service latencies (0 = no sleeping, 1 = typical latencies)')
+    parser.add_argument('--retriever', choices=['azure', 'local'], default='local', help='RETRIEVER_BACKEND of the run')
+    parser.add_argument('--eager', action='store_true', help='Embed all chapters at upload (EAGER_INDEXING)')
+    parser.add_argument('--dimensions', type=int, default=1536, help='Size of the fake embeddings')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip tracemalloc (it slows Python code down)')
+    parser.add_argument('--json', help='Also write the results to this JSON file (e.g. to compare runs)')
+    args = parser.parse_args(argv)
+
+    configure_environment(args)
+    # The functions read their settings at import time, so they are imported after configuring
+    package = __package__.rsplit('.', 1)[0]
+    functions = {
+        'upload': importlib.import_module(f"{package}.upload_function.main"),
+        'chat': importlib.import_module(f"{package}.chat_function.main")
+    }
+    results = [run_document(page_count, args, functions) for page_count in args.pages]
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,19 +1,31 @@
 import azure.functions as func
 import os
 import json
-from ..shared.azure_clients import get_blob_client, get_openai_client, get_search_client
-from ..shared.document_analysis import segment_document
-from ..shared.chunking import adaptive_chunking
+import logging
+from contextlib import nullcontext
+from ..shared.azure_clients import get_blob_client, get_openai_client
+from ..shared.embedding_store import section_key
+from ..shared.telemetry import start_trace
+from ..shared.chat_pipeline import (
+    SYSTEM_PROMPT, OPENAI_API_KEY, OPENAI_ENDPOINT, SEARCH_TOP, MAX_SEARCH_TOP, ROUTING_MODE, ANSWER_CACHE_ENABLED,
+    document_artifact_cache, chat_answer_cache, load_knowledge_map, retrieve_candidates, build_context
+)
+from ..shared.sessions import (
+    get_session_store, valid_session_id, open_session, reusable_retrieval, save_retrieval,
+    conversation_messages, record_turn, compress_history
+)
 
-# Environment variables for Azure resources
+# Environment variables for Azure resources (to be set in Azure or local.settings.json)
+# Question answering settings (OpenAI, AI Search, routing, retrieval, context, answer cache) are read by shared/chat_pipeline.py
 BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
 BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')  # Azure OpenAI key
-OPENAI_ENDPOINT = os.environ.get('OPENAI_ENDPOINT')  # Azure OpenAI endpoint
 BLOB_ACCOUNT_URL = os.environ.get('BLOB_ACCOUNT_URL')  # e.g., https://<account>.blob.core.windows.net
-AI_SEARCH_ENDPOINT = os.environ.get('AI_SEARCH_ENDPOINT')  # Azure AI Search endpoint
-AI_SEARCH_KEY = os.environ.get('AI_SEARCH_KEY')  # Azure AI Search key
-AI_SEARCH_INDEX = os.environ.get('AI_SEARCH_INDEX', 'readpilot-chunks')  # Default search index name
+SESSION_STORE = os.environ.get('SESSION_STORE', 'memory')  # 'memory' (per worker), 'file' (local directory) or 'blob' (shared by all instances)
+SESSION_DIR = os.environ.get('SESSION_DIR') or None  # Directory of the 'file' session store (default: <tmp>/readpilot-sessions)
+SESSION_TTL = float(os.environ.get('SESSION_TTL', '86400'))  # Seconds of inactivity after which a session starts over
+SESSION_MAX_SESSIONS = int(os.environ.get('SESSION_MAX_SESSIONS', '1024'))  # Sessions kept by the 'memory' store
+SESSION_HISTORY_TURNS = int(os.environ.get('SESSION_HISTORY_TURNS', '6'))  # Turns kept verbatim before older ones are summarized
+SESSION_REUSE_SIMILARITY = float(os.environ.get('SESSION_REUSE_SIMILARITY', '0.8'))  # Query similarity for a follow-up to reuse the last retrieval
 
 # Helper to construct blob URL from blob name
 def construct_blob_url(blob_name):
@@ -32,43 +44,94 @@ def download_blob_as_bytes(blob_client, container, blob_name):
     blob = blob_client.get_container_client(container).get_blob_client(blob_name)
     return blob.download_blob().readall()
 
-# LLM-based chapter/section scoring using GPT-4
-def llm_score_sections(query, knowledge_map, gpt_client):
+# Helper to format one server-sent event
+def format_sse(event, data):
+    # Each event is an 'event:' line plus a single JSON 'data:' line, terminated by a blank line
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Generates the answer as server-sent events, one per GPT delta as it arrives
+def iter_answer_events(gpt_client, messages, references, context_sections, extra=None, on_answer=None, trace=None):
     """
-    Uses GPT-4 to rate each chapter summary for relevance to the query.
-    Returns a priority queue: list of (score, index) tuples, sorted descending.
+    Yields the answer as server-sent events, in this order (lazily: each token event is
+    yielded as soon as its delta arrives, so a host that streams the body can send it at once):
+    - 'meta': {references, context_sections, ...extra}, sent before any generation so the UI can show sources first
+    - 'token': {text}, one per answer delta as it arrives from GPT
+    - 'done': {answer}, the full answer text (plus 'timings' if the request asked for them)
+    - 'error': {message}, instead of 'done' if generation fails after the first events
+    Args:
+        gpt_client: AzureOpenAI client; chat_completion(..., stream=True) yields text deltas
+        messages: Chat messages for the completion
+        references: Reference dicts for the frontend
+        context_sections: Names of the chapters used as context
+        extra: Optional additional fields for the 'meta' event (e.g. routing)
+        on_answer: Optional callback receiving the full response payload once the answer is complete
+        trace: Optional Trace of the request (see shared/telemetry.py)
     """
-    summaries = [section['summary'] for section in knowledge_map]
-    # Build a batch prompt for efficiency
-    prompt = (
-        "Given the following user question and a list of chapter summaries, "
-        "rate each summary from 1 (not relevant) to 5 (highly relevant) for answering the question. "
-        "Return a JSON list of numbers in the same order as the summaries.\n\n"
-        f"User question: {query}\n\n"
-        "Summaries:\n" +
-        "\n".join(f"{i+1}. {s}" for i, s in enumerate(summaries))
-    )
-    scores_str = gpt_client.chat_completion(prompt=prompt, model="gpt-4")
+    payload = {'references': references, 'context_sections': context_sections, **(extra or {})}
+    yield format_sse('meta', payload)
+    parts = []
     try:
-        scores = json.loads(scores_str)
-        if not isinstance(scores, list) or len(scores) != len(summaries):
-            raise ValueError("Invalid LLM output for chapter scores.")
-    except Exception:
-        # Fallback: if LLM output is not valid JSON, treat all as low relevance
-        scores = [1] * len(summaries)
-    # Build a priority queue (list of tuples: (score, index)), sorted descending
-    pq = sorted([(score, i) for i, score in enumerate(scores)], reverse=True)
-    return pq
-
-# Helper to extract real text for selected chapters from pre-extracted pages
-def extract_chapter_texts(pages, sections):
-    # For each selected section, extract the text from start_page to end_page (inclusive)
-    chapter_texts = []
-    for section in sections:
-        # Extract text from start_page to end_page (inclusive)
-        text = '\n'.join(pages[section['start_page']:section['end_page']])
-        chapter_texts.append(text)
-    return chapter_texts
+        with _span(trace, 'generate'):
+            for delta in gpt_client.chat_completion(messages=messages, model="gpt-4", stream=True):
+                if delta:
+                    parts.append(delta)
+                    yield format_sse('token', {'text': delta})
+    except Exception as e:
+        # Earlier events may already be sent, so report the failure in-band
+        logging.exception("Answer generation failed after the first events")
+        yield format_sse('error', {'message': str(e)})
+        return
+    answer = ''.join(parts)
+    if on_answer is not None:
+        on_answer({'answer': answer, **payload})
+    yield format_sse('done', trace.attach({'answer': answer}) if trace else {'answer': answer})
+
+# Helper to open a stage span of the request's trace, if any
+def _span(trace, name):
+    return trace.span(name, stage=True) if trace else nullcontext()
+
+# Helper to wrap a response payload in an HTTP response (JSON or events)
+def render_answer(payload, events=False, trace=None):
+    """
+    Renders a complete response payload ({answer, references, context_sections, ...}).
+    Used for answers that are already known, e.g. answer cache hits.
+    The request's timings are added if it asked for them (in the 'done' event with events).
+    """
+    if events:
+        meta = {k: v for k, v in payload.items() if k != 'answer'}
+        done = {'answer': payload['answer']}
+        body = (
+            format_sse('meta', meta) +
+            format_sse('token', {'text': payload['answer']}) +
+            format_sse('done', trace.attach(done) if trace else done)
+        )
+        return func.HttpResponse(body, mimetype="text/event-stream", headers={'Cache-Control': 'no-cache'}, status_code=200)
+    if trace:
+        payload = trace.attach(payload)
+    return func.HttpResponse(json.dumps(payload), mimetype="application/json", status_code=200)
+
+# Helper to generate the answer and wrap it in the HTTP response (JSON or events)
+def answer_response(gpt_client, messages, references, context_sections, events=False, extra=None, on_answer=None, trace=None):
+    if events:
+        # The v1 Python programming model cannot stream a response body, so the events are sent
+        # in one response: this only changes the format, not the time to the first token
+        return func.HttpResponse(
+            ''.join(iter_answer_events(gpt_client, messages, references, context_sections, extra, on_answer, trace)),
+            mimetype="text/event-stream",
+            headers={'Cache-Control': 'no-cache'},
+            status_code=200
+        )
+    with _span(trace, 'generate'):
+        answer = gpt_client.chat_completion(messages=messages, model="gpt-4")
+    payload = {
+        'answer': answer,
+        'references': references,
+        'context_sections': context_sections,
+        **(extra or {})
+    }
+    if on_answer is not None:
+        on_answer(payload)
+    return render_answer(payload, trace=trace)
 
 # Main Azure Function entry point
 def main(req: func.HttpRequest) -> func.HttpResponse:
@@ -76,13 +139,31 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     HTTP POST endpoint for user chat queries.
     Steps:
     1. Parse JSON payload for query and document reference.
-    2. Load knowledge map and pre-extracted pages from Blob Storage.
-    3. Use LLM to score and prioritize chapters/sections.
-    4. Extract real text for those chapters.
-    5. Chunk, vectorize, and store/query in Azure AI Search.
-    6. Retrieve top relevant chunks for context.
+    2. Load the knowledge map from Blob Storage and check the answer cache.
+    3. Route the query to chapters/sections (summary embeddings or GPT-4 scoring).
+    4. Read pages (byte ranges of the page store) only for chapters not yet in the chunk/embedding index.
+    5. Chunk and vectorize new chapters, store them, and query the retriever (AI Search or local vectors).
+    6. Assemble the context from the retrieved candidates (merged, deduplicated, packed into
+       CONTEXT_TOKEN_BUDGET; see shared/context_assembly.py) and build references.
     7. Generate and return the answer using GPT, with references.
+    An optional "top" sets the maximum number of context passages (default SEARCH_TOP), and "routing"
+    ('embedding' or 'llm') overrides ROUTING_MODE; the response includes the routing scores and time,
+    and a "context" block with the candidates, merges, duplicates and tokens used.
+    Repeated or near-duplicate questions are answered from the answer cache unless "cache": false;
+    the response's "cache" block reports whether it was a hit and the cache counters.
+    If the payload sets "events": true, the answer is returned in the server-sent event format
+    (see iter_answer_events) instead of a single JSON object; the body is still sent in one piece.
+    With a "session_id" (8-64 letters, digits, '-' or '_'), the request is a turn of a conversation kept
+    in the session store (SESSION_STORE, see shared/sessions.py): recent turns are sent to GPT as chat
+    history and older ones as a summary, follow-ups may leave out the document, and a follow-up on the
+    topic of the last retrieval reuses its chapters and chunks. The response's "session" block reports
+    the turn number and whether retrieval was reused.
+    With "timings": true the response adds a "timings" block: per-stage and per-call times, call,
+    byte and estimated token counters (see shared/telemetry.py). Failures return a JSON 500
+    {error, type, stage, trace_id}.
     """
+    # Telemetry is off unless requested or exported, then the trace only tracks the current stage
+    trace = start_trace('chat')
     try:
         # 1. Parse JSON payload
         try:
@@ -90,9 +171,33 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         except ValueError:
             # If the request body is not valid JSON, return an error
             return func.HttpResponse("Invalid JSON payload.", status_code=400)
+        if data.get('timings'):
+            trace.record_timings()
         query = data.get('query')
         blob_url = data.get('blob_url')
         blob_name = data.get('blob_name')
+        events = bool(data.get('events'))
+        use_cache = ANSWER_CACHE_ENABLED and data.get('cache', True) is not False
+        routing_mode = data.get('routing', ROUTING_MODE)
+        if routing_mode not in ('embedding', 'llm'):
+            return func.HttpResponse("'routing' must be 'embedding' or 'llm'.", status_code=400)
+        try:
+            top = min(max(int(data.get('top', SEARCH_TOP)), 1), MAX_SEARCH_TOP)
+        except (TypeError, ValueError):
+            return func.HttpResponse("'top' must be an integer.", status_code=400)
+        session_id = data.get('session_id')
+        session_store = None
+        if session_id is not None:
+            if not valid_session_id(session_id):
+                return func.HttpResponse("'session_id' must be 8-64 letters, digits, '-' or '_'.", status_code=400)
+            session_store = get_session_store(
+                SESSION_STORE, blob_client=get_blob_client(BLOB_CONN_STR), container=BLOB_CONTAINER,
+                directory=SESSION_DIR, ttl_seconds=SESSION_TTL, max_sessions=SESSION_MAX_SESSIONS
+            )
+            if not blob_url and not blob_name:
+                # Follow-ups may leave out the document; the session remembers it
+                known = session_store.load(session_id)
+                blob_name = known.get('blob_name') if known else None
         if not query or (not blob_url and not blob_name):
             # Require both a query and a document reference
             return func.HttpResponse("Must provide 'query' and either 'blob_url' or 'blob_name' in payload.", status_code=400)
@@ -103,113 +208,98 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             # If only blob_url is provided, extract the blob name from the URL
             blob_name = blob_url.split('/')[-1]
 
-        # 2. Load knowledge map and pre-extracted pages from Blob Storage
-        blob_client = get_blob_client(BLOB_CONN_STR)
-        map_blob_name = blob_name + '.knowledge_map.json'
-        pages_blob_name = blob_name + '.pages.json'
-        knowledge_map_json = download_blob_as_text(blob_client, BLOB_CONTAINER, map_blob_name)
-        knowledge_map = json.loads(knowledge_map_json)
-        pages_json = download_blob_as_text(blob_client, BLOB_CONTAINER, pages_blob_name)
-        pages = json.loads(pages_json)
+        # 2. Load the knowledge map from Blob Storage (or the in-memory artifact cache while its ETag is unchanged);
+        # the ETag also versions the document for the answer cache
+        with trace.span('load_map', stage=True) as span:
+            blob_client = get_blob_client(BLOB_CONN_STR)
+            artifact_cache = document_artifact_cache()
+            # Uploads with the same content share their artifacts under content/<sha256> (see shared/content_store.py)
+            doc_name, knowledge_map, map_etag = load_knowledge_map(blob_client, blob_name, artifact_cache)
+            span.set(sections=len(knowledge_map))
 
-        # 3. Use LLM to score and prioritize chapters/sections
+        # Session of a multi-turn conversation (a session about another document starts over)
+        session = open_session(session_store, session_id, doc_name, blob_name) if session_store is not None else None
+        history = bool(session and (session['turns'] or session['summary']))
+
+        def remember(answer, sections):
+            # Records the turn, folds older turns into the summary and saves the session
+            if session is None:
+                return
+            record_turn(session, query, answer, [section_key(s) for s in sections])
+            with trace.span('compress_history'):
+                compress_history(session, gpt_client, SESSION_HISTORY_TURNS)
+            session_store.save(session)
+
+        # Answer cache: exact match on the normalized query before any model call
+        # (answers to follow-ups depend on the conversation, so sessions with history skip it)
+        cache = chat_answer_cache() if use_cache and not history else None
+        cache_version = f"{map_etag}|{routing_mode}|{top}"
         gpt_client = get_openai_client(OPENAI_API_KEY, OPENAI_ENDPOINT)
-        pq = llm_score_sections(query, knowledge_map, gpt_client)
-        # Only consider chapters with score >= 3 (configurable threshold)
-        relevant_indices = [i for score, i in pq if score >= 3]
-        if not relevant_indices:
-            # If no chapter is relevant, let the LLM handle the response with system prompt and no context
-            system_prompt = (
-                "You are ReadPilot, an AI copilot that helps users understand, summarize, and answer questions about their book or document. "
-                "If the user asks a general question or greeting, introduce yourself and explain your capabilities. "
-                "If the question is about the document, answer using the provided context. If you don't know, say so politely."
-            )
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": query}
-            ]
-            answer = gpt_client.chat_completion(messages=messages, model="gpt-4")
-            return func.HttpResponse(
-                json.dumps({
-                    'answer': answer,
-                    'references': [],
-                    'context_sections': []
-                }),
-                mimetype="application/json",
-                status_code=200
+        if cache is not None:
+            cached, match = cache.get(doc_name, cache_version, query)
+            if cached is not None:
+                remember(cached['answer'], [])
+                return render_answer({**cached, 'cache': {'hit': True, 'match': match, **cache.stats()}}, events, trace)
+
+        # The query embedding is computed once and reused for the cache, routing and retrieval
+        with trace.span('embed_query', stage=True):
+            query_embedding = gpt_client.create_embedding(query)
+        if cache is not None:
+            # Near-duplicate questions hit the cache by query-embedding similarity
+            cached, match = cache.get(doc_name, cache_version, query, query_embedding)
+            if cached is not None:
+                remember(cached['answer'], [])
+                return render_answer({**cached, 'cache': {'hit': True, 'match': match, **cache.stats()}}, events, trace)
+
+        # 3-5. Route and retrieve, unless a follow-up in the session is on the topic of its last retrieval
+        reused, similarity = None, None
+        if session is not None:
+            reused, similarity = reusable_retrieval(session, map_etag, query_embedding, SESSION_REUSE_SIMILARITY)
+        if reused is not None:
+            # The chapters and candidate chunks are reused; only the context is assembled again for the new question
+            sections_by_key = {section_key(s): s for s in knowledge_map}
+            selected_sections = [sections_by_key[k] for k in reused['sections'] if k in sections_by_key]
+            results = reused['results']
+            routing = {'mode': 'session', 'elapsed_ms': 0.0, 'scores': [], 'similarity': similarity}
+        else:
+            selected_sections, results, routing = retrieve_candidates(
+                query, query_embedding, knowledge_map, doc_name, gpt_client, blob_client, artifact_cache, routing_mode, top, trace
             )
-        # Build a priority queue of relevant sections
-        selected_sections = [knowledge_map[i] for i in relevant_indices]
-
-        # 4. Extract real text for those chapters
-        chapter_texts = extract_chapter_texts(pages, selected_sections)
-
-        # 5. Chunk, vectorize, and store/query in Azure AI Search
-        search_client = get_search_client(AI_SEARCH_ENDPOINT, AI_SEARCH_KEY, AI_SEARCH_INDEX)
-        all_chunks = []
-        chunk_metadata = []
-        for text, section in zip(chapter_texts, selected_sections):
-            # Adaptive chunking (by headers, paragraphs, etc.)
-            chunks = adaptive_chunking(text, structure=None)  # returns list of dicts
-            for c in chunks:
-                chunk = c['chunk']
-                meta = {
-                    'chunk': chunk,
-                    'chapter': section['chapter_name'],
-                    'start_page': section.get('start_page'),
-                    'end_page': section.get('end_page'),
-                    'start_offset': c.get('start_offset'),
-                    'end_offset': c.get('end_offset')
-                }
-                embedding = gpt_client.create_embedding(chunk)
-                doc = {
-                    'id': f"{blob_name}_{section['start_page']}_{section['end_page']}_{c.get('start_offset',0)}",
-                    'chunk': chunk,
-                    'embedding': embedding,
-                    'chapter': section['chapter_name'],
-                    'doc_id': blob_name,
-                    'start_page': meta['start_page'],
-                    'end_page': meta['end_page']
-                }
-                search_client.upload_documents([doc])
-                all_chunks.append(doc)
-                chunk_metadata.append(meta)
-        # Query Azure AI Search for top relevant chunks
-        query_embedding = gpt_client.create_embedding(query)
-        results = search_client.search("*", vector=query_embedding, top=3)
-        context = '\n'.join([r['chunk'] for r in results])
-
-        # 6. Generate answer using GPT with system prompt and context
-        system_prompt = (
-            "You are ReadPilot, an AI copilot that helps users understand, summarize, and answer questions about their book or document. "
-            "If the user asks a general question or greeting, introduce yourself and explain your capabilities. "
-            "If the question is about the document, answer using the provided context. If you don't know, say so politely."
-        )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
-        ]
-        answer = gpt_client.chat_completion(messages=messages, model="gpt-4")
+            if session is not None and selected_sections:
+                save_retrieval(session, map_etag, [section_key(s) for s in selected_sections], query_embedding, results)
+        extra = {'routing': routing}
+        if cache is not None:
+            extra['cache'] = {'hit': False, 'match': None, **cache.stats()}
+        if session is not None:
+            extra['session'] = {
+                'id': session['session_id'],
+                'turn': session['summarized_turns'] + len(session['turns']) + 1,
+                'reused': reused is not None,
+                'similarity': similarity
+            }
 
-        # 7. Build references for the frontend
-        references = []
-        for r in results:
-            references.append({
-                'chunk': r['chunk'],
-                'chapter': r.get('chapter'),
-                'start_page': r.get('start_page'),
-                'end_page': r.get('end_page')
-            })
+        def on_answer(payload):
+            if cache is not None:
+                cache.put(doc_name, cache_version, query, query_embedding, {k: v for k, v in payload.items() if k not in ('cache', 'session')})
+            remember(payload['answer'], selected_sections)
+        if not selected_sections:
+            # If no chapter is relevant, let the LLM handle the response with system prompt and no context
+            messages = conversation_messages(SYSTEM_PROMPT, session, query)
+            return answer_response(gpt_client, messages, [], [], events, extra, on_answer, trace)
 
-        return func.HttpResponse(
-            json.dumps({
-                'answer': answer,
-                'references': references,
-                'context_sections': [s['chapter_name'] for s in selected_sections]
-            }),
-            mimetype="application/json",
-            status_code=200
-        )
+        # 6. Merge overlapping chunks, drop near-duplicates and pack the best passages into the token budget
+        with trace.span('assemble_context', stage=True) as span:
+            context, references, context_report = build_context(results, query, top)
+            extra['context'] = context_report
+            span.set(**context_report)
+
+        # 7. Generate answer using GPT with system prompt, conversation history and context (as events if requested)
+        messages = conversation_messages(SYSTEM_PROMPT, session, f"Context:\n{context}\n\nQuestion: {query}")
+        return answer_response(gpt_client, messages, references, [s['chapter_name'] for s in selected_sections], events, extra, on_answer, trace)
     except Exception as e:
-        # Return error details for debugging
-        return func.HttpResponse(f"Error: {str(e)}", status_code=500) 
\ No newline at end of file
+        # Log the traceback and report the failing stage; the trace id matches the exported spans
+        logging.exception("Chat request failed in stage %s", trace.stage)
+        trace.finish(e)
+        return func.HttpResponse(json.dumps(trace.error_payload(e)), mimetype="application/json", status_code=500)
+    finally:
+        trace.finish()
@@ -0,0 +1,2 @@
+# This file marks the directory as a Python package for Azure Functions.
+# It is intentionally left empty. 
\ No newline at end of file
@@ -0,0 +1,256 @@
+import azure.functions as func
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceNotFoundError
+from ..shared.azure_clients import get_blob_client, get_openai_client
+from ..shared.routing import embedding_score_sections, select_routed_sections
+from ..shared.telemetry import start_trace
+from ..shared.library import (
+    valid_library_id, empty_library, load_library, save_library, writable_library, document_entry, score_documents
+)
+from ..shared.chat_pipeline import (
+    OPENAI_API_KEY, OPENAI_ENDPOINT, SEARCH_TOP, MAX_SEARCH_TOP, ROUTING_TOP_K, ROUTING_MIN_SIMILARITY, CONTEXT_TOKEN_BUDGET,
+    document_artifact_cache, load_knowledge_map, prepare_retriever, search_candidates, build_context
+)
+
+# Environment variables for Azure resources (to be set in Azure or local.settings.json)
+# Question answering settings (OpenAI, AI Search, routing, retrieval, context) are read by shared/chat_pipeline.py
+BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
+LIBRARY_TOP_DOCUMENTS = int(os.environ.get('LIBRARY_TOP_DOCUMENTS', '3'))  # Documents searched chunk by chunk after the summary stage
+LIBRARY_MIN_SIMILARITY = float(os.environ.get('LIBRARY_MIN_SIMILARITY', '0.75'))  # Minimum summary similarity of a document's best chapter
+LIBRARY_MAX_DOCUMENTS = int(os.environ.get('LIBRARY_MAX_DOCUMENTS', '500'))  # Maximum documents in one library
+MAX_TOP_DOCUMENTS = 10  # Upper bound for a per-request 'top_documents'
+
+# System prompt of answers drawing on several documents
+LIBRARY_SYSTEM_PROMPT = (
+    "You are ReadPilot, an AI copilot that helps users find and understand information across their library of books and documents. "
+    "The context is grouped by document. Answer using the provided context and name the documents your answer draws on. "
+    "If none of the documents covers the question, say so politely."
+)
+
+# Helper to check the 'blob_names' of a library payload
+def parse_blob_names(blob_names):
+    """
+    Args:
+        blob_names: Value of the payload's 'blob_names' (None if absent)
+    Returns:
+        Tuple (blob_names, error): the list of names (or None), or None and an error message
+    """
+    if blob_names is None:
+        return None, None
+    if not isinstance(blob_names, list) or not all(isinstance(n, str) and n for n in blob_names):
+        return None, "'blob_names' must be a list of blob names."
+    if len(blob_names) > LIBRARY_MAX_DOCUMENTS:
+        return None, f"At most {LIBRARY_MAX_DOCUMENTS} documents per library."
+    return list(dict.fromkeys(blob_names)), None
+
+# Brings a library's documents in line with a list of blob names
+def sync_library(library, blob_names, blob_client, gpt_client, artifact_cache):
+    """
+    Documents not in blob_names are dropped; new ones are added from their knowledge maps.
+    Args:
+        library: Library dict
+        blob_names: Blob names of the documents the library should hold
+        blob_client: BlobServiceClient instance
+        gpt_client: OpenAI client wrapper (summary embeddings of older knowledge maps)
+        artifact_cache: ArtifactCache or None
+    Returns:
+        Tuple (library, changed, skipped): skipped lists the blob names without a knowledge map
+        (not uploaded or still being processed)
+    """
+    added = [name for name in blob_names if name not in library['documents']]
+    removed = [name for name in library['documents'] if name not in blob_names]
+    if not added and not removed:
+        return library, False, []
+    library = writable_library(library)
+    for name in removed:
+        del library['documents'][name]
+    skipped = []
+    for name in added:
+        try:
+            doc_name, knowledge_map, map_etag = load_knowledge_map(blob_client, name, artifact_cache)
+        except ResourceNotFoundError:
+            skipped.append(name)
+            continue
+        library['documents'][name] = document_entry(doc_name, knowledge_map, map_etag, gpt_client)
+    return library, True, skipped
+
+# Fine stage of library search: routes, retrieves and assembles the context within one document
+def search_document(blob_name, entry, ranking, query, query_embedding, top, token_budget, gpt_client, blob_client, artifact_cache, trace):
+    """
+    The document's chapters are selected from its summary ranking (ROUTING_TOP_K chapters of at
+    least ROUTING_MIN_SIMILARITY, and at least its best chapter), then searched like /chat does.
+    Args:
+        blob_name: Blob name of the document
+        entry: Its library entry
+        ranking: Its chapter ranking from the summary stage
+        query: User query
+        query_embedding: Embedding of the query
+        top: Maximum passages from this document
+        token_budget: Maximum context tokens from this document
+        gpt_client: OpenAI client wrapper
+        blob_client: BlobServiceClient instance
+        artifact_cache: ArtifactCache or None
+        trace: Trace of the request
+    Returns:
+        Tuple (document, context, refreshed_entry): document is the response entry
+        {blob_name, score, chapters, context_sections, references, context}; refreshed_entry is
+        the new library entry if the document was re-uploaded since it was added, else None.
+        document and context are None if the re-uploaded document has no chapters left.
+        None if the document no longer exists.
+    """
+    with trace.span('search_document', blob_name=blob_name):
+        try:
+            doc_name, knowledge_map, map_etag = load_knowledge_map(blob_client, blob_name, artifact_cache)
+        except ResourceNotFoundError:
+            return None
+        refreshed = None
+        if map_etag != entry['map_etag']:
+            # A re-upload changes the chapters, so the entry and the ranking are rebuilt from the new map
+            refreshed = document_entry(doc_name, knowledge_map, map_etag, gpt_client)
+            if not refreshed['chapters']:
+                # The new map has no chapters: the document is skipped, but its entry is still refreshed
+                return None, None, refreshed
+            ranking = embedding_score_sections(query_embedding, [{'summary_embedding': c['embedding']} for c in refreshed['chapters']])
+        indices, _ = select_routed_sections(ranking, top_k=ROUTING_TOP_K, min_similarity=ROUTING_MIN_SIMILARITY)
+        indices = indices or [ranking[0][1]]
+        sections = [knowledge_map[i] for i in indices]
+        retriever, embedding_index = prepare_retriever(sections, doc_name, gpt_client, blob_client, artifact_cache, trace)
+        with trace.span('retrieve', stage=True, top=top):
+            results = search_candidates(retriever, embedding_index, query_embedding, sections, doc_name, top)
+        context, references, report = build_context(results, query, top, token_budget)
+    scores = dict((i, score) for score, i in ranking)
+    document = {
+        'blob_name': blob_name,
+        'score': round(ranking[0][0], 4),
+        'chapters': [{'chapter': knowledge_map[i]['chapter_name'], 'score': round(scores[i], 4)} for i in indices],
+        'context_sections': [s['chapter_name'] for s in sections],
+        'references': references,
+        'context': report
+    }
+    return document, context, refreshed
+
+# Main Azure Function entry point
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    HTTP POST endpoint searching and answering across a user's library of documents.
+    Payload: {"query", "library_id" and/or "blob_names", optional "top", "top_documents", "answer", "timings"}.
+    - "library_id" (8-64 letters, digits, '-' or '_') names a library index stored at libraries/<library_id>.json;
+      "blob_names" sets its documents (documents are added from their knowledge maps, others dropped).
+      With "blob_names" only, the library is built for the request and not stored.
+    Steps:
+    1. Load the library index: one summary embedding per chapter of every document.
+    2. Summary stage: score all chapters of the library with one matrix product and keep the
+       top_documents (LIBRARY_TOP_DOCUMENTS) documents whose best chapter reaches LIBRARY_MIN_SIMILARITY.
+    3. Chunk stage, per kept document and concurrently: select its chapters, index them if needed,
+       retrieve candidates and assemble its share of CONTEXT_TOKEN_BUDGET.
+    4. Unless "answer": false, generate one answer over the per-document contexts.
+    The response lists the documents best first, each with its score, chapters and references, plus
+    a "library" block (documents, chapters, searched documents, whether the index was updated, skipped blobs).
+    """
+    trace = start_trace('library')
+    try:
+        try:
+            data = req.get_json()
+        except ValueError:
+            return func.HttpResponse("Invalid JSON payload.", status_code=400)
+        if data.get('timings'):
+            trace.record_timings()
+        query = data.get('query')
+        library_id = data.get('library_id')
+        blob_names, error = parse_blob_names(data.get('blob_names'))
+        if error:
+            return func.HttpResponse(error, status_code=400)
+        if library_id is not None and not valid_library_id(library_id):
+            return func.HttpResponse("'library_id' must be 8-64 letters, digits, '-' or '_'.", status_code=400)
+        if not query or (library_id is None and not blob_names):
+            return func.HttpResponse("Must provide 'query' and either 'library_id' or 'blob_names' in payload.", status_code=400)
+        try:
+            top = min(max(int(data.get('top', SEARCH_TOP)), 1), MAX_SEARCH_TOP)
+            top_documents = min(max(int(data.get('top_documents', LIBRARY_TOP_DOCUMENTS)), 1), MAX_TOP_DOCUMENTS)
+        except (TypeError, ValueError):
+            return func.HttpResponse("'top' and 'top_documents' must be integers.", status_code=400)
+
+        # 1. Load the library index and bring it in line with 'blob_names'
+        blob_client = get_blob_client(BLOB_CONN_STR)
+        artifact_cache = document_artifact_cache()
+        gpt_client = get_openai_client(OPENAI_API_KEY, OPENAI_ENDPOINT)
+        with trace.span('load_library', stage=True) as span:
+            library = load_library(blob_client, BLOB_CONTAINER, library_id, artifact_cache) if library_id else empty_library()
+            changed, skipped = False, []
+            if blob_names is not None:
+                library, changed, skipped = sync_library(library, blob_names, blob_client, gpt_client, artifact_cache)
+            span.set(documents=len(library['documents']), changed=changed)
+        if not library['documents']:
+            return func.HttpResponse("The library has no processed documents.", status_code=404)
+
+        # 2. Summary stage over the whole library
+        with trace.span('embed_query', stage=True):
+            query_embedding = gpt_client.create_embedding(query)
+        with trace.span('rank_documents', stage=True) as span:
+            ranked = score_documents(library, query_embedding, top_documents, LIBRARY_MIN_SIMILARITY)
+            span.set(selected=len(ranked))
+
+        # 3. Chunk stage inside the kept documents only, each with its share of the token budget
+        token_budget = CONTEXT_TOKEN_BUDGET // max(1, len(ranked))
+        with ThreadPoolExecutor(max_workers=max(1, len(ranked))) as executor:
+            found = list(executor.map(
+                lambda item: search_document(
+                    item[1], library['documents'][item[1]], item[2], query, query_embedding, top, token_budget,
+                    gpt_client, blob_client, artifact_cache, trace
+                ),
+                ranked
+            ))
+        documents, contexts, updates = [], [], {}
+        for (_, blob_name, _), result in zip(ranked, found):
+            if result is None:
+                # The document was deleted since it was added
+                updates[blob_name] = None
+                continue
+            document, context, refreshed = result
+            if refreshed is not None:
+                updates[blob_name] = refreshed
+            if document is None:
+                continue
+            documents.append(document)
+            contexts.append(f"Document: {blob_name}\n{context}")
+        if updates:
+            # Deleted documents are dropped and re-uploaded ones refreshed in the stored index
+            library = writable_library(library)
+            for blob_name, entry in updates.items():
+                if entry is None:
+                    library['documents'].pop(blob_name, None)
+                else:
+                    library['documents'][blob_name] = entry
+            changed = True
+
+        # 4. One answer over the contexts of all kept documents
+        payload = {}
+        if data.get('answer', True) is not False:
+            with trace.span('generate', stage=True):
+                content = "Context:\n" + "\n\n".join(contexts) + f"\n\nQuestion: {query}" if contexts else query
+                messages = [{"role": "system", "content": LIBRARY_SYSTEM_PROMPT}, {"role": "user", "content": content}]
+                payload['answer'] = gpt_client.chat_completion(messages=messages, model="gpt-4")
+        if changed and library_id:
+            with trace.span('save_library', stage=True):
+                save_library(blob_client, BLOB_CONTAINER, library)
+        payload['documents'] = documents
+        payload['library'] = {
+            'id': library_id,
+            'documents': len(library['documents']),
+            'chapters': sum(len(entry['chapters']) for entry in library['documents'].values()),
+            'searched': len(documents),
+            'updated': bool(changed and library_id),
+            'skipped': skipped
+        }
+        return func.HttpResponse(json.dumps(trace.attach(payload)), mimetype="application/json", status_code=200)
+    except Exception as e:
+        # Log the traceback and report the failing stage; the trace id matches the exported spans
+        logging.exception("Library request failed in stage %s", trace.stage)
+        trace.finish(e)
+        return func.HttpResponse(json.dumps(trace.error_payload(e)), mimetype="application/json", status_code=500)
+    finally:
+        trace.finish()
@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# In-process answer cache with TTL, LRU eviction and similarity lookup
+class AnswerCache:
+    """
+    Caches chat answers per document version and normalized query.
+    - Exact lookup: (doc_id, version, normalized query).
+    - Similarity lookup: the most similar cached query embedding for the same doc_id and version,
+      if its cosine similarity is at least similarity_threshold and both queries have the same key
+      terms (numbers and names, see query_terms): embeddings of "summarize chapter 3" and "summarize
+      chapter 4" are nearly identical, but their answers are not.
+    Entries expire after ttl_seconds; the least recently used entry is evicted beyond max_entries.
+    Safe to share between threads of one worker process.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, similarity_threshold=0.98):
+        """
+        Args:
+            max_entries: Maximum number of cached answers
+            ttl_seconds: Time to live of an entry in seconds
+            similarity_threshold: Minimum cosine similarity for a near-duplicate hit (> 1 disables it)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def get(self, doc_id, version, query, query_embedding=None):
+        """
+        Looks up an answer, exactly first and then by query similarity if an embedding is given.
+        Misses are only counted when query_embedding is given (the final lookup of a request).
+        Args:
+            doc_id: Document id
+            version: Document version (e.g. knowledge map ETag plus answer options)
+            query: User query
+            query_embedding: Optional query embedding for the similarity lookup
+        Returns:
+            Tuple (response dict, match) with match 'exact' or 'similar', or (None, None)
+        """
+        key = (doc_id, version, normalize_query(query))
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry['response'], 'exact'
+            if query_embedding is None:
+                return None, None
+            best_key = self._most_similar(doc_id, version, query, query_embedding)
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                self.similar_hits += 1
+                return self._entries[best_key]['response'], 'similar'
+            self.misses += 1
+            return None, None
+
+    def put(self, doc_id, version, query, query_embedding, response):
+        """
+        Stores an answer.
+        Args:
+            doc_id: Document id
+            version: Document version
+            query: User query
+            query_embedding: Query embedding (list of floats), or None
+            response: JSON-serializable response dict
+        """
+        key = (doc_id, version, normalize_query(query))
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            embedding = embedding / norm if norm else embedding
+        with self._lock:
+            self._entries[key] = {
+                'response': response, 'embedding': embedding, 'terms': query_terms(query),
+                'expires': time.monotonic() + self.ttl_seconds
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, doc_id):
+        # Drops every entry of a document, e.g. when it is reprocessed
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == doc_id]:
+                del self._entries[key]
+
+    def stats(self):
+        # Hit/miss counters and current size
+        with self._lock:
+            return {'hits': self.hits, 'similar_hits': self.similar_hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    # Helper to drop expired entries (caller holds the lock)
+    def _evict_expired(self, now):
+        for key in [k for k, e in self._entries.items() if e['expires'] <= now]:
+            del self._entries[key]
+
+    # Helper to find the most similar cached query of a document version (caller holds the lock)
+    def _most_similar(self, doc_id, version, query, query_embedding):
+        if self.similarity_threshold > 1:
+            return None
+        terms = query_terms(query)
+        keys = [
+            k for k, e in self._entries.items()
+            if k[0] == doc_id and k[1] == version and e['embedding'] is not None and e['terms'] == terms
+        ]
+        if not keys:
+            return None
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        similarities = np.stack([self._entries[k]['embedding'] for k in keys]) @ vector
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+# Normalizes a query for exact cache lookups
+def normalize_query(query):
+    # Case, surrounding punctuation and repeated whitespace do not change the question
+    return re.sub(r'\s+', ' ', query.strip().lower()).strip(' ?!.')
+
+# Extracts the terms two questions must share to have the same answer
+def query_terms(query):
+    """
+    Numbers (digits, number words, roman numerals after chapter/part/section/volume/book) and
+    names (capitalized words after the first word, acronyms, quoted phrases). Query embeddings
+    barely change when only these differ, so a similarity hit requires them to be equal.
+    Args:
+        query: User query
+    Returns:
+        Frozenset of lowercased terms
+    """
+    terms = set(re.findall(r'\d+(?:[.,]\d+)*', query))
+    terms.update(w for w in re.findall(r'[a-z]+', query.lower()) if w in _NUMBER_WORDS)
+    terms.update(m.lower() for m in re.findall(r'\b(?:chapter|part|section|volume|book)\s+([ivxlc]+)\b', query, re.IGNORECASE))
+    terms.update(q.strip().lower() for q in re.findall(r'"([^"]+)"', query))
+    words = re.findall(r"[A-Za-z][\w'-]*", query)
+    terms.update(w.lower() for w in words[1:] if w[0].isupper() and w != 'I')
+    return frozenset(terms)
+
+# Spelled-out numbers and ordinals (query_terms)
+_NUMBER_WORDS = frozenset(
+    'zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen '
+    'seventeen eighteen nineteen twenty thirty forty fifty hundred thousand first second third fourth fifth '
+    'sixth seventh eighth ninth tenth last'.split()
+)
+
+# Process-wide cache shared by the functions of this app
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+# Returns the process-wide answer cache, creating it on first use
+def get_answer_cache(max_entries=256, ttl_seconds=3600, similarity_threshold=0.98):
+    # The arguments only apply to the first call, which creates the cache
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(max_entries, ttl_seconds, similarity_threshold)
+        return _answer_cache
+
+# Returns the process-wide answer cache if a chat request has created it, else None
+def existing_answer_cache():
+    # For callers that only invalidate: creating the cache here would fix its settings to the defaults
+    with _answer_cache_lock:
+        return _answer_cache
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+# In-memory cache of downloaded artifacts, bounded by total size
+class ArtifactCache:
+    """
+    LRU cache of values derived from blobs (parsed knowledge maps, page store ranges, ...).
+    Keys include the blob ETag, so a rewritten blob is never served from a stale entry.
+    The sum of the entries' sizes (the downloaded byte counts) stays below max_bytes.
+    Cached values are shared between invocations and must not be mutated by callers.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Upper bound for the total size of cached entries
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        # Returns the cached value or None, marking it as recently used
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        # Stores a value of the given size; values larger than the whole cache are not kept
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def invalidate(self, container, blob_name):
+        # Drops every entry of a blob (keys start with (container, blob_name))
+        with self._lock:
+            for key in [k for k in self._entries if k[:2] == (container, blob_name)]:
+                self.total_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self.total_bytes}
+
+# Downloads and parses a blob, reusing the cached value while the blob's ETag is unchanged
+def load_blob(cache, blob_client, container, blob_name, parse=None):
+    """
+    Loads a blob through the artifact cache.
+    A cheap properties request checks the current ETag; the blob is only downloaded
+    (and parsed) if no entry exists for that ETag.
+    Args:
+        cache: ArtifactCache instance, or None to always download
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the blob
+        parse: Optional function turning the downloaded bytes into the cached value
+    Returns:
+        Tuple (value, etag)
+    Raises:
+        azure.core.exceptions.ResourceNotFoundError if the blob does not exist
+    """
+    blob = blob_client.get_container_client(container).get_blob_client(blob_name)
+    parse = parse or (lambda data: data)
+    if cache is not None:
+        etag = blob.get_blob_properties().etag
+        value = cache.get((container, blob_name, etag))
+        if value is not None:
+            return value, etag
+    downloader = blob.download_blob()
+    data = downloader.readall()
+    etag = downloader.properties.etag
+    value = parse(data)
+    if cache is not None:
+        cache.put((container, blob_name, etag), value, len(data))
+    return value, etag
+
+# Process-wide cache shared by warm invocations
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+
+# Returns the process-wide artifact cache, creating it on first use
+def get_artifact_cache(max_bytes=256 * 1024 * 1024):
+    # The argument only applies to the first call, which creates the cache
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache(max_bytes)
+        return _artifact_cache
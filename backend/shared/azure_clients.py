@@ -1,26 +1,86 @@
+import threading
+
 # Import Azure SDK clients for Form Recognizer (Document Intelligence), Blob Storage, OpenAI, and Search
 from azure.ai.formrecognizer import DocumentAnalysisClient  # For extracting text/structure from PDFs
 from azure.core.credentials import AzureKeyCredential  # For authenticating Azure SDK clients
 from azure.storage.blob import BlobServiceClient  # For accessing Azure Blob Storage
 from openai import AzureOpenAI  # For calling Azure OpenAI (GPT-4, embeddings)
 from azure.search.documents import SearchClient  # For Azure AI Search (vector search)
+from azure.search.documents.indexes import SearchIndexClient  # For managing the AI Search index schema
+from .telemetry import instrument_client  # Records calls in the current request's trace (see shared/telemetry.py)
+
+# Clients are created once per process and reused across warm invocations, keeping their
+# connection pools (and TLS sessions) alive. All of these SDK clients are thread-safe.
+# While a request is traced, the factories return proxies of the pooled clients that time each call.
+_clients = {}
+_clients_lock = threading.Lock()
+# Factories replacing the SDK clients of a kind (e.g. the offline fakes of benchmarks/fakes.py)
+_overrides = {}
+
+# Helper to return the pooled client for a key, creating it on first use
+def _pooled(key, create):
+    # key[0] is the client kind, the rest are the factory's arguments
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            override = _overrides.get(key[0])
+            client = override(*key[1:]) if override else create()
+            _clients[key] = client
+    return instrument_client(key[0], client)
+
+# Drops all pooled clients (e.g. after rotating keys)
+def reset_clients():
+    with _clients_lock:
+        _clients.clear()
+
+# Replaces the SDK clients of some kinds with other implementations
+def override_clients(factories):
+    """
+    Installs client factories in place of the Azure SDK constructors, for offline runs.
+    Args:
+        factories: Dict {kind: factory or None}. Kinds are 'document_intelligence', 'blob', 'openai',
+            'search', 'search_index' and 'queue'; a factory takes the arguments of the matching
+            get_*_client function, and None restores the SDK client.
+    """
+    with _clients_lock:
+        for kind, factory in factories.items():
+            if factory is None:
+                _overrides.pop(kind, None)
+            else:
+                _overrides[kind] = factory
+        # Clients created before must not be served anymore
+        _clients.clear()
 
 # Factory for Document Intelligence (Form Recognizer) client
 def get_document_intelligence_client(endpoint, key):
-    # Returns a DocumentAnalysisClient for the given endpoint and key
-    return DocumentAnalysisClient(endpoint, AzureKeyCredential(key))
+    # Returns the pooled DocumentAnalysisClient for the given endpoint and key
+    return _pooled(('document_intelligence', endpoint, key), lambda: DocumentAnalysisClient(endpoint, AzureKeyCredential(key)))
 
 # Factory for Blob Storage client
 def get_blob_client(conn_str):
-    # Returns a BlobServiceClient for the given connection string
-    return BlobServiceClient.from_connection_string(conn_str)
+    # Returns the pooled BlobServiceClient for the given connection string
+    return _pooled(('blob', conn_str), lambda: BlobServiceClient.from_connection_string(conn_str))
 
 # Factory for Azure OpenAI client
 def get_openai_client(api_key, endpoint):
-    # Returns an AzureOpenAI client for the given API key and endpoint
-    return AzureOpenAI(api_key=api_key, api_base=endpoint)
+    # Returns the pooled AzureOpenAI client for the given API key and endpoint
+    return _pooled(('openai', api_key, endpoint), lambda: AzureOpenAI(api_key=api_key, api_base=endpoint))
 
 # Factory for Azure AI Search client
 def get_search_client(endpoint, key, index_name):
-    # Returns a SearchClient for the given endpoint, key, and index name
-    return SearchClient(endpoint, AzureKeyCredential(key), index_name=index_name) 
\ No newline at end of file
+    # Returns the pooled SearchClient for the given endpoint, key, and index name
+    return _pooled(('search', endpoint, key, index_name), lambda: SearchClient(endpoint, AzureKeyCredential(key), index_name=index_name))
+
+# Factory for Azure AI Search index management client
+def get_search_index_client(endpoint, key):
+    # Returns the pooled SearchIndexClient for creating/updating index schemas
+    return _pooled(('search_index', endpoint, key), lambda: SearchIndexClient(endpoint, AzureKeyCredential(key)))
+
+# Factory for Azure Storage queue client (upload job queue)
+def get_queue_client(conn_str, queue_name):
+    # Imported here: only the upload functions ship azure-storage-queue
+    from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+    # Queue-triggered functions expect base64-encoded messages by default
+    return _pooled(('queue', conn_str, queue_name), lambda: QueueClient.from_connection_string(
+        conn_str, queue_name, message_encode_policy=TextBase64EncodePolicy()
+    ))
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .azure_clients import get_search_client
+from .embedding_store import load_embedding_index, save_embedding_index, writable_embedding_index, has_section, build_section_documents, section_key
+from .retrieval import AzureSearchRetriever
+from .vector_store import open_local_retriever
+from .routing import embedding_score_sections, embedding_score_queries, select_routed_sections, has_summary_embeddings
+from .answer_cache import get_answer_cache
+from .page_store import open_page_store
+from .artifact_cache import get_artifact_cache, load_blob
+from .chunking import join_pages
+from .content_store import resolve_artifact_name
+from .context_assembly import attach_offsets, assemble_context, format_context
+
+# Environment variables for Azure resources and question answering (shared by the chat and batch functions)
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')  # Azure OpenAI key
+OPENAI_ENDPOINT = os.environ.get('OPENAI_ENDPOINT')  # Azure OpenAI endpoint
+AI_SEARCH_ENDPOINT = os.environ.get('AI_SEARCH_ENDPOINT')  # Azure AI Search endpoint
+AI_SEARCH_KEY = os.environ.get('AI_SEARCH_KEY')  # Azure AI Search key
+AI_SEARCH_INDEX = os.environ.get('AI_SEARCH_INDEX', 'readpilot-chunks')  # Default search index name
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '16'))  # Texts per embedding request
+SEARCH_UPLOAD_BATCH_SIZE = int(os.environ.get('SEARCH_UPLOAD_BATCH_SIZE', '500'))  # Documents per AI Search indexing request
+INDEXING_CONCURRENCY = int(os.environ.get('INDEXING_CONCURRENCY', '4'))  # Embedding/indexing requests in flight at once
+RETRIEVER_BACKEND = os.environ.get('RETRIEVER_BACKEND', 'azure')  # 'azure' (AI Search) or 'local' (in-process vectors)
+LOCAL_SEARCH_MODE = os.environ.get('LOCAL_SEARCH_MODE', 'auto')  # 'exact', 'approximate' or 'auto' for the local backend
+SEARCH_TOP = int(os.environ.get('SEARCH_TOP', '3'))  # Default number of passages in the answer context
+MAX_SEARCH_TOP = 50  # Upper bound for a per-request 'top'
+ROUTING_MODE = os.environ.get('ROUTING_MODE', 'embedding')  # 'embedding' (summary similarity) or 'llm' (GPT-4 scoring)
+ROUTING_TOP_K = int(os.environ.get('ROUTING_TOP_K', '3'))  # Maximum chapters selected by embedding routing
+ROUTING_MIN_SIMILARITY = float(os.environ.get('ROUTING_MIN_SIMILARITY', '0.75'))  # Minimum summary similarity for a chapter to be relevant
+ROUTING_TIE_BREAK = os.environ.get('ROUTING_TIE_BREAK', 'false').lower() == 'true'  # Ask GPT-4 to order chapters with near-equal similarity
+ROUTING_TIE_MARGIN = float(os.environ.get('ROUTING_TIE_MARGIN', '0.01'))  # Similarity difference treated as a tie
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'  # Reuse answers to repeated questions
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '256'))  # Maximum cached answers per worker process
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', '3600'))  # Seconds a cached answer stays valid
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0.98'))  # Query similarity for a near-duplicate hit (key terms must match too)
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # Downloaded artifacts kept in memory (0 = off)
+CHUNK_MAX_SIZE = int(os.environ.get('CHUNK_MAX_SIZE', '1000'))  # Maximum chunk size (characters, or tokens with CHUNK_ENCODING)
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '200'))  # Overlap between windows of oversized paragraphs/sections
+CHUNK_ENCODING = os.environ.get('CHUNK_ENCODING') or None  # tiktoken encoding for token-based sizing, e.g. 'cl100k_base' (unset = characters)
+CONTEXT_CANDIDATES = int(os.environ.get('CONTEXT_CANDIDATES', '12'))  # Chunks retrieved as candidates for context assembly (at least 'top')
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '2000'))  # Maximum tokens of retrieved context in the prompt
+CONTEXT_RERANK = os.environ.get('CONTEXT_RERANK', 'none')  # 'none' (retrieval order) or 'lexical' (blend in query-term overlap)
+CONTEXT_RERANK_WEIGHT = float(os.environ.get('CONTEXT_RERANK_WEIGHT', '0.3'))  # Weight of the lexical score when re-ranking
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))  # Share of shared word trigrams above which a passage is a near-duplicate
+
+# System prompt shared by all answer generations
+SYSTEM_PROMPT = (
+    "You are ReadPilot, an AI copilot that helps users understand, summarize, and answer questions about their book or document. "
+    "If the user asks a general question or greeting, introduce yourself and explain your capabilities. "
+    "If the question is about the document, answer using the provided context. If you don't know, say so politely."
+)
+
+# Helper to return the process-wide artifact cache, or None if ARTIFACT_CACHE_MAX_BYTES is 0
+def document_artifact_cache():
+    return get_artifact_cache(ARTIFACT_CACHE_MAX_BYTES) if ARTIFACT_CACHE_MAX_BYTES > 0 else None
+
+# Helper to return the process-wide answer cache
+def chat_answer_cache():
+    return get_answer_cache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+
+# Loads the knowledge map of a document (from the artifact cache while its ETag is unchanged)
+def load_knowledge_map(blob_client, blob_name, artifact_cache):
+    """
+    Args:
+        blob_client: BlobServiceClient instance
+        blob_name: Blob name of the uploaded document
+        artifact_cache: ArtifactCache or None
+    Returns:
+        Tuple (doc_name, knowledge_map, map_etag); doc_name is the artifact base name (the blob name,
+        or content/<sha256> for deduplicated uploads, see shared/content_store.py) and the ETag
+        versions the document for the answer cache
+    """
+    doc_name = resolve_artifact_name(blob_client, BLOB_CONTAINER, blob_name, artifact_cache)
+    knowledge_map, map_etag = load_blob(
+        artifact_cache, blob_client, BLOB_CONTAINER, doc_name + '.knowledge_map.json', lambda data: json.loads(data.decode('utf-8'))
+    )
+    return doc_name, knowledge_map, map_etag
+
+# LLM-based chapter/section scoring using GPT-4
+def llm_score_sections(query, knowledge_map, gpt_client):
+    """
+    Uses GPT-4 to rate each chapter summary for relevance to the query.
+    Returns a priority queue: list of (score, index) tuples, sorted descending.
+    """
+    summaries = [section['summary'] for section in knowledge_map]
+    # Build a batch prompt for efficiency
+    prompt = (
+        "Given the following user question and a list of chapter summaries, "
+        "rate each summary from 1 (not relevant) to 5 (highly relevant) for answering the question. "
+        "Return a JSON list of numbers in the same order as the summaries.\n\n"
+        f"User question: {query}\n\n"
+        "Summaries:\n" +
+        "\n".join(f"{i+1}. {s}" for i, s in enumerate(summaries))
+    )
+    scores_str = gpt_client.chat_completion(prompt=prompt, model="gpt-4")
+    try:
+        scores = json.loads(scores_str)
+        if not isinstance(scores, list) or len(scores) != len(summaries):
+            raise ValueError("Invalid LLM output for chapter scores.")
+    except Exception:
+        # Fallback: if LLM output is not valid JSON, treat all as low relevance
+        scores = [1] * len(summaries)
+    # Build a priority queue (list of tuples: (score, index)), sorted descending
+    pq = sorted([(score, i) for i, score in enumerate(scores)], reverse=True)
+    return pq
+
+# Routes a query to the most relevant chapters/sections
+def route_sections(query, query_embedding, knowledge_map, gpt_client, mode=ROUTING_MODE, pq=None):
+    """
+    Picks the chapters to retrieve from.
+    - 'embedding': ranks chapters by cosine similarity between the query embedding and the summary
+      embeddings stored in the knowledge map at upload time; GPT-4 is only asked to order
+      near-tied chapters at the cut-off if ROUTING_TIE_BREAK is on.
+    - 'llm': asks GPT-4 to score every summary (llm_score_sections).
+    Knowledge maps without summary embeddings always use 'llm'.
+    An embedding ranking computed beforehand (e.g. by embedding_score_queries for a batch) can be passed as pq.
+    Returns:
+        Tuple (relevant_indices, routing) where routing is {mode, elapsed_ms, scores: [{index, chapter, score}]}
+    """
+    started = time.perf_counter()
+    if mode == 'embedding' and has_summary_embeddings(knowledge_map):
+        if pq is None:
+            pq = embedding_score_sections(query_embedding, knowledge_map)
+        relevant_indices, tied = select_routed_sections(
+            pq, top_k=ROUTING_TOP_K, min_similarity=ROUTING_MIN_SIMILARITY,
+            tie_margin=ROUTING_TIE_MARGIN if ROUTING_TIE_BREAK else 0.0
+        )
+        if tied:
+            # Only the tied chapters go to GPT-4, and only to order them
+            kept = [i for i in relevant_indices if i not in tied]
+            tie_pq = llm_score_sections(query, [knowledge_map[i] for i in tied], gpt_client)
+            relevant_indices = kept + [tied[j] for _, j in tie_pq][:ROUTING_TOP_K - len(kept)]
+            mode = 'embedding+llm'
+        else:
+            mode = 'embedding'
+    else:
+        pq = llm_score_sections(query, knowledge_map, gpt_client)
+        # Only consider chapters with score >= 3 (configurable threshold)
+        relevant_indices = [i for score, i in pq if score >= 3]
+        mode = 'llm'
+    routing = {
+        'mode': mode,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'scores': [{'index': i, 'chapter': knowledge_map[i]['chapter_name'], 'score': score} for score, i in pq]
+    }
+    return relevant_indices, routing
+
+# Routes several queries at once (one matrix product in embedding mode)
+def route_queries(queries, query_embeddings, knowledge_map, gpt_client, mode=ROUTING_MODE, max_workers=1):
+    """
+    Args:
+        queries: List of user queries
+        query_embeddings: Their embeddings, in the same order
+        knowledge_map: Knowledge map entries of the document
+        gpt_client: OpenAI client wrapper (LLM routing and tie-breaks)
+        mode: 'embedding' or 'llm'
+        max_workers: Queries routed at once (only GPT-4 scoring and tie-breaks make calls)
+    Returns:
+        List of (relevant_indices, routing) tuples, one per query (see route_sections)
+    """
+    rankings = [None] * len(queries)
+    if mode == 'embedding' and has_summary_embeddings(knowledge_map):
+        rankings = embedding_score_queries(query_embeddings, knowledge_map)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(
+            lambda item: route_sections(item[0], item[1], knowledge_map, gpt_client, mode, item[2]),
+            zip(queries, query_embeddings, rankings)
+        ))
+
+# Helper to extract real text for selected chapters from pre-extracted pages
+def extract_chapter_texts(pages, sections):
+    # For each selected section, read only its pages from the page store (PageStore or ListPageStore)
+    # Returns (texts, page_starts): the page start offsets let chunks be mapped back to pages
+    chapter_texts = []
+    page_starts = []
+    for section in sections:
+        # Extract text from start_page to end_page (inclusive)
+        text, starts = join_pages(pages.read_range(section['start_page'], section['end_page']))
+        chapter_texts.append(text)
+        page_starts.append(starts)
+    return chapter_texts, page_starts
+
+# Helper to create the retriever selected by RETRIEVER_BACKEND
+def get_retriever(blob_client, blob_name, embedding_index, rebuild=False, artifact_cache=None):
+    """
+    Returns the retriever for a document.
+    Args:
+        blob_client: BlobServiceClient instance
+        blob_name: Artifact base name of the document (its blob name, or content/<sha256>)
+        embedding_index: The document's chunk/embedding index
+        rebuild: True if the index just gained sections (the local vector file must be rebuilt)
+        artifact_cache: ArtifactCache or None (local backend: caches the vector matrix)
+    Returns:
+        AzureSearchRetriever or LocalVectorRetriever
+    """
+    if RETRIEVER_BACKEND == 'local':
+        return open_local_retriever(blob_client, BLOB_CONTAINER, blob_name, embedding_index, rebuild=rebuild, mode=LOCAL_SEARCH_MODE, cache=artifact_cache)
+    search_client = get_search_client(AI_SEARCH_ENDPOINT, AI_SEARCH_KEY, AI_SEARCH_INDEX)
+    return AzureSearchRetriever(search_client, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY)
+
+# Makes sure chapters are chunked, embedded and indexed, and returns the document's retriever
+def prepare_retriever(sections, doc_name, gpt_client, blob_client, artifact_cache, trace):
+    """
+    Args:
+        sections: Knowledge map entries of the chapters to search
+        doc_name: Artifact base name of the document
+        gpt_client: OpenAI client wrapper
+        blob_client: BlobServiceClient instance
+        artifact_cache: ArtifactCache or None
+        trace: Trace of the request
+    Returns:
+        Tuple (retriever, embedding_index)
+    """
+    # Load the persistent chunk/embedding index and extract real text only for chapters not in it yet
+    with trace.span('load_index', stage=True) as span:
+        embedding_index = load_embedding_index(blob_client, BLOB_CONTAINER, doc_name, artifact_cache)
+        new_sections = [s for s in sections if not has_section(embedding_index, s)]
+        span.set(new_sections=len(new_sections))
+    chapter_texts, page_starts = [], []
+    if new_sections:
+        with trace.span('read_pages', stage=True):
+            # The loaded index may be shared through the artifact cache, so new chapters go into a copy
+            embedding_index = writable_embedding_index(embedding_index)
+            # Pages are only needed for chapters that still have to be chunked, and only their byte ranges are read
+            pages = open_page_store(blob_client, BLOB_CONTAINER, doc_name, artifact_cache)
+            chapter_texts, page_starts = extract_chapter_texts(pages, new_sections)
+
+    # Chunk, vectorize, and index new chapters (cached chapters are already indexed)
+    with trace.span('index_chapters', stage=True) as span:
+        docs = build_section_documents(
+            embedding_index, doc_name, new_sections, chapter_texts, gpt_client,
+            batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY, page_starts=page_starts,
+            max_chunk_size=CHUNK_MAX_SIZE, chunk_overlap=CHUNK_OVERLAP, encoding=CHUNK_ENCODING
+        )
+        if new_sections:
+            # Persist the newly embedded chapters so later queries skip them; chapters other requests
+            # saved meanwhile are merged in rather than overwritten
+            embedding_index = save_embedding_index(blob_client, BLOB_CONTAINER, doc_name, embedding_index)
+        retriever = get_retriever(blob_client, doc_name, embedding_index, rebuild=bool(new_sections), artifact_cache=artifact_cache)
+        retriever.index_documents(docs)
+        span.set(chunks=len(docs))
+    return retriever, embedding_index
+
+# Queries a retriever for the candidate chunks of a query within some chapters
+def search_candidates(retriever, embedding_index, query_embedding, sections, doc_name, top):
+    """
+    Retrieves a candidate set larger than the context needs (CONTEXT_CANDIDATES, at least top),
+    scoped to the document and the given chapters.
+    Returns:
+        Results with their chunk offsets (see context_assembly.attach_offsets)
+    """
+    results = retriever.search(
+        query_embedding, top=min(max(top, CONTEXT_CANDIDATES), MAX_SEARCH_TOP), doc_id=doc_name,
+        sections=[section_key(s) for s in sections]
+    )
+    return attach_offsets(results, embedding_index)
+
+# Routes a query to chapters and retrieves candidate chunks from them
+def retrieve_candidates(query, query_embedding, knowledge_map, doc_name, gpt_client, blob_client, artifact_cache, routing_mode, top, trace):
+    """
+    Args:
+        query: User query
+        query_embedding: Embedding of the query
+        knowledge_map: Knowledge map entries of the document
+        doc_name: Artifact base name of the document
+        gpt_client: OpenAI client wrapper
+        blob_client: BlobServiceClient instance
+        artifact_cache: ArtifactCache or None
+        routing_mode: 'embedding' or 'llm'
+        top: Maximum passages of the context (at least as many candidates are retrieved)
+        trace: Trace of the request
+    Returns:
+        Tuple (selected_sections, results, routing); no sections and no results if no chapter is relevant.
+        Results carry their chunk offsets (see context_assembly.attach_offsets).
+    """
+    with trace.span('route', stage=True, mode=routing_mode) as span:
+        relevant_indices, routing = route_sections(query, query_embedding, knowledge_map, gpt_client, routing_mode)
+        span.set(selected=len(relevant_indices))
+    if not relevant_indices:
+        return [], [], routing
+    # Build a priority queue of relevant sections
+    selected_sections = [knowledge_map[i] for i in relevant_indices]
+    retriever, embedding_index = prepare_retriever(selected_sections, doc_name, gpt_client, blob_client, artifact_cache, trace)
+    with trace.span('retrieve', stage=True, top=top) as span:
+        results = search_candidates(retriever, embedding_index, query_embedding, selected_sections, doc_name, top)
+        span.set(results=len(results))
+    return selected_sections, results, routing
+
+# Packs retrieved candidates into the prompt context and builds the references for the frontend
+def build_context(results, query, top, token_budget=None):
+    """
+    Args:
+        results: Candidate chunks from retrieve_candidates or search_candidates
+        query: User query
+        top: Maximum number of passages
+        token_budget: Maximum tokens of the context (default CONTEXT_TOKEN_BUDGET)
+    Returns:
+        Tuple (context, references, report): the context text, reference dicts
+        {chunk, chapter, start_page, end_page} and the context_assembly report
+    """
+    passages, report = assemble_context(
+        results, query, token_budget=token_budget or CONTEXT_TOKEN_BUDGET, max_passages=top,
+        rerank=CONTEXT_RERANK, rerank_weight=CONTEXT_RERANK_WEIGHT,
+        duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD, encoding=CHUNK_ENCODING
+    )
+    references = [
+        {'chunk': p['chunk'], 'chapter': p.get('chapter'), 'start_page': p.get('start_page'), 'end_page': p.get('end_page')}
+        for p in passages
+    ]
+    return format_context(passages), references, report
@@ -1,75 +1,181 @@
 import re
+from bisect import bisect_right
+
+try:
+    import tiktoken  # Optional: token-based chunk sizing
+except ImportError:
+    tiktoken = None
+
+# Regex to detect headers: lines starting with 'Chapter', 'Section', 'Part' (any case), or all-caps lines
+# (case-sensitive, on a single line; ignoring case there would make every long sentence line a header)
+HEADER_PATTERN = re.compile(r'^(?i:chapter|section|part)\b|^[A-Z][A-Z \t\d\-:]{8,}$', re.MULTILINE)
+# Paragraph separator used by the paragraph fallback
+PARAGRAPH_BREAK = re.compile(r'\n\n')
+
+# Joins page texts into one string and records where each page starts
+def join_pages(pages, separator='\n'):
+    """
+    Joins pages like separator.join(pages) and returns the character offset of each page start,
+    for mapping chunk offsets back to pages.
+    Args:
+        pages: List of page texts
+        separator: String placed between pages
+    Returns:
+        Tuple (text, page_starts)
+    """
+    page_starts = []
+    offset = 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page) + len(separator)
+    return separator.join(pages), page_starts
+
+# Returns the function measuring chunk sizes (characters, or tokens of a tiktoken encoding)
+def get_size_function(encoding=None):
+    """
+    Args:
+        encoding: None for characters, or a tiktoken encoding name (e.g. 'cl100k_base')
+    Returns:
+        Tuple (size function, tiktoken encoding or None)
+    Raises:
+        ValueError if an encoding is requested but tiktoken is not installed
+    """
+    if not encoding:
+        return len, None
+    if tiktoken is None:
+        raise ValueError("Token-based chunk sizing requires the tiktoken package.")
+    enc = tiktoken.get_encoding(encoding)
+    return (lambda s: len(enc.encode(s, disallowed_special=()))), enc
+
+# Splits text into chunks lazily, in one pass over the text
+def iter_chunks(text, max_chunk_size=1000, overlap=200, page_offset=0, page_starts=None, encoding=None):
+    """
+    Yields context-aware chunks of text, in document order.
+    - Prefers splitting at detected headers (e.g., 'Chapter', 'Section', all-caps lines).
+    - Falls back to packing paragraphs up to max_chunk_size if fewer than two headers are found.
+    - Pieces still larger than max_chunk_size are split into overlapping windows.
+    Offsets are exact: text[start_offset:end_offset] == chunk for every chunk.
+    Args:
+        text: The full text to chunk (string)
+        max_chunk_size: Maximum chunk size, in characters or in tokens of encoding
+        overlap: Size shared by consecutive windows of an oversized piece (same unit)
+        page_offset: Page number of the first page of text
+        page_starts: Optional sorted character offsets where each page of text starts (see join_pages)
+        encoding: Optional tiktoken encoding name for token-based sizing (matches the embedding model's limit)
+    Yields:
+        Dicts: {chunk, start_offset, end_offset, start_page, end_page}
+    """
+    size, enc = get_size_function(encoding)
+    for start, end in _spans(text, max_chunk_size, size):
+        if size(text[start:end]) <= max_chunk_size:
+            windows = [(start, end)]
+        elif enc is not None:
+            windows = _token_windows(text, start, end, max_chunk_size, overlap, enc)
+        else:
+            windows = _char_windows(start, end, max_chunk_size, overlap)
+        for w_start, w_end in windows:
+            w_start, w_end = _strip_span(text, w_start, w_end)
+            if w_start < w_end:
+                yield _make_chunk(text, w_start, w_end, page_offset, page_starts)
 
 # Splits text into smart, context-aware chunks for vectorization and retrieval
-def adaptive_chunking(text, structure=None, max_chunk_size=1000, overlap=200, page_offset=0, page_map=None):
+def adaptive_chunking(text, structure=None, max_chunk_size=1000, overlap=200, page_offset=0, page_map=None, encoding=None):
     """
     Splits text into smart, context-aware chunks for vectorization and retrieval.
-    Returns a list of dicts: [{chunk, start_page, end_page}]
-    - Prefers splitting at detected headers (e.g., 'Chapter', 'Section', all-caps lines).
-    - Falls back to paragraph or fixed-size chunking if no headers found.
-    - If page_map is provided, maps character offsets to page numbers.
+    List version of iter_chunks, for callers that need all chunks at once.
     Args:
         text: The full text to chunk (string)
         structure: (optional) Structure info from Document Intelligence (not used yet)
-        max_chunk_size: Maximum number of characters per chunk
-        overlap: Number of characters to overlap between chunks
+        max_chunk_size: Maximum chunk size (characters, or tokens if encoding is set)
+        overlap: Overlap between windows of an oversized piece
         page_offset: Offset to add to page numbers (if needed)
-        page_map: Optional list mapping character offsets to page numbers
+        page_map: Optional list of the character offsets where each page starts
+        encoding: Optional tiktoken encoding name for token-based sizing
     Returns:
-        List of dicts: [{chunk, start_page, end_page}]
+        List of dicts: [{chunk, start_offset, end_offset, start_page, end_page}]
     """
-    # Regex to detect headers: lines starting with 'Chapter', 'Section', 'Part', or all-caps lines
-    header_pattern = re.compile(r'^(chapter|section|part)\b|^[A-Z][A-Z\s\d\-:]{8,}$', re.IGNORECASE | re.MULTILINE)
-    header_indices = [m.start() for m in header_pattern.finditer(text)]
-    chunks = []
-    chunk_spans = []
-    if header_indices and len(header_indices) > 1:
-        # If headers are found, split at each header
-        for i in range(len(header_indices)):
-            start = header_indices[i]
-            end = header_indices[i+1] if i+1 < len(header_indices) else len(text)
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-                chunk_spans.append((start, end))
-    else:
-        # If no headers, split by paragraphs or fixed-size windows
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        current = ''
-        start = 0
-        for para in paragraphs:
-            if len(current) + len(para) + 2 <= max_chunk_size:
-                if not current:
-                    start = text.find(para)
-                current += (para + '\n\n')
-            else:
-                if current:
-                    end = start + len(current)
-                    chunks.append(current.strip())
-                    chunk_spans.append((start, end))
-                start = text.find(para, start)
-                current = para + '\n\n'
-        if current:
-            end = start + len(current)
-            chunks.append(current.strip())
-            chunk_spans.append((start, end))
-    final_chunks = []
-    for chunk, (start, end) in zip(chunks, chunk_spans):
-        if len(chunk) <= max_chunk_size:
-            # If the chunk is within the size limit, add as is
-            final_chunks.append({'chunk': chunk, 'start_offset': start, 'end_offset': end})
-        else:
-            # If the chunk is too large, split into overlapping windows
-            for i in range(0, len(chunk), max_chunk_size - overlap):
-                c_start = start + i
-                c_end = min(start + i + max_chunk_size, end)
-                final_chunks.append({'chunk': chunk[i:i+max_chunk_size], 'start_offset': c_start, 'end_offset': c_end})
-    # Map offsets to page numbers if page_map is provided
-    for fc in final_chunks:
-        if page_map:
-            fc['start_page'] = page_map.get(fc['start_offset'], None)
-            fc['end_page'] = page_map.get(fc['end_offset'], None)
-        else:
-            fc['start_page'] = None
-            fc['end_page'] = None
-    return final_chunks 
\ No newline at end of file
+    return list(iter_chunks(text, max_chunk_size, overlap, page_offset, page_map, encoding))
+
+# Helper yielding the (start, end) spans of headed sections or packed paragraphs
+def _spans(text, max_chunk_size, size):
+    headers = HEADER_PATTERN.finditer(text)
+    first, second = next(headers, None), next(headers, None)
+    if second is not None:
+        # Text before the first header is kept as its own piece
+        yield _strip_span(text, 0, first.start())
+        previous = second.start()
+        yield first.start(), previous
+        for match in headers:
+            yield previous, match.start()
+            previous = match.start()
+        yield previous, len(text)
+        return
+    # No headers: pack consecutive paragraphs while they fit
+    current_start = current_end = None
+    current_size = 0
+    for para_start, para_end in _paragraph_spans(text):
+        # The added size includes the gap since the previous paragraph, which stays in the chunk
+        added = size(text[current_end if current_end is not None else para_start:para_end])
+        if current_start is not None and current_size + added <= max_chunk_size:
+            current_end = para_end
+            current_size += added
+            continue
+        if current_start is not None:
+            yield current_start, current_end
+        current_start, current_end = para_start, para_end
+        current_size = size(text[para_start:para_end])
+    if current_start is not None:
+        yield current_start, current_end
+
+# Helper yielding the stripped spans of non-empty paragraphs
+def _paragraph_spans(text):
+    position = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        start, end = _strip_span(text, position, match.start())
+        if start < end:
+            yield start, end
+        position = match.end()
+    start, end = _strip_span(text, position, len(text))
+    if start < end:
+        yield start, end
+
+# Helper splitting a span into overlapping character windows
+def _char_windows(start, end, max_chunk_size, overlap):
+    step = max(1, max_chunk_size - overlap)
+    windows = []
+    for w_start in range(start, end, step):
+        windows.append((w_start, min(w_start + max_chunk_size, end)))
+        if w_start + max_chunk_size >= end:
+            break
+    return windows
+
+# Helper splitting a span into overlapping token windows
+def _token_windows(text, start, end, max_chunk_size, overlap, enc):
+    tokens = enc.encode(text[start:end], disallowed_special=())
+    # Character offset of each token within the span
+    _, offsets = enc.decode_with_offsets(tokens)
+    offsets = list(offsets) + [end - start]
+    step = max(1, max_chunk_size - overlap)
+    windows = []
+    for t_start in range(0, len(tokens), step):
+        t_end = min(t_start + max_chunk_size, len(tokens))
+        windows.append((start + offsets[t_start], start + offsets[t_end]))
+        if t_end == len(tokens):
+            break
+    return windows
+
+# Helper shrinking a span so it excludes surrounding whitespace
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+# Helper building a chunk dict with page numbers found by binary search over page starts
+def _make_chunk(text, start, end, page_offset, page_starts):
+    chunk = {'chunk': text[start:end], 'start_offset': start, 'end_offset': end, 'start_page': None, 'end_page': None}
+    if page_starts:
+        chunk['start_page'] = page_offset + max(0, bisect_right(page_starts, start) - 1)
+        chunk['end_page'] = page_offset + max(0, bisect_right(page_starts, end - 1) - 1)
+    return chunk
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import time
+from azure.core.exceptions import ResourceNotFoundError
+from .artifact_cache import load_blob
+from .jobs import load_job, is_stale_job, fail_stale_job, LIVE_STATUSES
+
+# Documents with the same bytes share one set of derived artifacts (knowledge map, page store,
+# chunk/embedding index, vectors), stored under content/<sha256> instead of the blob name:
+#   content/<sha256>.json        manifest: processing state and the upload result
+#   content/<sha256>.<artifact>  the shared artifacts
+#   <blob_name>.ref.json         pointer from an uploaded blob to its content
+#   content/<sha256>.pending/... blobs waiting for a pointer until the content is ready
+CONTENT_PREFIX = 'content/'
+
+# Helper to build the artifact base name of a content hash
+def content_artifact_name(content_hash):
+    # Used wherever a blob name was used to name derived artifacts (e.g. + '.knowledge_map.json')
+    return CONTENT_PREFIX + content_hash
+
+# Helper to build the blob name of a content manifest
+def manifest_blob_name(content_hash):
+    return CONTENT_PREFIX + content_hash + '.json'
+
+# Helper to build the blob name of a document's content pointer
+def pointer_blob_name(blob_name):
+    return blob_name + '.ref.json'
+
+# Computes the SHA-256 of a blob's bytes
+def content_hash(blob_client, container, blob_name):
+    """
+    Streams a blob and hashes it, without holding the whole file in memory.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the blob
+    Returns:
+        Hex digest string
+    """
+    blob = blob_client.get_container_client(container).get_blob_client(blob_name)
+    digest = hashlib.sha256()
+    for chunk in blob.download_blob().chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+# Loads the manifest of a content hash
+def load_manifest(blob_client, container, content_hash):
+    # Returns None for content that was never processed
+    blob = blob_client.get_container_client(container).get_blob_client(manifest_blob_name(content_hash))
+    try:
+        return json.loads(blob.download_blob().readall().decode('utf-8'))
+    except ResourceNotFoundError:
+        return None
+
+# Saves the manifest of a content hash
+def save_manifest(blob_client, container, content_hash, status, job_id=None, result=None):
+    """
+    Records the processing state of a content hash.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        content_hash: SHA-256 of the document bytes
+        status: 'processing' (a job is building the artifacts) or 'ready'
+        job_id: Id of the job that builds (or built) the artifacts
+        result: Upload result (knowledge map metadata), once ready
+    Returns:
+        The manifest dict
+    """
+    manifest = {
+        'content_hash': content_hash,
+        'artifact_name': content_artifact_name(content_hash),
+        'status': status,
+        'job_id': job_id,
+        'result': result,
+        'updated_at': time.time()
+    }
+    blob = blob_client.get_container_client(container).get_blob_client(manifest_blob_name(content_hash))
+    blob.upload_blob(json.dumps(manifest), overwrite=True)
+    return manifest
+
+# Drops the manifest a job reserved for a content hash that turned out to be wrong
+def release_manifest(blob_client, container, content_hash, job_id):
+    # Only a manifest still being processed by this job is deleted
+    manifest = load_manifest(blob_client, container, content_hash)
+    if manifest is not None and manifest['status'] != 'ready' and manifest.get('job_id') == job_id:
+        blob = blob_client.get_container_client(container).get_blob_client(manifest_blob_name(content_hash))
+        try:
+            blob.delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+# Finds the processed (or processing) copy of a document's content
+def find_content(blob_client, container, content_hash, stale_after):
+    """
+    Looks up the manifest of a content hash.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        content_hash: SHA-256 of the document bytes
+        stale_after: Seconds without a job update after which the job building the content is
+            considered lost; it is then marked failed and the content is processed again
+    Returns:
+        Tuple (manifest, job): the manifest if the content is ready or a live job is building it,
+        with that job (None when ready); (None, None) otherwise
+    """
+    manifest = load_manifest(blob_client, container, content_hash)
+    if manifest is None:
+        return None, None
+    if manifest['status'] == 'ready':
+        return manifest, None
+    job = load_job(blob_client, container, manifest['job_id']) if manifest.get('job_id') else None
+    if job is not None and is_stale_job(job, stale_after):
+        fail_stale_job(blob_client, container, job, stale_after)
+        return None, None
+    if job is not None and job['status'] in LIVE_STATUSES:
+        return manifest, job
+    # The job building it failed (or is gone): process the content again
+    return None, None
+
+# Points an uploaded blob at the shared artifacts of its content
+def save_pointer(blob_client, container, blob_name, content_hash):
+    pointer = {'content_hash': content_hash, 'artifact_name': content_artifact_name(content_hash)}
+    blob = blob_client.get_container_client(container).get_blob_client(pointer_blob_name(blob_name))
+    blob.upload_blob(json.dumps(pointer), overwrite=True)
+
+# Removes a blob's pointer if it points at the given content (e.g. a client hash that turned out to be wrong)
+def remove_pointer(blob_client, container, blob_name, content_hash):
+    blob = blob_client.get_container_client(container).get_blob_client(pointer_blob_name(blob_name))
+    try:
+        pointer = json.loads(blob.download_blob().readall().decode('utf-8'))
+        if pointer.get('content_hash') == content_hash:
+            blob.delete_blob()
+    except ResourceNotFoundError:
+        pass
+
+# Helper to build the prefix of the blobs waiting for a content's pointer
+def pending_prefix(content_hash):
+    return CONTENT_PREFIX + content_hash + '.pending/'
+
+# Records a blob that should point at content still being processed
+def add_pending_pointer(blob_client, container, content_hash, blob_name):
+    # One marker per blob (named by the hash of its name), so concurrent uploads never overwrite each other
+    blob = blob_client.get_container_client(container).get_blob_client(_pending_marker(content_hash, blob_name))
+    blob.upload_blob(json.dumps({'blob_name': blob_name}), overwrite=True)
+
+# Withdraws a blob that was waiting for a content's pointer
+def remove_pending_pointer(blob_client, container, content_hash, blob_name):
+    blob = blob_client.get_container_client(container).get_blob_client(_pending_marker(content_hash, blob_name))
+    try:
+        blob.delete_blob()
+    except ResourceNotFoundError:
+        pass
+
+# Helper to build the blob name of a blob's pending pointer marker
+def _pending_marker(content_hash, blob_name):
+    return pending_prefix(content_hash) + hashlib.sha256(blob_name.encode('utf-8')).hexdigest() + '.json'
+
+# Writes the pointers of the blobs waiting for a content, once its artifacts are stored
+def publish_pending_pointers(blob_client, container, content_hash):
+    """
+    Called after the manifest is marked 'ready'; an upload that records a blob after the listing
+    sees the ready manifest and calls this itself, so no blob is left without its pointer.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        content_hash: SHA-256 of the document bytes
+    Returns:
+        List of the blob names that got their pointer
+    """
+    container_client = blob_client.get_container_client(container)
+    published = []
+    for item in container_client.list_blobs(name_starts_with=pending_prefix(content_hash)):
+        marker = container_client.get_blob_client(item.name)
+        try:
+            blob_name = json.loads(marker.download_blob().readall().decode('utf-8'))['blob_name']
+        except ResourceNotFoundError:
+            # Published by a concurrent call
+            continue
+        save_pointer(blob_client, container, blob_name, content_hash)
+        try:
+            marker.delete_blob()
+        except ResourceNotFoundError:
+            pass
+        published.append(blob_name)
+    return published
+
+# Resolves the artifact base name of an uploaded blob
+def resolve_artifact_name(blob_client, container, blob_name, cache=None):
+    """
+    Follows a blob's content pointer. Documents uploaded before deduplication have no
+    pointer and keep their artifacts under their own blob name.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the uploaded document blob
+        cache: Optional ArtifactCache
+    Returns:
+        Artifact base name (content/<sha256> or blob_name)
+    """
+    try:
+        pointer, _ = load_blob(cache, blob_client, container, pointer_blob_name(blob_name), lambda data: json.loads(data.decode('utf-8')))
+    except ResourceNotFoundError:
+        return blob_name
+    return pointer['artifact_name']
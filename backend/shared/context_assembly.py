@@ -0,0 +1,242 @@
+import math
+import re
+from .chunking import get_size_function
+
+# Local re-ranking modes of assemble_context
+RERANK_MODES = ('none', 'lexical')
+# Largest gap (characters, i.e. the whitespace between stripped chunks) across which neighbouring chunks are merged
+MERGE_GAP = 2
+# Remaining budget (tokens) below which a passage that does not fit is skipped instead of truncated
+MIN_TRUNCATED_TOKENS = 64
+# Separator between passages in the prompt context
+PASSAGE_SEPARATOR = '\n\n'
+# Words ignored by the lexical re-ranker and the near-duplicate check
+WORD_PATTERN = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a an and are as at be but by does for from has have how in is it its of on or that the this to was what '
+    'when where which who why will with about book chapter say says explain tell me'.split()
+)
+
+# Helper to count tokens (tiktoken encoding) or estimate them from characters
+def token_counter(encoding=None):
+    """
+    Args:
+        encoding: Optional tiktoken encoding name (e.g. CHUNK_ENCODING)
+    Returns:
+        Function text -> token count; without an encoding, characters / 4 rounded up
+    """
+    if encoding:
+        return get_size_function(encoding)[0]
+    return lambda text: (len(text) + 3) // 4
+
+# Adds the character offsets of retrieved chunks from the chunk/embedding index
+def attach_offsets(results, embedding_index):
+    """
+    AI Search results only carry the chunk id; the local retriever already returns offsets.
+    Args:
+        results: Retriever results ({id, section, chunk, ...})
+        embedding_index: The document's chunk/embedding index (see embedding_store)
+    Returns:
+        The results, with 'start_offset' and 'end_offset' where the chunk is in the index
+    """
+    missing = {r.get('section') for r in results if r.get('start_offset') is None and r.get('id')}
+    if not missing:
+        return results
+    offsets = {}
+    for key in missing:
+        for meta in (embedding_index or {}).get('sections', {}).get(key, {}).get('chunks', []):
+            offsets[meta['id']] = (meta.get('start_offset'), meta.get('end_offset'))
+    for r in results:
+        if r.get('start_offset') is None and r.get('id') in offsets:
+            r['start_offset'], r['end_offset'] = offsets[r['id']]
+    return results
+
+# Merges retrieved chunks into passages, removes duplicates, re-ranks and packs them into a token budget
+def assemble_context(results, query, token_budget=2000, max_passages=None, rerank='none', rerank_weight=0.3,
+                     duplicate_threshold=0.8, encoding=None):
+    """
+    Builds the prompt context from a candidate set of retrieved chunks:
+    1. Chunks of the same section whose offsets overlap or touch are merged into one passage
+       (overlapping window chunks repeat up to CHUNK_OVERLAP characters of text).
+    2. Passages whose words are mostly contained in a better-ranked passage are dropped.
+    3. With rerank='lexical', the retrieval score is blended with query-term overlap.
+    4. Passages are taken best first while they fit into token_budget; one that does not fit is
+       truncated at a word boundary if enough budget is left, else skipped.
+    The packed passages are returned in document order.
+    Args:
+        results: Retriever results, best first ({chunk, chapter, section, start_page, end_page, score,
+            start_offset, end_offset}; see attach_offsets)
+        query: User query (for lexical re-ranking)
+        token_budget: Maximum tokens of the context, separators included
+        max_passages: Optional maximum number of passages
+        rerank: 'none' or 'lexical'
+        rerank_weight: Weight of the lexical score in 'lexical' mode (0-1)
+        duplicate_threshold: Share of a passage's word trigrams found in a better passage above which it is dropped
+        encoding: Optional tiktoken encoding name for exact token counts (see token_counter)
+    Returns:
+        Tuple (passages, report): passages are dicts {chunk, chapter, start_page, end_page, score, chunks,
+        tokens, truncated}; report is {candidates, merged, duplicates, passages, tokens, budget, truncated, rerank}
+    """
+    if rerank not in RERANK_MODES:
+        raise ValueError(f"rerank must be one of {RERANK_MODES}")
+    count_tokens = token_counter(encoding)
+    passages = _merge_chunks(results)
+    merged = len(results) - len(passages)
+    passages, duplicates = _drop_duplicates(passages, duplicate_threshold)
+    if rerank == 'lexical':
+        passages = _lexical_rerank(passages, query, rerank_weight)
+
+    selected, used, truncated = [], 0, 0
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    for passage in passages:
+        if max_passages is not None and len(selected) >= max_passages:
+            break
+        cost = separator_tokens if selected else 0
+        remaining = token_budget - used - cost
+        tokens = count_tokens(passage['chunk'])
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                continue
+            passage = dict(passage, chunk=_truncate(passage['chunk'], remaining, count_tokens), truncated=True)
+            tokens = count_tokens(passage['chunk'])
+            truncated += 1
+        selected.append(dict(passage, tokens=tokens))
+        used += cost + tokens
+
+    selected.sort(key=lambda p: (p.get('start_page') or 0, p.get('section') or '', p.get('start_offset') or 0))
+    report = {
+        'candidates': len(results),
+        'merged': merged,
+        'duplicates': duplicates,
+        'passages': len(selected),
+        'tokens': used,
+        'budget': token_budget,
+        'truncated': truncated,
+        'rerank': rerank
+    }
+    return [_public(p) for p in selected], report
+
+# Joins packed passages into the prompt context
+def format_context(passages):
+    return PASSAGE_SEPARATOR.join(p['chunk'] for p in passages)
+
+# Helper merging overlapping or adjacent chunks of a section (keeps the rank of the best chunk)
+def _merge_chunks(results):
+    passages = []
+    by_section = {}
+    for rank, r in enumerate(results):
+        passage = {
+            'chunk': r['chunk'],
+            'chapter': r.get('chapter'),
+            'section': r.get('section'),
+            'start_page': r.get('start_page'),
+            'end_page': r.get('end_page'),
+            'score': r.get('score'),
+            'start_offset': r.get('start_offset'),
+            'end_offset': r.get('end_offset'),
+            'chunks': 1,
+            'truncated': False,
+            'rank': rank
+        }
+        if passage['start_offset'] is None or passage['end_offset'] is None or passage['section'] is None:
+            passages.append(passage)
+        else:
+            by_section.setdefault(passage['section'], []).append(passage)
+    for group in by_section.values():
+        group.sort(key=lambda p: p['start_offset'])
+        current = group[0]
+        for passage in group[1:]:
+            if passage['start_offset'] <= current['end_offset'] + MERGE_GAP:
+                current = _join(current, passage)
+            else:
+                passages.append(current)
+                current = passage
+        passages.append(current)
+    passages.sort(key=lambda p: p['rank'])
+    return passages
+
+# Helper joining two passages of a section, the second starting before the first ends (plus MERGE_GAP)
+def _join(first, second):
+    if second['end_offset'] <= first['end_offset']:
+        text = first['chunk']
+    elif second['start_offset'] < first['end_offset']:
+        # Overlapping windows: keep the second's text after the shared part
+        text = first['chunk'] + second['chunk'][first['end_offset'] - second['start_offset']:]
+    else:
+        # The gap is the whitespace stripped from both chunks
+        text = first['chunk'] + PASSAGE_SEPARATOR + second['chunk']
+    scores = [s for s in (first['score'], second['score']) if s is not None]
+    return dict(
+        first,
+        chunk=text,
+        end_offset=max(first['end_offset'], second['end_offset']),
+        start_page=_bound(min, first['start_page'], second['start_page']),
+        end_page=_bound(max, first['end_page'], second['end_page']),
+        score=max(scores) if scores else None,
+        chunks=first['chunks'] + second['chunks'],
+        rank=min(first['rank'], second['rank'])
+    )
+
+# Helper applying min/max to page numbers that may be missing
+def _bound(pick, a, b):
+    values = [v for v in (a, b) if v is not None]
+    return pick(values) if values else None
+
+# Helper returning the lower-cased words of a text
+def _words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+# Helper dropping passages mostly contained in a better-ranked passage
+def _drop_duplicates(passages, threshold):
+    kept, kept_shingles, dropped = [], [], 0
+    for passage in passages:
+        words = _words(passage['chunk'])
+        shingles = {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+        if shingles and any(len(shingles & other) / len(shingles) >= threshold for other in kept_shingles):
+            dropped += 1
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+    return kept, dropped
+
+# Helper re-ranking passages by retrieval score blended with query-term overlap
+def _lexical_rerank(passages, query, weight):
+    terms = {w for w in _words(query) if w not in STOPWORDS and len(w) > 2}
+    if not terms or not passages:
+        return passages
+    word_sets = [set(_words(p['chunk'])) for p in passages]
+    # Terms found in fewer candidates weigh more (inverse document frequency over the candidate set)
+    idf = {t: math.log(1 + len(passages) / (1 + sum(t in words for words in word_sets))) for t in terms}
+    total = sum(idf.values()) or 1.0
+    scores = [p['score'] for p in passages if p['score'] is not None]
+    low, high = (min(scores), max(scores)) if scores else (0.0, 0.0)
+
+    def blended(item):
+        passage, words = item
+        lexical = sum(idf[t] for t in terms if t in words) / total
+        # Without a spread of scores, the retrieval rank orders the passages
+        if passage['score'] is None or high == low:
+            vector = 1.0 - passage['rank'] / max(1, len(passages))
+        else:
+            vector = (passage['score'] - low) / (high - low)
+        return (1 - weight) * vector + weight * lexical
+
+    ranked = sorted(zip(passages, word_sets), key=blended, reverse=True)
+    return [passage for passage, _ in ranked]
+
+# Helper cutting a text to a token budget at a word boundary
+def _truncate(text, budget, count_tokens):
+    # Binary search on the character length, then back off to the last whitespace
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text.rfind(' ', 0, low) if low < len(text) else low
+    return text[:cut if cut > 0 else low].rstrip()
+
+# Helper dropping internal fields from a packed passage
+def _public(passage):
+    return {k: v for k, v in passage.items() if k not in ('rank', 'section', 'start_offset', 'end_offset')}
@@ -1,32 +1,172 @@
 import re
+from bisect import bisect_right
+from collections import Counter
+
+# Structure detection is regex scanning of whole pages with precompiled patterns (one pass per
+# page, no per-line Python loop for non-matching text), plus cheap checks on the matches.
+
+# A line ending in a page number, e.g. 'Chapter 1 .... 5' or '2.3 Results    12'.
+# The greedy body backtracks from the end of the line only, so long lines cost linear time.
+TOC_LINE_PATTERN = re.compile(r'^[ \t]*(?P<text>[^\n]*[^\d\n])(?P<page>\d{1,5})[ \t]*$', re.MULTILINE)
+# Dot leader (or other filler) between an entry's title and its page number
+LEADER_PATTERN = re.compile(r'(?:[ \t]*[.·…_\-]){2,}[ \t]*$')
+# Entry labelled with a keyword: 'Chapter 3', 'Part II', 'Section 2.3', 'Appendix A'
+KEYWORD_PATTERN = re.compile(r'^(?P<keyword>chapter|part|section|appendix)\s+(?P<number>[\w.\-]+)', re.IGNORECASE)
+# Entry labelled with a number: '3 Methods', '2.3. Results'
+NUMBERED_PATTERN = re.compile(r'^(?P<number>\d{1,4}(?:\.\d{1,3})*)\.?\s+\S')
+# First lines of a page (candidate headings when there is no layout information)
+HEAD_LINES = 3
+# TOC entries are only trusted on pages with at least this many entries (or next to such a page)
+MIN_TOC_PAGE_ENTRIES = 2
+# TOC entries looked up in the document to find the page offset
+OFFSET_SAMPLE_ENTRIES = 20
+# Pages past the last sampled entry's page ref scanned for its heading (front matter is rarely longer)
+OFFSET_SCAN_MARGIN = 100
+
+# Helper to normalize a title or heading for matching
+def _normalize(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+# Helper to parse the label of a TOC entry or heading
+def _label(text):
+    """
+    Args:
+        text: Entry title or heading text
+    Returns:
+        Tuple (label key or None, level): level 0 for parts, 1 for chapters, 2+ for numbered subsections
+    """
+    match = KEYWORD_PATTERN.match(text)
+    if match:
+        keyword, number = match.group('keyword').lower(), match.group('number').rstrip('.')
+        level = 0 if keyword == 'part' else number.count('.') + 1
+        return f"{keyword} {number.lower()}", level
+    match = NUMBERED_PATTERN.match(text)
+    if match:
+        number = match.group('number')
+        return number, number.count('.') + 1
+    return None, 1
 
 # Detects a table of contents (TOC) or index in the first N pages of a document
 def detect_index(pages, max_toc_pages=50):
     """
     Scans the first max_toc_pages for a table of contents (TOC) or index.
     Handles multi-page indices by aggregating all detected entries.
+    An entry is a line ending in a page number that has a dot leader or a chapter/section label.
+    Repeated entries are dropped, as are entries whose page refs go backwards (the longest
+    non-decreasing run of refs is kept) and lone matches on pages that are not TOC pages.
     Args:
         pages: List of page texts (strings)
         max_toc_pages: Number of pages to scan for TOC/index
     Returns:
-        List of index entries: [{title, page_ref, line, toc_page}]
+        List of index entries: [{title, page_ref, line, toc_page, level}]
     """
-    # Pattern matches lines like 'Chapter 1 .... 5', 'Section 2.3 .... 12', etc.
-    toc_pattern = re.compile(r'(chapter|section|part)\s+([\w\d\.\-]+).*?(\d+)', re.IGNORECASE)
-    index = []
+    entries_by_page = {}
     for i, page in enumerate(pages[:max_toc_pages]):
-        for line in page.split('\n'):
-            match = toc_pattern.search(line)
-            if match:
-                # If a TOC entry is found, add it to the index list
-                index.append({
-                    'title': match.group(2),  # The chapter/section/part name
-                    'page_ref': int(match.group(3)),  # The referenced page number
-                    'line': line,  # The full line text
-                    'toc_page': i+1  # The page number in the PDF where this TOC entry was found
-                })
+        for match in TOC_LINE_PATTERN.finditer(page):
+            entry = _parse_entry(match, i + 1)
+            if entry is not None:
+                entries_by_page.setdefault(i + 1, []).append(entry)
+    toc_pages = {p for p, entries in entries_by_page.items() if len(entries) >= MIN_TOC_PAGE_ENTRIES}
+    index = []
+    seen = set()
+    for toc_page in sorted(entries_by_page):
+        if toc_page not in toc_pages and toc_page - 1 not in toc_pages and toc_page + 1 not in toc_pages:
+            continue
+        for entry in entries_by_page[toc_page]:
+            key = (_normalize(entry['title']), entry['page_ref'])
+            if key not in seen:
+                seen.add(key)
+                index.append(entry)
+    return _monotonic(index)
+
+# Helper to turn a TOC line match into an index entry
+def _parse_entry(match, toc_page):
+    # Returns None for lines that end in a number but are not TOC entries
+    text = match.group('text')
+    if text[-1] not in ' \t.·…_-':
+        # 'Figure3' or 'v2': the number is part of a word
+        return None
+    leader = LEADER_PATTERN.search(text)
+    title = ' '.join((text[:leader.start()] if leader else text).split())
+    if not title:
+        return None
+    label, level = _label(title)
+    if not leader and (label is None or label[0].isdigit()):
+        # Without a leader, only keyword labels are trusted: '2019 sales rose by 15' is not an entry
+        return None
+    return {
+        'title': title,  # The entry text without leader and page number
+        'page_ref': int(match.group('page')),  # The referenced (printed) page number
+        'line': match.group(0).strip(),  # The full line text
+        'toc_page': toc_page,  # The page number in the PDF where this TOC entry was found
+        'level': level  # 0 part, 1 chapter, 2+ subsection
+    }
+
+# Helper keeping the longest run of entries with non-decreasing page refs
+def _monotonic(index):
+    # Patience sorting: O(n log n); the entries' order is kept
+    tails, tail_positions, previous = [], [], [None] * len(index)
+    for i, entry in enumerate(index):
+        k = bisect_right(tails, entry['page_ref'])
+        if k == len(tails):
+            tails.append(entry['page_ref'])
+            tail_positions.append(i)
+        else:
+            tails[k] = entry['page_ref']
+            tail_positions[k] = i
+        previous[i] = tail_positions[k - 1] if k else None
+    kept = []
+    i = tail_positions[-1] if tail_positions else None
+    while i is not None:
+        kept.append(index[i])
+        i = previous[i]
+    return kept[::-1]
+
+# Detects chapter headings from the document layout (or the first lines of each page)
+def detect_headings(pages, headings=None):
+    """
+    Finds chapter starts when the document has no TOC. Headings come from Document Intelligence
+    paragraph roles where available; otherwise the first lines of each page are used. Only
+    labelled chapter-level headings ('Chapter 3', 'Part II', or numbered layout headings) count,
+    and a heading repeated on following pages (a running header) counts once.
+    Args:
+        pages: List of page texts
+        headings: Optional dict {page index: [heading texts]} from the layout model
+    Returns:
+        List of index entries: [{title, page_ref, line, toc_page, level}] with page_ref the
+        0-based page index (a page offset of 0)
+    """
+    index = []
+    _scan_headings(pages, headings, 0, set(), index)
     return index
 
+# Helper scanning pages [start, len(pages)) for chapter headings, appending to index
+def _scan_headings(pages, headings, start, seen, index):
+    # seen holds the normalized headings found so far (running headers are skipped)
+    for i in range(start, len(pages)):
+        from_layout = bool(headings and headings.get(i))
+        for text in (headings[i] if from_layout else _head_lines(pages[i])):
+            title = ' '.join(text.split())
+            label, level = _label(title)
+            if label is None or level > 1 or (not from_layout and label[0].isdigit()):
+                continue
+            key = _normalize(title)
+            if key in seen:
+                continue
+            seen.add(key)
+            index.append({'title': title, 'page_ref': i, 'line': text, 'toc_page': None, 'level': level})
+            break
+
+# Helper returning the first non-empty lines of a page
+def _head_lines(page):
+    lines = []
+    for line in page.split('\n', HEAD_LINES * 2)[:HEAD_LINES * 2]:
+        if line.strip():
+            lines.append(line.strip())
+            if len(lines) == HEAD_LINES:
+                break
+    return lines
+
 # Calculates the offset between the first index reference and the actual content start
 def calculate_page_offset(index, actual_first_chapter_page):
     """
@@ -43,25 +183,151 @@ def calculate_page_offset(index, actual_first_chapter_page):
     # Offset = where content actually starts - what the TOC says
     return actual_first_chapter_page - index[0]['page_ref']
 
+# Detects the offset between printed page numbers (TOC refs) and page indices
+def detect_page_offset(pages, index, headings=None):
+    """
+    Finds where TOC entries actually start by looking their titles (or labels) up among the
+    headings after the TOC, and takes the most common difference. Without any match, printed
+    page 1 is assumed to be the first page, moved past the TOC if that would overlap it.
+    Args:
+        pages: List of page texts
+        index: List of index entries from detect_index
+        headings: Optional dict {page index: [heading texts]} from the layout model
+    Returns:
+        Integer offset: page index = page_ref + offset
+    """
+    return _page_offset(pages, index, headings)[0]
+
+# Helper computing the page offset and whether more pages could still change it
+def _page_offset(pages, index, headings):
+    # Returns (offset, settled); settled once every sampled entry is found or the scan range is complete
+    if not index:
+        return 0, True
+    toc_end = max(entry['toc_page'] for entry in index)  # Index of the first page after the TOC
+    sample = index[:OFFSET_SAMPLE_ENTRIES]
+    # Keys a sampled entry's heading may have: its normalized title, or its keyword label
+    wanted = {}
+    for n, entry in enumerate(sample):
+        label, _ = _label(entry['title'])
+        wanted.setdefault(_normalize(entry['title']), n)
+        if label is not None and not label[0].isdigit():
+            wanted.setdefault(label, n)
+    found = {}
+    # Scanning stops once every sampled entry is found, or well past where the last one should be
+    scan_end = toc_end + sample[-1]['page_ref'] + OFFSET_SCAN_MARGIN
+    for i in range(toc_end, min(len(pages), scan_end)):
+        for text in (headings[i] if headings and headings.get(i) else _head_lines(pages[i])):
+            label, _ = _label(text.strip())
+            for key in (_normalize(text), label):
+                n = wanted.get(key) if key else None
+                if n is not None and n not in found:
+                    found[n] = i
+        if len(found) == len(sample):
+            break
+    settled = len(found) == len(sample) or len(pages) >= scan_end
+    votes = Counter(page - sample[n]['page_ref'] for n, page in found.items())
+    if votes:
+        return votes.most_common(1)[0][0], settled
+    return max(-1, toc_end - index[0]['page_ref']), settled
+
 # Segments the document into sections/chapters using the index if found, otherwise creates synthetic sections
-def segment_document(pages, index):
+def segment_document(pages, index, page_count=None, page_offset=0):
     """
     Segments the document into sections/chapters using the index if found, otherwise creates synthetic sections.
+    When the index has several levels, sections are cut at the top level (e.g. chapters, not their subsections).
     Args:
         pages: List of page texts
         index: List of index entries
+        page_count: Total number of pages, if pages is only the extracted prefix (defaults to len(pages))
+        page_offset: Offset from the entries' page refs to page indices (see detect_page_offset)
     Returns:
         List of sections: [{title, start_page, end_page}]
     """
+    page_count = len(pages) if page_count is None else page_count
     if index:
+        starts = []
+        for entry in _top_level(index):
+            start = min(max(entry['page_ref'] + page_offset, 0), page_count)
+            if starts and start <= starts[-1][1]:
+                # Starts on the same page as the previous entry (or refs out of range)
+                continue
+            starts.append((entry['title'], start))
         sections = []
-        for i, entry in enumerate(index):
-            start = entry['page_ref']
+        for i, (title, start) in enumerate(starts):
             # The end of this section is the start of the next, or the end of the document
-            end = index[i+1]['page_ref'] if i+1 < len(index) else len(pages)
-            sections.append({'title': entry['title'], 'start_page': start, 'end_page': end})
-        return sections
-    else:
-        # Fallback: split by every N pages if no TOC/index is found
-        N = max(5, len(pages)//10)  # At least 5 pages per section, or 10 sections
-        return [{'title': f'Section {i+1}', 'start_page': i*N, 'end_page': min((i+1)*N, len(pages))} for i in range((len(pages)+N-1)//N)] 
\ No newline at end of file
+            end = starts[i+1][1] if i+1 < len(starts) else page_count
+            if start < end:
+                sections.append({'title': title, 'start_page': start, 'end_page': end})
+        if sections:
+            return sections
+    # Fallback: split by every N pages if no TOC/index is found
+    N = max(5, page_count//10)  # At least 5 pages per section, or 10 sections
+    return [{'title': f'Section {i+1}', 'start_page': i*N, 'end_page': min((i+1)*N, page_count)} for i in range((page_count+N-1)//N)]
+
+# Helper selecting the entries to cut sections at
+def _top_level(index):
+    # The shallowest level with at least two entries; all entries if no level has two
+    counts = Counter(entry.get('level', 1) for entry in index)
+    for level in sorted(counts):
+        if counts[level] >= 2:
+            return [entry for entry in index if entry.get('level', 1) <= level]
+    return index
+
+# Detects the structure of a document and segments it
+def analyze_structure(pages, headings=None, max_toc_pages=50, page_count=None):
+    """
+    Segments a document by its TOC (with the page offset applied), else by its chapter
+    headings, else into synthetic sections.
+    Args:
+        pages: List of page texts (or the extracted prefix)
+        headings: Optional dict {page index: [heading texts]} from the layout model
+        max_toc_pages: Number of pages to scan for TOC/index
+        page_count: Total number of pages, if pages is only the extracted prefix
+    Returns:
+        Tuple (sections, source) with source 'toc', 'headings' or 'synthetic'
+    """
+    return StructureDetector(max_toc_pages).analyze(pages, headings, page_count)
+
+# Detects the structure of a document while its pages are being extracted
+class StructureDetector:
+    """
+    analyze_structure for a growing prefix of pages, without rescanning it on every call.
+    The TOC only depends on the first max_toc_pages pages and the page offset on the pages up
+    to the sampled entries' headings, so each is kept once those pages are in; chapter
+    headings are scanned from where the previous call stopped.
+    """
+
+    def __init__(self, max_toc_pages=50):
+        self.max_toc_pages = max_toc_pages
+        self._index = None
+        self._page_offset = None
+        self._headings = []
+        self._seen_headings = set()
+        self._scanned = 0
+
+    def analyze(self, pages, headings=None, page_count=None):
+        """
+        Args:
+            pages: The extracted pages so far (each call passes the same pages plus new ones)
+            headings: Optional dict {page index: [heading texts]} from the layout model
+            page_count: Total number of pages, if pages is only the extracted prefix
+        Returns:
+            Tuple (sections, source) with source 'toc', 'headings' or 'synthetic'
+        """
+        index = self._index
+        if index is None:
+            index = detect_index(pages, max_toc_pages=self.max_toc_pages)
+            if len(pages) >= self.max_toc_pages:
+                self._index = index
+        if index:
+            page_offset = self._page_offset
+            if page_offset is None:
+                page_offset, settled = _page_offset(pages, index, headings)
+                if settled and self._index is not None:
+                    self._page_offset = page_offset
+            return segment_document(pages, index, page_count=page_count, page_offset=page_offset), 'toc'
+        _scan_headings(pages, headings, self._scanned, self._seen_headings, self._headings)
+        self._scanned = len(pages)
+        if len(self._headings) >= 2:
+            return segment_document(pages, self._headings, page_count=page_count), 'headings'
+        return segment_document(pages, [], page_count=page_count), 'synthetic'
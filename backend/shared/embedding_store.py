@@ -0,0 +1,244 @@
+import base64
+import hashlib
+import json
+import numpy as np
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError, ResourceModifiedError
+from .chunking import iter_chunks
+from .indexing import embed_texts, EMBEDDING_BATCH_SIZE, INDEXING_CONCURRENCY
+from .artifact_cache import load_blob
+
+# Version of the stored index layout; an index with a different version is treated as empty
+EMBEDDING_INDEX_VERSION = 1
+# Conditional writes of an index before giving up when other requests keep changing it
+INDEX_SAVE_ATTEMPTS = 5
+
+# Helper to build the blob name of a document's chunk/embedding index
+def embedding_index_blob_name(blob_name):
+    # The index lives next to the knowledge map and pages blobs
+    return blob_name + '.embeddings.json'
+
+# Helper to build the key identifying a section inside the index
+def section_key(section):
+    # Sections are identified by their page range, which is stable for a given upload
+    return f"{section['start_page']}-{section['end_page']}"
+
+# Helper to build the AI Search key of a chunk
+def chunk_id(blob_name, section, start_offset):
+    # Keys only allow letters, digits, '_', '-' and '=', and deduplicated artifacts are named content/<sha256>,
+    # so the readable id is URL-safe base64 encoded (doc_id keeps the plain name)
+    raw = f"{blob_name}_{section['start_page']}_{section['end_page']}_{start_offset}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+# Helper to compute the content address of a chunk
+def chunk_hash(text):
+    # SHA-256 of the chunk text, so identical chunks share a single embedding
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Creates an empty chunk/embedding index for a document
+def empty_embedding_index(blob_name):
+    """
+    Creates an empty chunk/embedding index.
+    Layout:
+        sections: {section_key: {chapter, chunks: [chunk metadata]}}
+        embeddings: {chunk_hash: embedding}
+    Args:
+        blob_name: Name of the source document blob
+    Returns:
+        Index dict
+    """
+    return {
+        'version': EMBEDDING_INDEX_VERSION,
+        'doc_id': blob_name,
+        'sections': {},
+        'embeddings': {}
+    }
+
+# Loads a document's chunk/embedding index from Blob Storage
+def load_embedding_index(blob_client, container, blob_name, cache=None):
+    """
+    Loads the chunk/embedding index for a document, or an empty one if none exists yet.
+    The index keeps the ETag it was loaded with in '_etag', for save_embedding_index.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        cache: Optional ArtifactCache; the returned index is then shared and must be
+            copied with writable_embedding_index before it is modified
+    Returns:
+        Index dict
+    """
+    try:
+        index, etag = load_blob(cache, blob_client, container, embedding_index_blob_name(blob_name), _parse_index)
+    except ResourceNotFoundError:
+        # Nothing stored yet: the index is filled lazily on first touch
+        return empty_embedding_index(blob_name)
+    if index.get('version') != EMBEDDING_INDEX_VERSION:
+        # Stale layout: rebuild from scratch rather than misread it (and overwrite it when saving)
+        return {**empty_embedding_index(blob_name), '_etag': etag}
+    return {**index, '_etag': etag}
+
+# Returns a copy of an index that build_section_documents can modify without touching a cached original
+def writable_embedding_index(index):
+    # Only the two top-level maps are modified, so a shallow copy of them is enough
+    return {**index, 'sections': dict(index['sections']), 'embeddings': dict(index['embeddings'])}
+
+# Saves a document's chunk/embedding index to Blob Storage
+def save_embedding_index(blob_client, container, blob_name, index, replace=False):
+    """
+    Saves an index without losing sections that other requests saved in the meantime.
+    The write only succeeds while the stored index is the one `index` was loaded from (ETag
+    condition); otherwise the stored index is reloaded, the sections of `index` are merged
+    into it, and the write is retried.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        index: Index dict (from load_embedding_index or empty_embedding_index)
+        replace: Overwrite the stored index unconditionally (e.g. when publishing a new upload's index)
+    Returns:
+        The saved index, with its new ETag (it may include sections merged from the stored one)
+    """
+    blob = blob_client.get_container_client(container).get_blob_client(embedding_index_blob_name(blob_name))
+    for attempt in range(INDEX_SAVE_ATTEMPTS):
+        data = _serialize_index(index)
+        try:
+            if replace:
+                result = blob.upload_blob(data, overwrite=True)
+            elif index.get('_etag'):
+                result = blob.upload_blob(data, overwrite=True, etag=index['_etag'], match_condition=MatchConditions.IfNotModified)
+            else:
+                # Not stored when it was loaded: only create it
+                result = blob.upload_blob(data, overwrite=False)
+            return {**index, '_etag': (result or {}).get('etag')}
+        except (ResourceModifiedError, ResourceExistsError, ResourceNotFoundError):
+            if attempt == INDEX_SAVE_ATTEMPTS - 1:
+                raise
+            index = merge_embedding_indexes(load_embedding_index(blob_client, container, blob_name), index)
+
+# Merges the sections of an index into a more recently stored one
+def merge_embedding_indexes(stored, index):
+    # Sections of `index` win; sections only in the stored index (saved by another request) are kept
+    merged = writable_embedding_index(stored)
+    merged['sections'].update(index['sections'])
+    merged['embeddings'].update(index['embeddings'])
+    return merged
+
+# Drops a document's chunk/embedding index, e.g. when the document is re-uploaded
+def invalidate_embedding_index(blob_client, container, blob_name):
+    """
+    Deletes the stored index for a document.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+    Returns:
+        List of search document ids that were indexed for the old version (to delete from AI Search)
+    """
+    blob = blob_client.get_container_client(container).get_blob_client(embedding_index_blob_name(blob_name))
+    try:
+        index = json.loads(blob.download_blob().readall().decode('utf-8'))
+    except ResourceNotFoundError:
+        return []
+    blob.delete_blob()
+    return [c['id'] for entry in index.get('sections', {}).values() for c in entry.get('chunks', [])]
+
+# Checks whether a section has already been chunked and embedded
+def has_section(index, section):
+    # Also compares the chapter name, so a renamed section is rebuilt
+    entry = index['sections'].get(section_key(section))
+    return entry is not None and entry.get('chapter') == section['chapter_name']
+
+# Returns the search documents for a section from the index (the section must already be in it)
+def get_section_documents(index, section):
+    # Rebuilds full search documents from the stored metadata and content-addressed embeddings
+    chunks = index['sections'][section_key(section)]['chunks']
+    return [_to_search_document(c, index['embeddings'][c['chunk_hash']]) for c in chunks]
+
+# Chunks and embeds sections that are not in the index yet
+def build_section_documents(index, blob_name, sections, texts, gpt_client, batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY,
+                            page_starts=None, max_chunk_size=1000, chunk_overlap=200, encoding=None):
+    """
+    Chunks the given sections and adds them to the index.
+    Only chunks whose hash is not yet in the index are sent to the embedding model,
+    and those are embedded together in multi-input batches.
+    Args:
+        index: Chunk/embedding index dict (updated in place)
+        blob_name: Name of the source document blob
+        sections: Knowledge map entries (chapter_name, start_page, end_page) to build
+        texts: Section texts, in the same order as sections
+        gpt_client: AzureOpenAI client for embeddings
+        batch_size: Number of chunks per embedding request
+        max_workers: Maximum number of concurrent embedding requests
+        page_starts: Optional page start offsets of each text (see chunking.join_pages); chunks then
+            record the pages they span instead of the whole section's range
+        max_chunk_size: Maximum chunk size (characters, or tokens if encoding is set)
+        chunk_overlap: Overlap between windows of oversized pieces
+        encoding: Optional tiktoken encoding name for token-based chunk sizing
+    Returns:
+        List of new search documents (chunk + embedding + metadata) to upload to AI Search
+    """
+    built = []
+    missing = {}
+    for i, (section, text) in enumerate(zip(sections, texts)):
+        starts = page_starts[i] if page_starts else None
+        chunks = []
+        for c in iter_chunks(text, max_chunk_size, chunk_overlap, section.get('start_page') or 0, starts, encoding):
+            h = chunk_hash(c['chunk'])
+            if h not in index['embeddings']:
+                # Only unseen content is embedded, once even if repeated
+                missing.setdefault(h, c['chunk'])
+            chunks.append({
+                'id': chunk_id(blob_name, section, c['start_offset']),
+                'chunk_hash': h,
+                'chunk': c['chunk'],
+                'chapter': section['chapter_name'],
+                'section': section_key(section),
+                'doc_id': blob_name,
+                'start_page': c['start_page'] if c['start_page'] is not None else section.get('start_page'),
+                'end_page': c['end_page'] if c['end_page'] is not None else section.get('end_page'),
+                'start_offset': c['start_offset'],
+                'end_offset': c['end_offset']
+            })
+        built.append((section, chunks))
+    hashes = list(missing)
+    embeddings = embed_texts(gpt_client, [missing[h] for h in hashes], batch_size=batch_size, max_workers=max_workers)
+    index['embeddings'].update(zip(hashes, embeddings))
+    docs = []
+    for section, chunks in built:
+        index['sections'][section_key(section)] = {'chapter': section['chapter_name'], 'chunks': chunks}
+        docs.extend(_to_search_document(c, index['embeddings'][c['chunk_hash']]) for c in chunks)
+    return docs
+
+# Helper parsing a downloaded index, unpacking its embeddings
+def _parse_index(data):
+    index = json.loads(data.decode('utf-8'))
+    # Indexes saved before embeddings were packed keep plain float lists
+    index['embeddings'] = {
+        h: np.frombuffer(base64.b64decode(e), dtype='<f4').tolist() if isinstance(e, str) else e
+        for h, e in index.get('embeddings', {}).items()
+    }
+    return index
+
+# Helper serializing an index; embeddings are packed as base64 float32 (about a quarter of a JSON float list)
+def _serialize_index(index):
+    stored = {k: v for k, v in index.items() if not k.startswith('_')}
+    stored['embeddings'] = {
+        h: base64.b64encode(np.asarray(e, dtype='<f4').tobytes()).decode('ascii')
+        for h, e in index['embeddings'].items()
+    }
+    return json.dumps(stored)
+
+# Helper to turn stored chunk metadata into an AI Search document
+def _to_search_document(meta, embedding):
+    # Only the fields defined in the AI Search index are included
+    return {
+        'id': meta['id'],
+        'chunk': meta['chunk'],
+        'embedding': embedding,
+        'chapter': meta['chapter'],
+        'section': meta.get('section') or section_key(meta),
+        'doc_id': meta['doc_id'],
+        'start_page': meta['start_page'],
+        'end_page': meta['end_page']
+    }
@@ -0,0 +1,181 @@
+import io
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .retry import call_with_retries
+
+try:
+    import pypdf  # Optional: local text-layer extraction
+except ImportError:
+    pypdf = None
+
+# Document Intelligence paragraph roles kept as headings (used to find chapter starts)
+HEADING_ROLES = ('title', 'sectionHeading')
+
+# Extracts page texts with Azure Document Intelligence, in page-range batches analysed concurrently
+class DocumentIntelligenceExtractor:
+    """
+    Splits a document into page ranges of batch_pages pages and analyses up to max_workers
+    ranges at once with the prebuilt-layout model. iter_batches() yields each range as soon as
+    it is analysed, so early pages are usable before the last page is done.
+    The page count is not known up front: ranges are requested ahead speculatively, and the
+    first range returning fewer pages than requested (or rejected as out of range) marks the
+    end of the document. Headings found by the layout model are collected in self.headings.
+    """
+
+    def __init__(self, form_client, document_url, batch_pages=50, max_workers=4, model='prebuilt-layout', max_retries=5):
+        """
+        Args:
+            form_client: DocumentAnalysisClient instance
+            document_url: URL of the PDF in Blob Storage
+            batch_pages: Pages analysed per request
+            max_workers: Maximum number of page ranges analysed at once
+            model: Document Intelligence model id
+            max_retries: Retries per range on rate limiting (429/503)
+        """
+        self.form_client = form_client
+        self.document_url = document_url
+        self.batch_pages = max(1, batch_pages)
+        self.max_workers = max(1, max_workers)
+        self.model = model
+        self.max_retries = max_retries
+        # Known once the last range has been analysed
+        self.page_count = None
+        # {page index: [heading texts]} of the ranges yielded so far
+        self.headings = {}
+
+    def iter_batches(self):
+        """
+        Yields batches of page texts in completion order (not necessarily page order).
+        Yields:
+            Tuples (start_page, page_texts) with 0-based start_page
+        """
+        end = None
+        errors = {}
+        next_batch = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            while True:
+                # Keep max_workers ranges in flight until the end of the document is known (or a range failed)
+                while end is None and not errors and len(pending) < self.max_workers:
+                    start = next_batch * self.batch_pages
+                    pending[pool.submit(self._analyze, start)] = start
+                    next_batch += 1
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    start = pending.pop(future)
+                    try:
+                        pages, headings = future.result()
+                    except Exception as e:
+                        # A range past the end of the document fails; decided once the end is known
+                        errors[start] = e
+                        continue
+                    if len(pages) < self.batch_pages:
+                        end = start + len(pages) if end is None else min(end, start + len(pages))
+                    if pages and (end is None or start < end):
+                        self.headings.update(headings)
+                        yield start, pages
+        if end is None and errors:
+            # The document ends exactly at a range boundary: the next range is rejected as invalid (400)
+            first = min(errors)
+            if getattr(errors[first], 'status_code', None) == 400:
+                end = first
+        for start, error in sorted(errors.items()):
+            if end is None or start < end:
+                raise error
+        self.page_count = end
+
+    # Helper analysing one page range
+    def _analyze(self, start):
+        page_range = f"{start + 1}-{start + self.batch_pages}"
+
+        def analyze():
+            poller = self.form_client.begin_analyze_document_from_url(self.model, self.document_url, pages=page_range)
+            return poller.result()
+
+        result = call_with_retries(analyze, max_retries=self.max_retries)
+        # Concatenate all lines on each page into a single string
+        pages = ["\n".join([line.content for line in page.lines]) for page in result.pages]
+        # Paragraph roles mark titles and section headings (page numbers are 1-based in the document)
+        headings = {}
+        for paragraph in getattr(result, 'paragraphs', None) or []:
+            if getattr(paragraph, 'role', None) in HEADING_ROLES and paragraph.bounding_regions:
+                page = paragraph.bounding_regions[0].page_number - 1
+                headings.setdefault(page, []).append(paragraph.content)
+        return pages, headings
+
+# Extracts the text layer of born-digital PDFs locally with pypdf
+class PdfTextExtractor:
+    """
+    Pure-Python extraction without OCR or a layout model: fast, free and offline, but scanned
+    pages (images without a text layer) come out empty.
+    """
+
+    def __init__(self, pdf_bytes, batch_pages=50):
+        """
+        Args:
+            pdf_bytes: Content of the PDF
+            batch_pages: Pages per yielded batch
+        Raises:
+            ValueError if pypdf is not installed
+        """
+        if pypdf is None:
+            raise ValueError("Local PDF extraction requires the pypdf package.")
+        self.reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+        self.batch_pages = max(1, batch_pages)
+        self.page_count = len(self.reader.pages)
+        # No layout model: chapter starts are found from the page texts
+        self.headings = {}
+
+    def iter_batches(self):
+        """
+        Yields batches of page texts in page order.
+        Yields:
+            Tuples (start_page, page_texts) with 0-based start_page
+        """
+        for start in range(0, self.page_count, self.batch_pages):
+            end = min(start + self.batch_pages, self.page_count)
+            yield start, [self.reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+# Collects batches of pages that arrive out of order
+class PageAccumulator:
+    """
+    Holds extracted pages and tracks the contiguous prefix available from page 0,
+    which is what sections can be built from while extraction continues.
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self.contiguous = 0
+
+    def add(self, start, pages):
+        # Adds a batch; returns the new length of the contiguous prefix
+        for i, text in enumerate(pages):
+            self._pages[start + i] = text
+        while self.contiguous in self._pages:
+            self.contiguous += 1
+        return self.contiguous
+
+    def prefix(self):
+        # The contiguous pages as a list
+        return [self._pages[i] for i in range(self.contiguous)]
+
+    def __len__(self):
+        return len(self._pages)
+
+# Extracts all pages of a document
+def extract_pages(extractor, on_batch=None):
+    """
+    Runs an extractor to completion.
+    Args:
+        extractor: DocumentIntelligenceExtractor or PdfTextExtractor
+        on_batch: Optional function called with the PageAccumulator after each batch
+    Returns:
+        List of page texts
+    """
+    accumulator = PageAccumulator()
+    for start, pages in extractor.iter_batches():
+        accumulator.add(start, pages)
+        if on_batch:
+            on_batch(accumulator)
+    return accumulator.prefix()
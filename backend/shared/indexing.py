@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from .retry import call_with_retries
+
+# Default number of texts sent in one embedding request
+EMBEDDING_BATCH_SIZE = 16
+# Default number of documents sent in one AI Search indexing request (the service allows up to 1000)
+SEARCH_UPLOAD_BATCH_SIZE = 500
+# Default number of batches in flight at once
+INDEXING_CONCURRENCY = 4
+
+# Helper to split a list into consecutive batches
+def _batches(items, batch_size):
+    # Yields slices of at most batch_size items, preserving order
+    batch_size = max(1, int(batch_size))
+    for i in range(0, len(items), batch_size):
+        yield items[i:i+batch_size]
+
+# Helper to run one callable per batch with bounded concurrency, keeping batch order
+def _run_batches(fn, batches, max_workers):
+    batches = list(batches)
+    if len(batches) <= 1 or max_workers <= 1:
+        return [fn(b) for b in batches]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+        return list(pool.map(fn, batches))
+
+# Embeds many texts using multi-input embedding requests
+def embed_texts(gpt_client, texts, batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY, max_retries=5):
+    """
+    Embeds a list of texts in batches, with bounded concurrency and retry/backoff on throttling.
+    Uses gpt_client.create_embeddings(list) for multi-input requests when the client supports it,
+    otherwise falls back to one create_embedding call per text inside each batch.
+    Args:
+        gpt_client: AzureOpenAI client for embeddings
+        texts: List of strings to embed
+        batch_size: Number of texts per embedding request
+        max_workers: Maximum number of concurrent requests
+        max_retries: Retries per request on 429/503
+    Returns:
+        List of embeddings, in the same order as texts
+    """
+    if not texts:
+        return []
+    create_many = getattr(gpt_client, 'create_embeddings', None)
+
+    def embed_batch(batch):
+        if create_many is not None:
+            embeddings = call_with_retries(lambda: create_many(batch), max_retries=max_retries)
+            if len(embeddings) != len(batch):
+                raise ValueError("Embedding response size does not match the request.")
+            return embeddings
+        return [call_with_retries(lambda t=t: gpt_client.create_embedding(t), max_retries=max_retries) for t in batch]
+
+    results = _run_batches(embed_batch, _batches(texts, batch_size), max_workers)
+    return [e for batch in results for e in batch]
+
+# Uploads (merge-or-upload) documents to AI Search in bulk
+def upload_search_documents(search_client, docs, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY, max_retries=5):
+    """
+    Merges or uploads documents into the AI Search index in bulk batches,
+    with bounded concurrency and retry/backoff on throttling.
+    Args:
+        search_client: SearchClient instance
+        docs: List of search documents (must include the key field 'id')
+        batch_size: Number of documents per indexing request
+        max_workers: Maximum number of concurrent requests
+        max_retries: Retries per request on 429/503
+    Returns:
+        Number of documents sent
+    """
+    if not docs:
+        return 0
+    _run_batches(
+        lambda batch: call_with_retries(lambda: search_client.merge_or_upload_documents(documents=batch), max_retries=max_retries),
+        _batches(docs, batch_size),
+        max_workers
+    )
+    return len(docs)
+
+# Deletes documents from AI Search in bulk
+def delete_search_documents(search_client, doc_ids, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY, max_retries=5):
+    """
+    Deletes documents by id from the AI Search index in bulk batches.
+    Args:
+        search_client: SearchClient instance
+        doc_ids: List of document ids
+        batch_size: Number of documents per indexing request
+        max_workers: Maximum number of concurrent requests
+        max_retries: Retries per request on 429/503
+    Returns:
+        Number of documents sent for deletion
+    """
+    if not doc_ids:
+        return 0
+    _run_batches(
+        lambda batch: call_with_retries(lambda: search_client.delete_documents(documents=[{'id': i} for i in batch]), max_retries=max_retries),
+        _batches(list(doc_ids), batch_size),
+        max_workers
+    )
+    return len(doc_ids)
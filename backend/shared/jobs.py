@@ -0,0 +1,285 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+# Upload pipeline stages, in order, with their share of the overall progress
+STAGES = [('extract', 0.3), ('analyze', 0.05), ('summarize', 0.35), ('index', 0.2), ('store', 0.1)]
+# Minimum seconds between two progress writes of the same job (stage changes are always written)
+PROGRESS_SAVE_INTERVAL = 2.0
+# Job states in which a job is still expected to make progress
+LIVE_STATUSES = ('queued', 'running', 'retrying')
+
+# Helper to build the blob name of a job record
+def job_blob_name(job_id):
+    return f"jobs/{job_id}.json"
+
+# Helper to build the blob name prefix of a job's checkpoints
+def checkpoint_prefix(job_id):
+    # Checkpoint blobs live under jobs/<job_id>/ and are deleted when the job succeeds
+    return f"jobs/{job_id}/"
+
+# Creates and stores a new upload job
+def create_job(blob_client, container, blob_name, blob_url, content_hash=None, artifact_name=None, force=False):
+    """
+    Creates a queued job record for processing an uploaded document.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the document blob
+        blob_url: URL of the document blob
+        content_hash: Optional SHA-256 of the document bytes as claimed by the client (the job verifies it)
+        artifact_name: Base name of the derived artifacts (defaults to blob_name until the job has hashed the document)
+        force: Process the document even if its content was processed before
+    Returns:
+        Job dict
+    """
+    now = time.time()
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'blob_name': blob_name,
+        'blob_url': blob_url,
+        'content_hash': content_hash,
+        'artifact_name': artifact_name or blob_name,
+        'force': force,
+        'status': 'queued',
+        'stage': None,
+        'progress': 0.0,
+        'stages': {name: {'status': 'pending'} for name, _ in STAGES},
+        'attempts': 0,
+        'error': None,
+        'result': None,
+        'created_at': now,
+        'updated_at': now
+    }
+    save_job(blob_client, container, job)
+    return job
+
+# Saves a job record to Blob Storage
+def save_job(blob_client, container, job):
+    blob = blob_client.get_container_client(container).get_blob_client(job_blob_name(job['job_id']))
+    blob.upload_blob(json.dumps(job), overwrite=True)
+
+# Loads a job record from Blob Storage
+def load_job(blob_client, container, job_id):
+    # Returns None for unknown job ids
+    blob = blob_client.get_container_client(container).get_blob_client(job_blob_name(job_id))
+    try:
+        return json.loads(blob.download_blob().readall().decode('utf-8'))
+    except ResourceNotFoundError:
+        return None
+
+# Checks whether a live job has stopped updating its record
+def is_stale_job(job, max_age):
+    # A running job writes its record at every stage change and while it reports progress; a local-queue
+    # job lost with its process (or a worker that died) would otherwise stay 'running' forever
+    return job.get('status') in LIVE_STATUSES and time.time() - job.get('updated_at', 0) > max_age
+
+# Marks a job that stopped updating its record as failed
+def fail_stale_job(blob_client, container, job, max_age):
+    """
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        job: Job dict (see is_stale_job)
+        max_age: Seconds without an update after which the job was considered lost
+    Returns:
+        The updated job dict; a late delivery of its message skips it ('stale')
+    """
+    job = dict(job, status='failed', stale=True, error=f"The job stopped updating its status for over {int(max_age)} seconds.")
+    job['updated_at'] = time.time()
+    save_job(blob_client, container, job)
+    return job
+
+# Helper to build the public view of a job (for the status endpoint)
+def job_status(job):
+    # The result is only included once the job has succeeded
+    status = {k: job.get(k) for k in ('job_id', 'blob_name', 'status', 'stage', 'progress', 'stages', 'attempts', 'error', 'created_at', 'updated_at')}
+    if job.get('status') == 'succeeded':
+        status['result'] = job.get('result')
+    return status
+
+# Saves a JSON checkpoint of a job stage
+def save_checkpoint(blob_client, container, job_id, name, value):
+    blob = blob_client.get_container_client(container).get_blob_client(checkpoint_prefix(job_id) + name)
+    blob.upload_blob(json.dumps(value), overwrite=True)
+
+# Loads a JSON checkpoint of a job stage
+def load_checkpoint(blob_client, container, job_id, name):
+    # Returns None if the checkpoint was never written
+    blob = blob_client.get_container_client(container).get_blob_client(checkpoint_prefix(job_id) + name)
+    try:
+        return json.loads(blob.download_blob().readall().decode('utf-8'))
+    except ResourceNotFoundError:
+        return None
+
+# Deletes all checkpoints of a job
+def delete_checkpoints(blob_client, container, job_id):
+    container_client = blob_client.get_container_client(container)
+    for blob in container_client.list_blobs(name_starts_with=checkpoint_prefix(job_id)):
+        try:
+            container_client.delete_blob(blob.name)
+        except ResourceNotFoundError:
+            pass
+
+# Tracks and persists the progress of a running job
+class JobTracker:
+    """
+    Updates a job record as its stages run and writes it to Blob Storage.
+    Stages may run at the same time (summarize and index start during extract), so updates are locked.
+    Progress within a stage is written at most every PROGRESS_SAVE_INTERVAL seconds.
+    """
+
+    def __init__(self, blob_client, container, job):
+        self.blob_client = blob_client
+        self.container = container
+        self.job = job
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+    @property
+    def job_id(self):
+        return self.job['job_id']
+
+    def start(self):
+        # Marks the job as running; stages finished by an earlier attempt stay done
+        with self._lock:
+            self.job['status'] = 'running'
+            self.job['attempts'] = self.job.get('attempts', 0) + 1
+            self.job['error'] = None
+            self._save()
+
+    def set_content(self, content_hash, artifact_name):
+        # Records the verified content hash of the document and where its artifacts are stored
+        with self._lock:
+            self.job.update({'content_hash': content_hash, 'artifact_name': artifact_name, 'content_verified': True})
+            self._save()
+
+    def is_done(self, stage):
+        # True if the stage finished in this or an earlier attempt (its checkpoint can be loaded)
+        with self._lock:
+            return self.job['stages'][stage]['status'] == 'done'
+
+    def start_stage(self, stage, once=False):
+        # With once=True, a stage that is already running is left as it is
+        with self._lock:
+            if once and self.job['stages'][stage]['status'] == 'running':
+                return
+            self.job['stages'][stage] = {'status': 'running', 'started_at': time.time()}
+            self.job['stage'] = stage
+            self._save()
+
+    def stage_progress(self, stage, done, total):
+        # Records how many items of a stage are finished
+        with self._lock:
+            self.job['stages'][stage].update({'done': done, 'total': total})
+            self._update_progress()
+            if time.monotonic() - self._last_save >= PROGRESS_SAVE_INTERVAL:
+                self._save()
+
+    def finish_stage(self, stage):
+        with self._lock:
+            self.job['stages'][stage].update({'status': 'done', 'finished_at': time.time()})
+            self._save()
+
+    def skip_stage(self, stage):
+        # For stages that do not apply to this upload (e.g. index without eager indexing)
+        with self._lock:
+            self.job['stages'][stage] = {'status': 'skipped'}
+            self._save()
+
+    def succeed(self, result):
+        with self._lock:
+            self.job.update({'status': 'succeeded', 'stage': None, 'progress': 1.0, 'result': result})
+            self._save()
+
+    def fail(self, error, final=True):
+        # A non-final failure is retried from the last checkpoint by the next delivery of the job message
+        with self._lock:
+            for stage in self.job['stages'].values():
+                if stage['status'] == 'running':
+                    stage['status'] = 'failed'
+            self.job.update({'status': 'failed' if final else 'retrying', 'error': error})
+            self._save()
+
+    # Helper to recompute overall progress from stage states (caller holds the lock)
+    def _update_progress(self):
+        progress = 0.0
+        for name, weight in STAGES:
+            stage = self.job['stages'][name]
+            if stage['status'] in ('done', 'skipped'):
+                progress += weight
+            elif stage.get('total'):
+                progress += weight * stage.get('done', 0) / stage['total']
+        self.job['progress'] = round(progress, 3)
+
+    # Helper to write the job record (caller holds the lock)
+    def _save(self):
+        self._update_progress()
+        self.job['updated_at'] = time.time()
+        save_job(self.blob_client, self.container, self.job)
+        self._last_save = time.monotonic()
+
+# Job queue backed by an Azure Storage queue (consumed by upload_worker_function)
+class AzureJobQueue:
+    def __init__(self, queue_client):
+        # queue_client: QueueClient with base64 message encoding, as expected by the queue trigger
+        self.queue_client = queue_client
+        self._created = False
+
+    def enqueue(self, job_id):
+        if not self._created:
+            try:
+                self.queue_client.create_queue()
+            except ResourceExistsError:
+                pass
+            self._created = True
+        self.queue_client.send_message(json.dumps({'job_id': job_id}))
+
+# In-process job queue for local development and tests
+class LocalJobQueue:
+    """
+    Runs jobs on background threads of the current process instead of a Storage queue.
+    Jobs are lost if the process exits, but their checkpoints let them be re-run.
+    """
+
+    def __init__(self, handler, max_workers=1):
+        # handler: function taking a job id, e.g. upload_pipeline.run_upload_job
+        self.handler = handler
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Only pending jobs are tracked; a warm process would otherwise keep every finished job
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_id):
+        future = self._pool.submit(self.handler, job_id)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+
+    def join(self, timeout=None):
+        # Waits for the jobs still pending; returns their results (or raises the first error).
+        # Finished jobs report their outcome through the job record
+        with self._lock:
+            pending = list(self._futures)
+        return [f.result(timeout=timeout) for f in pending]
+
+    # Helper dropping a finished job's future
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+# Process-wide local queue, so jobs of warm invocations share one worker pool
+_local_queue = None
+_local_queue_lock = threading.Lock()
+
+# Returns the process-wide local job queue, creating it on first use
+def get_local_job_queue(handler, max_workers=1):
+    # The arguments only apply to the first call, which creates the queue
+    global _local_queue
+    with _local_queue_lock:
+        if _local_queue is None:
+            _local_queue = LocalJobQueue(handler, max_workers)
+        return _local_queue
@@ -1,36 +1,190 @@
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from .retry import call_with_retries
+
+# Number of characters of sampled text kept as a fallback summary when summarization fails
+FALLBACK_SUMMARY_CHARS = 500
 
 # Generates a knowledge map (chapter summaries) for the document using GPT-4
-def generate_knowledge_map(sections, pages, gpt_client):
+def generate_knowledge_map(sections, pages, gpt_client, max_workers=1, timeout=None, max_retries=5, on_progress=None):
     """
     For each section, sample up to 3 pages, concatenate their text, and ask GPT-4 to summarize.
+    Sections are summarized concurrently when max_workers > 1; the result keeps section order.
+    A section whose summary fails or times out gets a degraded entry (an excerpt of its sampled
+    text plus a 'summary_error' field) instead of failing the whole map.
     Returns a list of dicts: [{chapter_name, start_page, end_page, summary}]
     Args:
         sections: List of section dicts (with start_page, end_page, title)
         pages: List of page texts
         gpt_client: AzureOpenAI client for GPT-4
+        max_workers: Maximum number of summaries requested at once (1 = sequential)
+        timeout: Per-section timeout in seconds, measured from when its call starts (None = no limit);
+            applies to sequential maps too
+        max_retries: Retries per summary on rate limiting (429/503)
+        on_progress: Optional function called with (done, total) as summaries are collected
     Returns:
         List of knowledge map entries
     """
-    knowledge_map = []
+    if max_workers <= 1 or len(sections) <= 1:
+        # Sample pages up front so the sampling does not depend on thread scheduling
+        sample_texts = [_sample_section_text(section, pages) for section in sections]
+        summaries = []
+        for text in sample_texts:
+            try:
+                summaries.append((_summarize_with_deadline(text, gpt_client, max_retries, timeout), None))
+            except Exception as e:
+                summaries.append((None, e))
+            if on_progress:
+                on_progress(len(summaries), len(sections))
+        return [_map_entry(section, text, summary, error) for section, text, (summary, error) in zip(sections, sample_texts, summaries)]
+    builder = KnowledgeMapBuilder(gpt_client, max_workers, timeout, max_retries, on_progress)
     for section in sections:
-        # Randomly sample up to 3 pages from this section for summarization
-        sample_pages = random.sample(range(section['start_page'], section['end_page']), min(3, section['end_page']-section['start_page']))
-        sample_text = "\n".join([pages[i] for i in sample_pages])
-        # Use GPT-4 to summarize the sampled text with a system prompt
-        system_prompt = (
-            "You are ReadPilot, an AI copilot that helps users understand, summarize, and answer questions about their book or document. "
-            "If the user asks for a summary, provide a concise and clear summary of the provided text."
-        )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Summarize: {sample_text}"}
-        ]
-        summary = gpt_client.chat_completion(messages=messages, model="gpt-4")
-        knowledge_map.append({
-            'chapter_name': section['title'],
-            'start_page': section['start_page'],
-            'end_page': section['end_page'],
-            'summary': summary
-        })
-    return knowledge_map 
\ No newline at end of file
+        builder.submit(section, pages)
+    return builder.build(sections, pages)
+
+# Builds a knowledge map incrementally, summarizing sections as soon as their pages are available
+class KnowledgeMapBuilder:
+    """
+    Summarizes sections on a thread pool as they are submitted, e.g. while later pages are still
+    being extracted. build() then returns the entries of the final sections in order, reusing
+    the summaries of submitted sections that are still part of the final segmentation.
+    """
+
+    def __init__(self, gpt_client, max_workers=4, timeout=None, max_retries=5, on_progress=None):
+        """
+        Args:
+            gpt_client: AzureOpenAI client for GPT-4
+            max_workers: Maximum number of summaries requested at once
+            timeout: Per-section timeout in seconds, measured from when its call starts (None = no limit)
+            max_retries: Retries per summary on rate limiting (429/503)
+            on_progress: Optional function called with (done, total) as summaries finish
+        """
+        self.gpt_client = gpt_client
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._lock = threading.Lock()
+        self._submitted = {}
+        self._started_at = {}
+        self._done = 0
+
+    def submit(self, section, pages):
+        """
+        Starts summarizing a section unless it was already submitted.
+        Args:
+            section: Section dict (title, start_page, end_page); its pages must be available
+            pages: List (or prefix) of page texts
+        """
+        key = _section_key(section)
+        with self._lock:
+            if key in self._submitted:
+                return
+            # Sample pages now so the sampling does not depend on thread scheduling
+            text = _sample_section_text(section, pages)
+            self._submitted[key] = (text, self._pool.submit(self._run, key, text))
+
+    def build(self, sections, pages):
+        """
+        Waits for the summaries of the given sections (submitting any that are missing)
+        and returns their knowledge map entries in order. Summaries of submitted sections
+        that are not in `sections` are discarded.
+        Args:
+            sections: Final list of section dicts
+            pages: List of page texts
+        Returns:
+            List of knowledge map entries
+        """
+        for section in sections:
+            self.submit(section, pages)
+        try:
+            knowledge_map = []
+            for section in sections:
+                key = _section_key(section)
+                text, future = self._submitted[key]
+                try:
+                    summary, error = _wait_for_call(future, self._started_at, key, self.timeout), None
+                except Exception as e:
+                    summary, error = None, e
+                knowledge_map.append(_map_entry(section, text, summary, error))
+            return knowledge_map
+        finally:
+            # Do not block on calls that timed out; their results are discarded
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # Helper running one summary on the pool
+    def _run(self, key, text):
+        self._started_at[key] = time.monotonic()
+        try:
+            return _summarize(text, self.gpt_client, self.max_retries)
+        finally:
+            with self._lock:
+                self._done += 1
+                done, total = self._done, len(self._submitted)
+            if self.on_progress:
+                self.on_progress(done, total)
+
+# Helper to build a knowledge map entry, degraded to an excerpt if the summary failed
+def _map_entry(section, text, summary, error):
+    entry = {
+        'chapter_name': section['title'],
+        'start_page': section['start_page'],
+        'end_page': section['end_page'],
+        'summary': summary
+    }
+    if error is not None:
+        # Degrade this entry only: keep an excerpt so routing still has something to match against
+        entry['summary'] = text[:FALLBACK_SUMMARY_CHARS]
+        entry['summary_error'] = str(error) or type(error).__name__
+    return entry
+
+# Helper to identify a section across provisional and final segmentations
+def _section_key(section):
+    return (section['title'], section['start_page'], section['end_page'])
+
+# Helper to randomly sample up to 3 pages from a section and join their text
+def _sample_section_text(section, pages):
+    sample_pages = random.sample(range(section['start_page'], section['end_page']), min(3, section['end_page']-section['start_page']))
+    return "\n".join([pages[i] for i in sample_pages])
+
+# Helper to summarize sampled section text with GPT-4
+def _summarize(sample_text, gpt_client, max_retries):
+    # Use GPT-4 to summarize the sampled text with a system prompt
+    system_prompt = (
+        "You are ReadPilot, an AI copilot that helps users understand, summarize, and answer questions about their book or document. "
+        "If the user asks for a summary, provide a concise and clear summary of the provided text."
+    )
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Summarize: {sample_text}"}
+    ]
+    return call_with_retries(lambda: gpt_client.chat_completion(messages=messages, model="gpt-4"), max_retries=max_retries)
+
+# Helper to summarize one section in sequence, giving up `timeout` seconds after the call starts
+def _summarize_with_deadline(sample_text, gpt_client, max_retries, timeout):
+    if timeout is None:
+        return _summarize(sample_text, gpt_client, max_retries)
+    # Each call gets its own thread so an abandoned call does not hold up the next section
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        return pool.submit(_summarize, sample_text, gpt_client, max_retries).result(timeout=timeout)
+    except FuturesTimeoutError:
+        raise TimeoutError(f"Summary timed out after {timeout} seconds.")
+    finally:
+        pool.shutdown(wait=False)
+
+# Helper to wait for a future, timing out `timeout` seconds after its call started
+def _wait_for_call(future, started_at, i, timeout):
+    if timeout is None:
+        return future.result()
+    while True:
+        start = started_at.get(i)
+        # A queued call has not started yet, so wait in slices until it does
+        remaining = timeout if start is None else start + timeout - time.monotonic()
+        try:
+            return future.result(timeout=max(0.0, remaining))
+        except FuturesTimeoutError:
+            if started_at.get(i) is not None and time.monotonic() - started_at[i] >= timeout:
+                raise TimeoutError(f"Summary timed out after {timeout} seconds.")
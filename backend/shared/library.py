@@ -0,0 +1,145 @@
+import json
+import re
+import time
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError
+from .artifact_cache import load_blob
+from .indexing import embed_texts, EMBEDDING_BATCH_SIZE, INDEXING_CONCURRENCY
+from .routing import summary_text
+
+# Blob prefix of stored library indexes
+LIBRARY_PREFIX = 'libraries/'
+# Library ids are used in blob names
+LIBRARY_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+# Version of the stored library layout; an index with another version is rebuilt
+LIBRARY_VERSION = 1
+
+# Checks a client-provided library id
+def valid_library_id(library_id):
+    return isinstance(library_id, str) and bool(LIBRARY_ID_PATTERN.match(library_id))
+
+# Helper to build the blob name of a library index
+def library_blob_name(library_id):
+    return f"{LIBRARY_PREFIX}{library_id}.json"
+
+# Creates an empty library index
+def empty_library(library_id=None):
+    """
+    Layout:
+        documents: {blob_name: {doc_name, map_etag, chapters: [{chapter_name, start_page, end_page, embedding}]}}
+    The chapter embeddings are the knowledge map's summary embeddings, in knowledge map order.
+    Args:
+        library_id: Library id, or None for a library that is not stored
+    Returns:
+        Library dict
+    """
+    return {'version': LIBRARY_VERSION, 'library_id': library_id, 'documents': {}, 'updated_at': time.time()}
+
+# Loads a stored library index (an in-memory copy is reused while its ETag is unchanged)
+def load_library(blob_client, container, library_id, artifact_cache=None):
+    """
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        library_id: Library id (see valid_library_id)
+        artifact_cache: ArtifactCache or None
+    Returns:
+        Library dict; an empty one if none is stored yet or it has another layout version
+    """
+    try:
+        library, _ = load_blob(artifact_cache, blob_client, container, library_blob_name(library_id), _parse_library)
+    except ResourceNotFoundError:
+        return empty_library(library_id)
+    if library.get('version') != LIBRARY_VERSION:
+        return empty_library(library_id)
+    return library
+
+# Stores a library index
+def save_library(blob_client, container, library):
+    # Last write wins if two requests change a library at once
+    library = {k: v for k, v in library.items() if not k.startswith('_')}
+    library['updated_at'] = time.time()
+    blob = blob_client.get_container_client(container).get_blob_client(library_blob_name(library['library_id']))
+    blob.upload_blob(json.dumps(library), overwrite=True)
+
+# Returns a copy of a library whose document table can be changed (the loaded one may be shared through the artifact cache)
+def writable_library(library):
+    return dict({k: v for k, v in library.items() if not k.startswith('_')}, documents=dict(library['documents']))
+
+# Builds the library entry of a document from its knowledge map
+def document_entry(doc_name, knowledge_map, map_etag, gpt_client):
+    """
+    Maps uploaded before summary embeddings existed get them computed here (in bulk requests).
+    Args:
+        doc_name: Artifact base name of the document
+        knowledge_map: Knowledge map entries
+        map_etag: ETag of the knowledge map (a re-upload changes it and the entry is refreshed)
+        gpt_client: OpenAI client wrapper
+    Returns:
+        Entry dict {doc_name, map_etag, chapters}
+    """
+    embeddings = [e.get('summary_embedding') for e in knowledge_map]
+    missing = [i for i, embedding in enumerate(embeddings) if not embedding]
+    if missing:
+        computed = embed_texts(
+            gpt_client, [summary_text(knowledge_map[i]) for i in missing],
+            batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY
+        )
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+    return {
+        'doc_name': doc_name,
+        'map_etag': map_etag,
+        'chapters': [
+            {'chapter_name': e['chapter_name'], 'start_page': e['start_page'], 'end_page': e['end_page'], 'embedding': embedding}
+            for e, embedding in zip(knowledge_map, embeddings)
+        ]
+    }
+
+# Coarse stage of library search: ranks documents by their best chapter summary
+def score_documents(library, query_embedding, top_documents=3, min_similarity=0.0):
+    """
+    Scores every chapter of the library with one matrix product and keeps the documents
+    whose best chapter is most similar to the query. Only these documents are searched chunk by chunk.
+    Args:
+        library: Library dict
+        query_embedding: Query embedding
+        top_documents: Maximum number of documents returned
+        min_similarity: Minimum similarity of a document's best chapter
+    Returns:
+        List of (score, blob_name, ranking) tuples, best first; ranking is the document's chapters
+        as (similarity, chapter index) tuples, sorted descending (as routing.embedding_score_sections)
+    """
+    matrix, rows = _library_matrix(library)
+    if not rows:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    similarities = (matrix @ query) / norms
+    rankings = {}
+    for (blob_name, index), score in zip(rows, similarities):
+        rankings.setdefault(blob_name, []).append((float(score), index))
+    ranked = []
+    for blob_name, ranking in rankings.items():
+        ranking.sort(reverse=True)
+        if ranking[0][0] >= min_similarity:
+            ranked.append((ranking[0][0], blob_name, ranking))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return ranked[:top_documents]
+
+# Helper parsing a downloaded library index
+def _parse_library(data):
+    return json.loads(data.decode('utf-8'))
+
+# Helper returning the stacked chapter embeddings of a library and the (blob_name, chapter index) of each row
+def _library_matrix(library):
+    # Built once per loaded index; cached copies keep the matrix between requests
+    if '_matrix' not in library:
+        rows, vectors = [], []
+        for blob_name, entry in library['documents'].items():
+            for i, chapter in enumerate(entry['chapters']):
+                rows.append((blob_name, i))
+                vectors.append(chapter['embedding'])
+        library['_matrix'] = np.asarray(vectors, dtype=np.float32), rows
+    return library['_matrix']
@@ -0,0 +1,215 @@
+import json
+import mmap
+import struct
+import zlib
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from .artifact_cache import load_blob
+
+# Page store layout (all integers little-endian):
+#   header: magic 'RPPS' | version u16 | reserved u16 | page_count u32 | pages_per_block u32
+#   offset table: (block_count + 1) x u64 absolute byte offsets of the blocks (last = end of file)
+#   blocks: zlib-compressed UTF-8 JSON list of the block's page texts
+PAGE_STORE_MAGIC = b'RPPS'
+PAGE_STORE_VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+# Bytes fetched by the first read, enough for the header and offset table of most documents
+_PREFETCH_BYTES = 8192
+
+# Helper to build the blob name of a document's page store
+def page_store_blob_name(blob_name):
+    # Replaces the monolithic .pages.json, which is still read for older uploads
+    return blob_name + '.pages.bin'
+
+# Helper to build the blob name of a document's legacy pages file
+def legacy_pages_blob_name(blob_name):
+    return blob_name + '.pages.json'
+
+# Encodes page texts into the page store format
+def encode_page_store(pages, pages_per_block=8, level=6):
+    """
+    Compresses pages into blocks and prepends an offset table, so any page range
+    can be read with one header read and one contiguous range read.
+    Args:
+        pages: List of page texts
+        pages_per_block: Number of pages compressed together (larger = smaller file, coarser reads)
+        level: zlib compression level
+    Returns:
+        Encoded bytes
+    """
+    pages_per_block = max(1, int(pages_per_block))
+    blocks = [
+        zlib.compress(json.dumps(pages[i:i+pages_per_block]).encode('utf-8'), level)
+        for i in range(0, len(pages), pages_per_block)
+    ]
+    offset = _HEADER.size + 8 * (len(blocks) + 1)
+    offsets = []
+    for block in blocks:
+        offsets.append(offset)
+        offset += len(block)
+    offsets.append(offset)
+    header = _HEADER.pack(PAGE_STORE_MAGIC, PAGE_STORE_VERSION, 0, len(pages), pages_per_block)
+    return header + struct.pack(f'<{len(offsets)}Q', *offsets) + b''.join(blocks)
+
+# Byte source reading ranges of a blob with ranged downloads
+class BlobRangeSource:
+    def __init__(self, blob, etag=None):
+        # blob: BlobClient of the page store; etag: if set, reads fail instead of mixing two blob versions
+        self.blob = blob
+        self.etag = etag
+
+    def read(self, offset, length):
+        if self.etag is None:
+            return self.blob.download_blob(offset=offset, length=length).readall()
+        return self.blob.download_blob(
+            offset=offset, length=length, etag=self.etag, match_condition=MatchConditions.IfNotModified
+        ).readall()
+
+# Byte source that keeps the ranges it reads in an artifact cache
+class CachedRangeSource:
+    def __init__(self, source, cache, key):
+        # key identifies the blob version, e.g. (container, blob_name, etag)
+        self.source = source
+        self.cache = cache
+        self.key = key
+
+    def read(self, offset, length):
+        range_key = self.key + (offset, length)
+        data = self.cache.get(range_key)
+        if data is None:
+            data = self.source.read(offset, length)
+            self.cache.put(range_key, data, len(data))
+        return data
+
+# Byte source over a memory-mapped local file
+class MmapSource:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, offset, length):
+        return self._mmap[offset:offset+length]
+
+    def close(self):
+        self._mmap.close()
+
+# Byte source over bytes already in memory
+class BytesSource:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, offset, length):
+        return self.data[offset:offset+length]
+
+# Random-access reader for the page store format
+class PageStore:
+    """
+    Reads page ranges from a page store through a byte source (blob range reads, mmap or bytes).
+    Only the header, offset table and the blocks covering the requested pages are fetched.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        head = source.read(0, _PREFETCH_BYTES)
+        magic, version, _, self.page_count, self.pages_per_block = _HEADER.unpack_from(head)
+        if magic != PAGE_STORE_MAGIC or version != PAGE_STORE_VERSION:
+            raise ValueError("Not a ReadPilot page store.")
+        block_count = -(-self.page_count // self.pages_per_block)
+        table_size = 8 * (block_count + 1)
+        table = head[_HEADER.size:_HEADER.size + table_size]
+        if len(table) < table_size:
+            table = source.read(_HEADER.size, table_size)
+        self.offsets = struct.unpack(f'<{block_count + 1}Q', table)
+
+    def __len__(self):
+        return self.page_count
+
+    def read_range(self, start, end):
+        """
+        Returns the texts of pages [start, end) (clamped to the document), like pages[start:end].
+        Args:
+            start: First page index (0-based)
+            end: Page index after the last page
+        Returns:
+            List of page texts
+        """
+        start, end = max(0, start), min(end, self.page_count)
+        if start >= end:
+            return []
+        first_block = start // self.pages_per_block
+        last_block = (end - 1) // self.pages_per_block
+        # The needed blocks are contiguous, so one range read fetches them all
+        base = self.offsets[first_block]
+        data = self.source.read(base, self.offsets[last_block + 1] - base)
+        pages = []
+        for b in range(first_block, last_block + 1):
+            block = data[self.offsets[b] - base:self.offsets[b + 1] - base]
+            pages.extend(json.loads(zlib.decompress(block).decode('utf-8')))
+        skip = start - first_block * self.pages_per_block
+        return pages[skip:skip + end - start]
+
+# Page reader over a list of pages (legacy .pages.json or pages already in memory)
+class ListPageStore:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    def read_range(self, start, end):
+        return self.pages[max(0, start):end]
+
+# Writes a document's page store to Blob Storage
+def save_page_store(blob_client, container, blob_name, pages, pages_per_block=8):
+    # Returns the name of the written blob
+    name = page_store_blob_name(blob_name)
+    blob = blob_client.get_container_client(container).get_blob_client(name)
+    blob.upload_blob(encode_page_store(pages, pages_per_block), overwrite=True)
+    return name
+
+# Opens a document's pages for random access, falling back to the legacy .pages.json
+def open_page_store(blob_client, container, blob_name, cache=None):
+    """
+    Opens the page store of a document with blob range reads.
+    Documents uploaded before the page store existed only have a .pages.json,
+    which is downloaded whole and wrapped in a ListPageStore.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        cache: Optional ArtifactCache; ranges (or the legacy file) are then reused while the blob's ETag is unchanged
+    Returns:
+        PageStore or ListPageStore
+    """
+    container_client = blob_client.get_container_client(container)
+    name = page_store_blob_name(blob_name)
+    blob = container_client.get_blob_client(name)
+    try:
+        if cache is None:
+            return PageStore(BlobRangeSource(blob))
+        etag = blob.get_blob_properties().etag
+        return PageStore(CachedRangeSource(BlobRangeSource(blob, etag), cache, (container, name, etag)))
+    except ResourceNotFoundError:
+        pages, _ = load_blob(cache, blob_client, container, legacy_pages_blob_name(blob_name), lambda data: json.loads(data.decode('utf-8')))
+        return ListPageStore(pages)
+
+# Opens a local page store file through a memory map
+def open_local_page_store(path):
+    # For offline processing and tests; the file uses the same format as the .pages.bin blob
+    return PageStore(MmapSource(path))
+
+# Converts a legacy .pages.json blob into a page store blob
+def migrate_pages_blob(blob_client, container, blob_name, pages_per_block=8):
+    """
+    Writes a .pages.bin next to an existing .pages.json (which is left in place).
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        pages_per_block: Number of pages compressed together
+    Returns:
+        Name of the written page store blob
+    """
+    legacy = blob_client.get_container_client(container).get_blob_client(legacy_pages_blob_name(blob_name))
+    pages = json.loads(legacy.download_blob().readall().decode('utf-8'))
+    return save_page_store(blob_client, container, blob_name, pages, pages_per_block)
@@ -0,0 +1,61 @@
+from azure.search.documents.models import VectorizedQuery
+from .indexing import upload_search_documents, SEARCH_UPLOAD_BATCH_SIZE, INDEXING_CONCURRENCY
+from .search_index import build_search_filter
+
+# Retriever backends selectable with RETRIEVER_BACKEND
+RETRIEVER_BACKENDS = ('azure', 'local')
+
+# Retriever backed by an Azure AI Search index
+class AzureSearchRetriever:
+    """
+    Retriever interface shared with vector_store.LocalVectorRetriever:
+        index_documents(docs) -> number of documents indexed
+        search(query_embedding, top, doc_id=None, sections=None) -> [{id, chunk, chapter, section, doc_id, start_page, end_page, score}]
+    """
+
+    def __init__(self, search_client, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY):
+        """
+        Args:
+            search_client: SearchClient instance
+            batch_size: Number of documents per indexing request
+            max_workers: Maximum number of concurrent indexing requests
+        """
+        self.search_client = search_client
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    def index_documents(self, docs):
+        # Bulk merge-or-upload of new chunks into the index
+        return upload_search_documents(self.search_client, docs, batch_size=self.batch_size, max_workers=self.max_workers)
+
+    def search(self, query_embedding, top=3, doc_id=None, sections=None):
+        """
+        Runs a vector query, pre-filtered to a document and a set of sections.
+        Args:
+            query_embedding: Query embedding (list of floats)
+            top: Number of results
+            doc_id: Document id to search in (None = all documents)
+            sections: Section keys to search in (None = all sections)
+        Returns:
+            List of result dicts, best first
+        """
+        vector_query = VectorizedQuery(vector=query_embedding, k_nearest_neighbors=top, fields='embedding')
+        results = self.search_client.search(
+            search_text=None,
+            vector_queries=[vector_query],
+            filter=build_search_filter(doc_id, sections),
+            vector_filter_mode='preFilter',
+            top=top
+        )
+        # Results are materialized so they can be iterated more than once
+        # (offsets are not in the index schema; see context_assembly.attach_offsets)
+        return [{
+            'id': r.get('id'),
+            'chunk': r['chunk'],
+            'chapter': r.get('chapter'),
+            'section': r.get('section'),
+            'doc_id': r.get('doc_id'),
+            'start_page': r.get('start_page'),
+            'end_page': r.get('end_page'),
+            'score': r.get('@search.score')
+        } for r in results]
@@ -0,0 +1,87 @@
+import random
+import threading
+import time
+
+# HTTP status codes that mean "slow down and try again"
+THROTTLING_STATUS_CODES = (429, 503)
+
+# Helper to read the HTTP status code from an Azure SDK or OpenAI exception
+def _status_code(exc):
+    # azure.core HttpResponseError and openai APIStatusError both expose status_code;
+    # some errors only carry it on the attached response
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status
+
+# Checks whether an exception is a throttling (rate limit) error
+def is_throttling_error(exc):
+    # Returns True for 429 Too Many Requests and 503 Server Busy
+    return _status_code(exc) in THROTTLING_STATUS_CODES
+
+# Helper to read the server-suggested wait time from a throttling error, if any
+def _retry_after_seconds(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after-ms') or headers.get('Retry-After-Ms')
+    if value is not None:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+# Calls a function, retrying with exponential backoff when the service throttles
+def call_with_retries(fn, max_retries=5, base_delay=1.0, max_delay=30.0):
+    """
+    Calls fn() and retries it on throttling errors (429/503).
+    Waits for the server's Retry-After hint if present, otherwise uses exponential backoff with jitter.
+    Any other exception is raised immediately.
+    Args:
+        fn: Zero-argument callable to invoke
+        max_retries: Maximum number of retries after the first attempt
+        base_delay: Initial backoff delay in seconds
+        max_delay: Upper bound for a single backoff delay in seconds
+    Returns:
+        The return value of fn()
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_throttling_error(e):
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+            time.sleep(min(delay, max_delay))
+            attempt += 1
+
+# Spaces out calls to stay under a requests-per-minute quota, shared by threads
+class RateLimiter:
+    """
+    Hands out one slot every 60 / requests_per_minute seconds; callers block until their slot.
+    A requests_per_minute of 0 or less disables the limit.
+    """
+
+    def __init__(self, requests_per_minute=0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Reserves the next free slot under the lock, then sleeps outside it
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,95 @@
+import numpy as np
+from .indexing import embed_texts, EMBEDDING_BATCH_SIZE, INDEXING_CONCURRENCY
+
+# Helper to build the text embedded for a knowledge map entry
+def summary_text(entry):
+    # The chapter name is included so short or degraded summaries still route by title
+    return f"{entry['chapter_name']}: {entry.get('summary') or ''}"
+
+# Adds summary embeddings to knowledge map entries (done once, at upload time)
+def embed_knowledge_map(knowledge_map, gpt_client, batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY):
+    """
+    Computes one embedding per chapter summary and stores it as 'summary_embedding'.
+    Args:
+        knowledge_map: List of knowledge map entries (updated in place)
+        gpt_client: AzureOpenAI client for embeddings
+        batch_size: Number of summaries per embedding request
+        max_workers: Maximum number of concurrent embedding requests
+    Returns:
+        The same knowledge map
+    """
+    embeddings = embed_texts(gpt_client, [summary_text(e) for e in knowledge_map], batch_size=batch_size, max_workers=max_workers)
+    for entry, embedding in zip(knowledge_map, embeddings):
+        entry['summary_embedding'] = embedding
+    return knowledge_map
+
+# Checks whether every knowledge map entry has a summary embedding
+def has_summary_embeddings(knowledge_map):
+    # Maps built before embedding routing existed have none and must use the LLM scorer
+    return bool(knowledge_map) and all(e.get('summary_embedding') for e in knowledge_map)
+
+# Helper to drop summary embeddings from knowledge map entries (e.g. for HTTP responses)
+def strip_summary_embeddings(knowledge_map):
+    # Returns copies; the embeddings are large and of no use to the frontend
+    return [{k: v for k, v in e.items() if k != 'summary_embedding'} for e in knowledge_map]
+
+# Ranks chapters by cosine similarity between the query and the chapter summaries
+def embedding_score_sections(query_embedding, knowledge_map):
+    """
+    Scores every chapter by cosine similarity of its summary embedding to the query embedding.
+    Returns a priority queue: list of (score, index) tuples, sorted descending.
+    Args:
+        query_embedding: Query embedding (list of floats)
+        knowledge_map: Knowledge map entries with 'summary_embedding'
+    Returns:
+        List of (similarity, index) tuples
+    """
+    matrix = np.asarray([e['summary_embedding'] for e in knowledge_map], dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    similarities = (matrix @ query) / norms
+    return sorted([(float(score), i) for i, score in enumerate(similarities)], reverse=True)
+
+# Selects chapters from an embedding ranking, and reports which ones are too close to call
+def select_routed_sections(pq, top_k=3, min_similarity=0.0, tie_margin=0.0):
+    """
+    Keeps at most top_k chapters whose similarity is at least min_similarity.
+    Args:
+        pq: Ranking from embedding_score_sections
+        top_k: Maximum number of chapters selected
+        min_similarity: Minimum cosine similarity for a chapter to be relevant
+        tie_margin: Chapters within this similarity of the cut-off are reported as ties
+    Returns:
+        Tuple (selected_indices, tied_indices); tied_indices is empty unless the
+        cut-off falls inside a group of near-equal scores
+    """
+    eligible = [(score, i) for score, i in pq if score >= min_similarity]
+    selected = [i for _, i in eligible[:top_k]]
+    if tie_margin <= 0 or len(eligible) <= top_k or not selected:
+        return selected, []
+    cutoff = eligible[top_k - 1][0]
+    tied = [i for score, i in eligible if abs(score - cutoff) <= tie_margin]
+    # A tie only matters if it straddles the cut-off
+    if all(i in selected for i in tied):
+        return selected, []
+    return selected, tied
+
+# Ranks chapters for several queries at once
+def embedding_score_queries(query_embeddings, knowledge_map):
+    """
+    Batched embedding_score_sections: one matrix product scores every chapter for every query.
+    Args:
+        query_embeddings: List of query embeddings
+        knowledge_map: Knowledge map entries with 'summary_embedding'
+    Returns:
+        List of rankings (lists of (similarity, index) tuples, sorted descending), one per query
+    """
+    if not query_embeddings:
+        return []
+    matrix = np.asarray([e['summary_embedding'] for e in knowledge_map], dtype=np.float32)
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    norms = np.outer(np.linalg.norm(queries, axis=1), np.linalg.norm(matrix, axis=1))
+    norms[norms == 0] = 1.0
+    similarities = (queries @ matrix.T) / norms
+    return [sorted([(float(score), i) for i, score in enumerate(row)], reverse=True) for row in similarities]
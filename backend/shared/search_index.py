@@ -0,0 +1,76 @@
+from azure.search.documents.indexes.models import (
+    HnswAlgorithmConfiguration,
+    SearchableField,
+    SearchField,
+    SearchFieldDataType,
+    SearchIndex,
+    SimpleField,
+    VectorSearch,
+    VectorSearchProfile,
+)
+
+# Name of the vector search profile used by the embedding field
+VECTOR_PROFILE_NAME = 'readpilot-hnsw-profile'
+
+# Builds the AI Search index schema for document chunks
+def build_search_index(index_name, dimensions=1536):
+    """
+    Builds the schema of the chunk index.
+    doc_id, section and chapter are filterable so queries can be scoped to one document
+    and to the chapters selected for a question; with vector_filter_mode='preFilter'
+    these filters are applied before the nearest-neighbour search rather than after it.
+    Args:
+        index_name: Name of the AI Search index
+        dimensions: Embedding dimensionality (1536 for text-embedding-ada-002)
+    Returns:
+        SearchIndex instance
+    """
+    fields = [
+        SimpleField(name='id', type=SearchFieldDataType.String, key=True),
+        SearchableField(name='chunk', type=SearchFieldDataType.String),
+        SearchField(
+            name='embedding',
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=dimensions,
+            vector_search_profile_name=VECTOR_PROFILE_NAME
+        ),
+        SimpleField(name='doc_id', type=SearchFieldDataType.String, filterable=True),
+        SimpleField(name='section', type=SearchFieldDataType.String, filterable=True),
+        SimpleField(name='chapter', type=SearchFieldDataType.String, filterable=True, facetable=True),
+        SimpleField(name='start_page', type=SearchFieldDataType.Int32, filterable=True),
+        SimpleField(name='end_page', type=SearchFieldDataType.Int32, filterable=True),
+    ]
+    vector_search = VectorSearch(
+        algorithms=[HnswAlgorithmConfiguration(name='readpilot-hnsw')],
+        profiles=[VectorSearchProfile(name=VECTOR_PROFILE_NAME, algorithm_configuration_name='readpilot-hnsw')]
+    )
+    return SearchIndex(name=index_name, fields=fields, vector_search=vector_search)
+
+# Creates or updates the chunk index so it matches build_search_index
+def ensure_search_index(index_client, index_name, dimensions=1536):
+    # Idempotent: adding filterable fields to an existing index is an in-place update
+    return index_client.create_or_update_index(build_search_index(index_name, dimensions))
+
+# Helper to quote a string literal for an OData filter expression
+def _odata_literal(value):
+    # Single quotes are escaped by doubling them
+    return "'" + str(value).replace("'", "''") + "'"
+
+# Builds the OData filter that scopes a vector query to a document and a set of sections
+def build_search_filter(doc_id=None, sections=None):
+    """
+    Builds an OData filter on the filterable doc_id and section fields.
+    Args:
+        doc_id: Document id to restrict results to (None = all documents)
+        sections: Section keys ('start-end' page ranges) to restrict results to (None = all sections)
+    Returns:
+        Filter string, or None if there is nothing to filter on
+    """
+    clauses = []
+    if doc_id:
+        clauses.append(f"doc_id eq {_odata_literal(doc_id)}")
+    if sections:
+        # search.in is much faster than a chain of 'or' comparisons; section keys never contain '|'
+        clauses.append(f"search.in(section, {_odata_literal('|'.join(sections))}, '|')")
+    return ' and '.join(clauses) or None
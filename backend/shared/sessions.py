@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError
+
+# Session store backends selectable with SESSION_STORE
+SESSION_STORES = ('memory', 'file', 'blob')
+# Blob prefix of the 'blob' store
+SESSION_PREFIX = 'sessions/'
+# Default directory of the 'file' store
+SESSION_DIR = os.path.join(tempfile.gettempdir(), 'readpilot-sessions')
+# Session ids are used in file and blob names
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+# Version of the stored session layout; a session with another version starts over
+SESSION_VERSION = 1
+# Maximum words of the summary of older turns
+SUMMARY_MAX_WORDS = 150
+
+# Checks a client-provided session id
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
+
+# Creates an empty session for a document
+def new_session(session_id, doc_id, blob_name=None):
+    """
+    Layout:
+        turns: [{query, answer, sections}], the recent turns, oldest first
+        summary: Summary of the turns folded out of 'turns' (see compress_history)
+        retrieval: {version, sections, query_embedding, results} of the last retrieval, or None
+    Args:
+        session_id: Session id (see valid_session_id)
+        doc_id: Artifact name of the document the session is about
+        blob_name: Blob name the client asked about (follow-ups may leave it out)
+    Returns:
+        Session dict
+    """
+    return {
+        'version': SESSION_VERSION,
+        'session_id': session_id,
+        'doc_id': doc_id,
+        'blob_name': blob_name,
+        'turns': [],
+        'summary': '',
+        'summarized_turns': 0,
+        'retrieval': None,
+        'updated_at': time.time()
+    }
+
+# Loads a session, or starts a new one if it is unknown, expired or about another document
+def open_session(store, session_id, doc_id, blob_name=None):
+    session = store.load(session_id)
+    if session is None or session.get('version') != SESSION_VERSION or session.get('doc_id') != doc_id:
+        return new_session(session_id, doc_id, blob_name)
+    return session
+
+# Returns the retrieval state of a session if a query is a follow-up on the same topic
+def reusable_retrieval(session, version, query_embedding, min_similarity=0.8):
+    """
+    A follow-up reuses the chapters and retrieved chunks of the session's last retrieval if its
+    query embedding is similar enough to the query that retrieval was made for.
+    Args:
+        session: Session dict
+        version: Current document version (e.g. the knowledge map ETag); a re-upload invalidates the state
+        query_embedding: Embedding of the new query
+        min_similarity: Minimum cosine similarity to count as the same topic (> 1 disables reuse)
+    Returns:
+        Tuple (retrieval state or None, similarity or None)
+    """
+    retrieval = session.get('retrieval')
+    if not retrieval or retrieval.get('version') != version or not retrieval.get('query_embedding'):
+        return None, None
+    previous = np.asarray(retrieval['query_embedding'], dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = float(np.linalg.norm(previous) * np.linalg.norm(query)) or 1.0
+    similarity = float(previous @ query) / norms
+    return (retrieval if similarity >= min_similarity else None), round(similarity, 4)
+
+# Stores the retrieval state of a query in its session
+def save_retrieval(session, version, sections, query_embedding, results):
+    """
+    Args:
+        session: Session dict (updated in place)
+        version: Document version (see reusable_retrieval)
+        sections: Section keys the results were retrieved from
+        query_embedding: Embedding of the query the retrieval was made for
+        results: Retrieved candidate chunks (with offsets, see context_assembly.attach_offsets)
+    """
+    session['retrieval'] = {
+        'version': version,
+        'sections': list(sections),
+        'query_embedding': [float(x) for x in query_embedding],
+        'results': results
+    }
+
+# Builds the chat messages of a question with the session's history
+def conversation_messages(system_prompt, session, user_content):
+    """
+    Args:
+        system_prompt: System prompt
+        session: Session dict, or None for a stateless request
+        user_content: Content of the current user message (context and question)
+    Returns:
+        List of chat messages: system prompt (with the summary of older turns), recent turns, question
+    """
+    system = system_prompt
+    if session and session['summary']:
+        system += f"\n\nSummary of the earlier conversation:\n{session['summary']}"
+    messages = [{"role": "system", "content": system}]
+    for turn in (session['turns'] if session else []):
+        messages.append({"role": "user", "content": turn['query']})
+        messages.append({"role": "assistant", "content": turn['answer']})
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+# Appends a finished turn to a session
+def record_turn(session, query, answer, sections=None):
+    # Only the question and answer are kept; the context is rebuilt (or reused) per question
+    session['turns'].append({'query': query, 'answer': answer, 'sections': list(sections or [])})
+    session['updated_at'] = time.time()
+
+# Folds the older turns of a session into its summary
+def compress_history(session, gpt_client, max_turns=6):
+    """
+    Once a session has more than max_turns turns, the oldest ones (all but the last max_turns // 2)
+    are summarized together with the previous summary in one GPT call, so prompts stay bounded
+    and compression runs only every few turns.
+    Args:
+        session: Session dict (updated in place)
+        gpt_client: OpenAI client wrapper
+        max_turns: Maximum turns kept verbatim
+    Returns:
+        Number of turns folded into the summary (0 if none)
+    """
+    if len(session['turns']) <= max_turns:
+        return 0
+    keep = max(1, max_turns // 2)
+    folded, session['turns'] = session['turns'][:-keep], session['turns'][-keep:]
+    transcript = '\n'.join(f"User: {t['query']}\nAssistant: {t['answer']}" for t in folded)
+    prompt = (
+        f"Summarize this conversation about a document in at most {SUMMARY_MAX_WORDS} words. "
+        "Keep the topics, chapters and facts the user asked about, so later questions can refer to them.\n\n"
+        + (f"Earlier summary:\n{session['summary']}\n\n" if session['summary'] else '')
+        + f"Conversation:\n{transcript}"
+    )
+    session['summary'] = gpt_client.chat_completion(prompt=prompt, model="gpt-4").strip()
+    session['summarized_turns'] += len(folded)
+    return len(folded)
+
+# In-process session store with TTL and LRU eviction
+class MemorySessionStore:
+    """
+    Session store interface shared by FileSessionStore and BlobSessionStore:
+        load(session_id) -> session dict or None (unknown or expired)
+        save(session)
+        delete(session_id)
+    Sessions live in one worker process; scaled-out apps should use the blob store.
+    """
+
+    def __init__(self, max_sessions=1024, ttl_seconds=86400):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or _expired(session, self.ttl_seconds):
+                self._sessions.pop(session_id, None)
+                return None
+            self._sessions.move_to_end(session_id)
+            # Copies, so a request never changes a stored session before saving it
+            return json.loads(json.dumps(session))
+
+    def save(self, session):
+        with self._lock:
+            self._sessions[session['session_id']] = json.loads(json.dumps(session))
+            self._sessions.move_to_end(session['session_id'])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+# Session store writing one JSON file per session (local development and offline tests)
+class FileSessionStore:
+    def __init__(self, directory=SESSION_DIR, ttl_seconds=86400):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, session_id):
+        try:
+            with open(self._path(session_id), encoding='utf-8') as f:
+                session = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return None if _expired(session, self.ttl_seconds) else session
+
+    def save(self, session):
+        # Written to a temporary file first, so readers never see a partial session
+        path = self._path(session['session_id'])
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(temp_path, path)
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    # Helper to build the file path of a session
+    def _path(self, session_id):
+        return os.path.join(self.directory, session_id + '.json')
+
+# Session store keeping sessions as blobs (sessions/<session_id>.json), shared by all instances
+class BlobSessionStore:
+    def __init__(self, blob_client, container, ttl_seconds=86400):
+        self.blob_client = blob_client
+        self.container = container
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, session_id):
+        try:
+            data = self._blob(session_id).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+        session = json.loads(data.decode('utf-8'))
+        return None if _expired(session, self.ttl_seconds) else session
+
+    def save(self, session):
+        # Last write wins if two requests of a session overlap
+        self._blob(session['session_id']).upload_blob(json.dumps(session), overwrite=True)
+
+    def delete(self, session_id):
+        try:
+            self._blob(session_id).delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+    # Helper to return the BlobClient of a session
+    def _blob(self, session_id):
+        return self.blob_client.get_container_client(self.container).get_blob_client(SESSION_PREFIX + session_id + '.json')
+
+# Helper to check a session's age against a TTL
+def _expired(session, ttl_seconds):
+    return time.time() - session.get('updated_at', 0) > ttl_seconds
+
+# Process-wide in-memory and file stores (the blob store holds no state and is created per request)
+_stores = {}
+_stores_lock = threading.Lock()
+
+# Returns the session store selected by a SESSION_STORE value
+def get_session_store(backend='memory', blob_client=None, container=None, directory=None, ttl_seconds=86400, max_sessions=1024):
+    """
+    Args:
+        backend: 'memory', 'file' or 'blob'
+        blob_client: BlobServiceClient instance (blob store)
+        container: Blob container name (blob store)
+        directory: Directory of the file store (default: SESSION_DIR)
+        ttl_seconds: Seconds of inactivity after which a session starts over
+        max_sessions: Maximum sessions kept by the memory store
+    Returns:
+        MemorySessionStore, FileSessionStore or BlobSessionStore
+    Raises:
+        ValueError for an unknown backend
+    """
+    if backend == 'blob':
+        return BlobSessionStore(blob_client, container, ttl_seconds)
+    if backend not in SESSION_STORES:
+        raise ValueError(f"SESSION_STORE must be one of {SESSION_STORES}")
+    # The other arguments only apply to the first call, which creates the store
+    with _stores_lock:
+        if backend not in _stores:
+            _stores[backend] = (
+                MemorySessionStore(max_sessions, ttl_seconds) if backend == 'memory'
+                else FileSessionStore(directory or SESSION_DIR, ttl_seconds)
+            )
+        return _stores[backend]
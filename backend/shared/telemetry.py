@@ -0,0 +1,520 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+try:
+    # Optional: spans and counters are also reported through the OpenTelemetry API;
+    # the host configures the SDK and exporter (e.g. Azure Monitor)
+    from opentelemetry import trace as otel_trace
+    from opentelemetry import metrics as otel_metrics
+except ImportError:
+    otel_trace = None
+    otel_metrics = None
+
+# Environment variables
+TELEMETRY_EXPORT = os.environ.get('TELEMETRY_EXPORT', '')  # Comma-separated exporters: 'log' (one summary line per request) and/or 'otel' (OpenTelemetry API)
+
+# Exporters enabled by TELEMETRY_EXPORT
+EXPORTERS = frozenset(name.strip() for name in TELEMETRY_EXPORT.split(',') if name.strip())
+# Rough characters per token, for token estimates of prompts and completions
+CHARS_PER_TOKEN = 4
+
+# Trace of the request (or job) running in the current context
+_current_trace = contextvars.ContextVar('readpilot_trace', default=None)
+# Callables receiving every finished span of an enabled trace
+_span_hooks = []
+# OpenTelemetry counters, created on first use
+_otel_counters = {}
+_otel_lock = threading.Lock()
+logger = logging.getLogger('readpilot.telemetry')
+
+# Registers a callable receiving each finished span
+def register_span_hook(hook):
+    """
+    Adds an exporter hook, e.g. to forward spans to another tracing system.
+    Args:
+        hook: Callable hook(trace, span) where span is the dict recorded by Trace (see Span)
+    """
+    _span_hooks.append(hook)
+
+# Starts the trace of a request or job and makes it current
+def start_trace(name, timings=False, **attributes):
+    """
+    Args:
+        name: Trace name, e.g. 'chat' or 'upload'
+        timings: True to keep the timings for the response (see Trace.timings)
+        attributes: Attributes of the trace (e.g. job_id)
+    Returns:
+        Trace; it only records spans if timings is True or an exporter or span hook is configured
+    """
+    trace = Trace(name, enabled=bool(timings or EXPORTERS or _span_hooks), attributes=attributes)
+    trace.keep_timings = bool(timings)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+# Returns the trace of the current context, or None
+def current_trace():
+    return _current_trace.get()
+
+# Estimates the token count of a text
+def estimate_tokens(chars):
+    # Counts are estimates (characters / CHARS_PER_TOKEN); the API's usage is not exposed by all calls
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+# Span context manager returned by Trace.span
+class Span:
+    """
+    Times a block and records it in its trace as a dict
+    {name, parent, start_ms, duration_ms, attributes, error}.
+    The parent is the enclosing span of the same thread, else the trace's current stage.
+    """
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self._started = None
+        self._otel_span = None
+
+    def set(self, **attributes):
+        # Adds attributes once they are known (e.g. result sizes)
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.trace._stack()
+        if stack:
+            self.parent = stack[-1].name
+        elif self.trace.stage != self.name:
+            self.parent = self.trace.stage
+        self._otel_span = self.trace._start_otel_span(self.name, stack[-1]._otel_span if stack else None)
+        stack.append(self)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        stack = self.trace._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.trace._record({
+            'name': self.name,
+            'parent': self.parent,
+            'start_ms': round((self._started - self.trace.started) * 1000, 1),
+            'duration_ms': round(duration * 1000, 1),
+            'attributes': self.attributes,
+            'error': exc_type.__name__ if exc_type else None
+        }, self._otel_span, exc)
+        return False
+
+# No-op span of disabled traces
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+# Spans and counters of one request or job
+class Trace:
+    """
+    Collects the spans and counters of a request. Disabled traces only remember the current
+    stage (for error reports): span() returns a shared no-op and count() returns at once.
+    Spans may finish on worker threads; recording is thread-safe.
+    """
+
+    def __init__(self, name, enabled=True, attributes=None):
+        self.name = name
+        self.enabled = enabled
+        self.attributes = attributes or {}
+        self.trace_id = uuid.uuid4().hex
+        self.keep_timings = False
+        self.stage = None
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+        self.error = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._token = None
+        self._finished = False
+        self._otel_root = None
+        if enabled and 'otel' in EXPORTERS and otel_trace is not None:
+            self._otel_root = otel_trace.get_tracer('readpilot').start_span(name, attributes=_otel_attributes(self.attributes))
+
+    def span(self, name, stage=False, **attributes):
+        """
+        Args:
+            name: Span name, e.g. 'route' or 'openai.chat'
+            stage: True for the request's top-level steps (reported as the failing stage on errors)
+            attributes: Span attributes
+        Returns:
+            Context manager; its set() adds attributes
+        """
+        if stage:
+            self.stage = name
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, dict(attributes, stage=True) if stage else attributes)
+
+    def record_timings(self):
+        # Turns recording on for a response 'timings' block once the request asks for it
+        self.enabled = self.keep_timings = True
+
+    def count(self, name, value=1):
+        # Adds to a counter (calls, bytes, estimated tokens, ...)
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+        if self._otel_root is not None:
+            _otel_counter(name).add(value, {'trace': self.name})
+
+    def timings(self):
+        """
+        Returns:
+            Dict {trace_id, total_ms, stages: {name: ms}, calls: {span name: {count, total_ms, errors}},
+            counters}; stages are the top-level steps, calls aggregate every other span
+        """
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        stages, calls = {}, {}
+        for span in spans:
+            if span['attributes'].get('stage'):
+                stages[span['name']] = round(stages.get(span['name'], 0) + span['duration_ms'], 1)
+                continue
+            call = calls.setdefault(span['name'], {'count': 0, 'total_ms': 0.0, 'errors': 0})
+            call['count'] += 1
+            call['total_ms'] = round(call['total_ms'] + span['duration_ms'], 1)
+            call['errors'] += span['error'] is not None
+        return {
+            'trace_id': self.trace_id,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'stages': stages,
+            'calls': calls,
+            'counters': counters
+        }
+
+    def attach(self, payload):
+        # Returns the payload with a 'timings' block if the request asked for one
+        if not self.keep_timings:
+            return payload
+        return dict(payload, timings=self.timings())
+
+    def error_payload(self, error):
+        """
+        Builds the JSON body of a failed request.
+        Args:
+            error: The exception
+        Returns:
+            Dict {error, type, stage, trace_id} (plus 'timings' if requested)
+        """
+        return self.attach({
+            'error': str(error) or type(error).__name__,
+            'type': type(error).__name__,
+            'stage': self.stage,
+            'trace_id': self.trace_id
+        })
+
+    def finish(self, error=None):
+        """
+        Ends the trace: restores the previous current trace and exports the summary.
+        Safe to call more than once; only the first call counts.
+        Args:
+            error: Exception that failed the request, if any
+        """
+        if self._finished:
+            return
+        self._finished = True
+        if self._token is not None:
+            try:
+                _current_trace.reset(self._token)
+            except ValueError:
+                # Finished from another context than it was started in
+                pass
+        self.error = error
+        if not self.enabled:
+            return
+        if self._otel_root is not None:
+            if error is not None:
+                self._otel_root.record_exception(error)
+                self._otel_root.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+            self._otel_root.end()
+        if 'log' in EXPORTERS:
+            summary = dict(self.timings(), name=self.name, attributes=self.attributes, stage=self.stage,
+                           error=type(error).__name__ if error is not None else None)
+            logger.info('trace %s', json.dumps(summary, default=str))
+
+    # Helper returning the span stack of the calling thread
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    # Helper storing a finished span and passing it to the exporters
+    def _record(self, span, otel_span, error):
+        with self._lock:
+            self.spans.append(span)
+        if otel_span is not None:
+            otel_span.set_attributes(_otel_attributes(span['attributes']))
+            if error is not None:
+                otel_span.record_exception(error)
+                otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+            otel_span.end()
+        for hook in _span_hooks:
+            hook(self, span)
+
+    # Helper starting the OpenTelemetry span of a Span (parents are passed explicitly, spans cross threads)
+    def _start_otel_span(self, name, parent):
+        if self._otel_root is None:
+            return None
+        context = otel_trace.set_span_in_context(parent or self._otel_root)
+        return otel_trace.get_tracer('readpilot').start_span(name, context=context)
+
+# Helper converting attributes to OpenTelemetry attribute values (str, bool, int, float)
+def _otel_attributes(attributes):
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items() if value is not None
+    }
+
+# Helper returning the OpenTelemetry counter of a name
+def _otel_counter(name):
+    with _otel_lock:
+        counter = _otel_counters.get(name)
+        if counter is None:
+            counter = _otel_counters[name] = otel_metrics.get_meter('readpilot').create_counter('readpilot.' + name)
+        return counter
+
+# Wraps a client in a proxy recording its calls in the current trace
+def instrument_client(kind, client):
+    """
+    Called by the azure_clients factories. Without an enabled current trace the client itself
+    is returned, so disabled telemetry adds no per-call work.
+    Args:
+        kind: Client kind ('blob', 'openai', 'search', 'search_index', 'document_intelligence', 'queue')
+        client: The pooled client
+    Returns:
+        The client, or a proxy with the same interface
+    """
+    trace = _current_trace.get()
+    if trace is None or not trace.enabled:
+        return client
+    proxy = _PROXIES.get(kind)
+    return proxy(client, trace) if proxy else client
+
+# Base of the client proxies: attributes that are not instrumented pass through
+class _Proxy:
+    def __init__(self, client, trace):
+        self._client = client
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+# Proxy of the OpenAI client wrapper (chat completions and embeddings)
+class _TracedOpenAI(_Proxy):
+    def chat_completion(self, *args, **kwargs):
+        prompt_chars = len(kwargs.get('prompt') or '') + sum(len(m.get('content') or '') for m in kwargs.get('messages') or [])
+        self._trace.count('openai.chat.calls')
+        self._trace.count('openai.prompt_tokens_est', estimate_tokens(prompt_chars))
+        if kwargs.get('stream'):
+            return self._stream(args, kwargs, prompt_chars)
+        with self._trace.span('openai.chat', model=kwargs.get('model'), prompt_chars=prompt_chars) as span:
+            answer = self._client.chat_completion(*args, **kwargs)
+            span.set(completion_chars=len(answer or ''))
+        self._trace.count('openai.completion_tokens_est', estimate_tokens(len(answer or '')))
+        return answer
+
+    # Helper timing a streamed completion until its last delta
+    def _stream(self, args, kwargs, prompt_chars):
+        completion_chars = 0
+        with self._trace.span('openai.chat', model=kwargs.get('model'), prompt_chars=prompt_chars, stream=True) as span:
+            for delta in self._client.chat_completion(*args, **kwargs):
+                if delta and not completion_chars:
+                    span.set(first_token_ms=round((time.perf_counter() - span._started) * 1000, 1))
+                completion_chars += len(delta or '')
+                yield delta
+            span.set(completion_chars=completion_chars)
+        self._trace.count('openai.completion_tokens_est', estimate_tokens(completion_chars))
+
+    def create_embedding(self, text):
+        self._trace.count('openai.embedding.calls')
+        self._trace.count('openai.embedding_tokens_est', estimate_tokens(len(text or '')))
+        with self._trace.span('openai.embedding', inputs=1, chars=len(text or '')):
+            return self._client.create_embedding(text)
+
+    def create_embeddings(self, texts):
+        chars = sum(len(t or '') for t in texts)
+        self._trace.count('openai.embedding.calls')
+        self._trace.count('openai.embedding_tokens_est', estimate_tokens(chars))
+        with self._trace.span('openai.embedding', inputs=len(texts), chars=chars):
+            return self._client.create_embeddings(texts)
+
+# Proxy of BlobServiceClient
+class _TracedBlobService(_Proxy):
+    def get_container_client(self, container):
+        return _TracedContainer(self._client.get_container_client(container), self._trace)
+
+    def get_blob_client(self, container, blob):
+        return _TracedBlob(self._client.get_blob_client(container, blob), self._trace)
+
+# Proxy of ContainerClient
+class _TracedContainer(_Proxy):
+    def get_blob_client(self, blob):
+        return _TracedBlob(self._client.get_blob_client(blob), self._trace)
+
+    def list_blobs(self, *args, **kwargs):
+        self._trace.count('blob.list.calls')
+        with self._trace.span('blob.list', prefix=kwargs.get('name_starts_with')):
+            # Listing is paged lazily, so the pages are fetched inside the span
+            return list(self._client.list_blobs(*args, **kwargs))
+
+    def delete_blob(self, blob, *args, **kwargs):
+        self._trace.count('blob.delete.calls')
+        with self._trace.span('blob.delete', blob=getattr(blob, 'name', blob)):
+            return self._client.delete_blob(blob, *args, **kwargs)
+
+# Proxy of BlobClient
+class _TracedBlob(_Proxy):
+    def __init__(self, client, trace):
+        super().__init__(client, trace)
+        self._name = getattr(client, 'blob_name', None)
+
+    def download_blob(self, *args, **kwargs):
+        self._trace.count('blob.download.calls')
+        with self._trace.span('blob.download', blob=self._name, offset=kwargs.get('offset'), length=kwargs.get('length')) as span:
+            downloader = self._client.download_blob(*args, **kwargs)
+            span.set(size=getattr(downloader, 'size', None))
+        return _TracedDownloader(downloader, self._trace, self._name)
+
+    def upload_blob(self, data, *args, **kwargs):
+        size = len(data) if isinstance(data, (bytes, bytearray, str)) else None
+        self._trace.count('blob.upload.calls')
+        if size is not None:
+            self._trace.count('blob.bytes_out', size)
+        with self._trace.span('blob.upload', blob=self._name, bytes=size):
+            return self._client.upload_blob(data, *args, **kwargs)
+
+    def get_blob_properties(self, *args, **kwargs):
+        self._trace.count('blob.properties.calls')
+        with self._trace.span('blob.properties', blob=self._name):
+            return self._client.get_blob_properties(*args, **kwargs)
+
+    def delete_blob(self, *args, **kwargs):
+        self._trace.count('blob.delete.calls')
+        with self._trace.span('blob.delete', blob=self._name):
+            return self._client.delete_blob(*args, **kwargs)
+
+# Proxy of StorageStreamDownloader: reading the body is timed and its bytes are counted
+class _TracedDownloader(_Proxy):
+    def __init__(self, client, trace, blob_name):
+        super().__init__(client, trace)
+        self._blob_name = blob_name
+
+    def readall(self):
+        with self._trace.span('blob.read', blob=self._blob_name) as span:
+            data = self._client.readall()
+            span.set(bytes=len(data))
+        self._trace.count('blob.bytes_in', len(data))
+        return data
+
+    def readinto(self, stream):
+        with self._trace.span('blob.read', blob=self._blob_name) as span:
+            size = self._client.readinto(stream)
+            span.set(bytes=size)
+        self._trace.count('blob.bytes_in', size or 0)
+        return size
+
+    def chunks(self):
+        for chunk in self._client.chunks():
+            self._trace.count('blob.bytes_in', len(chunk))
+            yield chunk
+
+# Proxy of SearchClient
+class _TracedSearch(_Proxy):
+    def search(self, *args, **kwargs):
+        self._trace.count('search.query.calls')
+        with self._trace.span('search.query', top=kwargs.get('top')) as span:
+            # Results are paged lazily, so they are fetched inside the span
+            results = list(self._client.search(*args, **kwargs))
+            span.set(results=len(results))
+        return results
+
+    def merge_or_upload_documents(self, documents, *args, **kwargs):
+        return self._write('search.upload', self._client.merge_or_upload_documents, documents, args, kwargs)
+
+    def upload_documents(self, documents, *args, **kwargs):
+        return self._write('search.upload', self._client.upload_documents, documents, args, kwargs)
+
+    def delete_documents(self, documents, *args, **kwargs):
+        return self._write('search.delete', self._client.delete_documents, documents, args, kwargs)
+
+    # Helper timing a batch write and counting its documents
+    def _write(self, name, method, documents, args, kwargs):
+        self._trace.count(name + '.calls')
+        self._trace.count(name + '.documents', len(documents))
+        with self._trace.span(name, documents=len(documents)):
+            return method(documents, *args, **kwargs)
+
+# Proxy of SearchIndexClient
+class _TracedSearchIndex(_Proxy):
+    def create_or_update_index(self, *args, **kwargs):
+        with self._trace.span('search.index_schema'):
+            return self._client.create_or_update_index(*args, **kwargs)
+
+# Proxy of DocumentAnalysisClient: the analysis is timed until its result is read
+class _TracedDocumentIntelligence(_Proxy):
+    def begin_analyze_document_from_url(self, *args, **kwargs):
+        self._trace.count('document_intelligence.calls')
+        with self._trace.span('document_intelligence.begin', pages=kwargs.get('pages')):
+            poller = self._client.begin_analyze_document_from_url(*args, **kwargs)
+        return _TracedPoller(poller, self._trace, kwargs.get('pages'))
+
+    def begin_analyze_document(self, *args, **kwargs):
+        self._trace.count('document_intelligence.calls')
+        with self._trace.span('document_intelligence.begin', pages=kwargs.get('pages')):
+            poller = self._client.begin_analyze_document(*args, **kwargs)
+        return _TracedPoller(poller, self._trace, kwargs.get('pages'))
+
+# Proxy of the Document Intelligence poller
+class _TracedPoller(_Proxy):
+    def __init__(self, client, trace, pages):
+        super().__init__(client, trace)
+        self._pages = pages
+
+    def result(self, *args, **kwargs):
+        with self._trace.span('document_intelligence.analyze', pages=self._pages) as span:
+            result = self._client.result(*args, **kwargs)
+            span.set(analyzed_pages=len(getattr(result, 'pages', None) or []))
+        self._trace.count('document_intelligence.pages', len(getattr(result, 'pages', None) or []))
+        return result
+
+# Proxy of QueueClient
+class _TracedQueue(_Proxy):
+    def send_message(self, *args, **kwargs):
+        self._trace.count('queue.send.calls')
+        with self._trace.span('queue.send'):
+            return self._client.send_message(*args, **kwargs)
+
+# Proxy class of each client kind
+_PROXIES = {
+    'openai': _TracedOpenAI,
+    'blob': _TracedBlobService,
+    'search': _TracedSearch,
+    'search_index': _TracedSearchIndex,
+    'document_intelligence': _TracedDocumentIntelligence,
+    'queue': _TracedQueue
+}
@@ -0,0 +1,432 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .azure_clients import get_document_intelligence_client, get_blob_client, get_openai_client, get_search_client, get_search_index_client
+from .document_analysis import analyze_structure, StructureDetector
+from .knowledge_map import KnowledgeMapBuilder
+from .embedding_store import empty_embedding_index, load_embedding_index, save_embedding_index, invalidate_embedding_index, build_section_documents, get_section_documents, section_key
+from .indexing import upload_search_documents, delete_search_documents
+from .chunking import join_pages
+from .vector_store import build_vector_matrix, save_vectors, delete_vectors
+from .search_index import ensure_search_index
+from .routing import embed_knowledge_map, strip_summary_embeddings
+from .answer_cache import existing_answer_cache
+from .page_store import save_page_store, open_page_store
+from .jobs import JobTracker, load_job, save_checkpoint, load_checkpoint, delete_checkpoints, checkpoint_prefix, STAGES
+from .extraction import DocumentIntelligenceExtractor, PdfTextExtractor, extract_pages
+from .content_store import (
+    content_hash, content_artifact_name, find_content, load_manifest, save_manifest, release_manifest,
+    save_pointer, remove_pointer, add_pending_pointer, remove_pending_pointer, publish_pending_pointers
+)
+from .telemetry import start_trace, current_trace
+
+# Environment variables for Azure resources (shared by the upload and upload worker functions)
+BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
+FORMRECOGNIZER_ENDPOINT = os.environ.get('FORMRECOGNIZER_ENDPOINT')  # Document Intelligence endpoint
+FORMRECOGNIZER_KEY = os.environ.get('FORMRECOGNIZER_KEY')  # Document Intelligence key
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')  # Azure OpenAI key
+OPENAI_ENDPOINT = os.environ.get('OPENAI_ENDPOINT')  # Azure OpenAI endpoint
+AI_SEARCH_ENDPOINT = os.environ.get('AI_SEARCH_ENDPOINT')  # Azure AI Search endpoint
+AI_SEARCH_KEY = os.environ.get('AI_SEARCH_KEY')  # Azure AI Search key
+AI_SEARCH_INDEX = os.environ.get('AI_SEARCH_INDEX', 'readpilot-chunks')  # Default search index name
+EAGER_INDEXING = os.environ.get('EAGER_INDEXING', 'false').lower() == 'true'  # Embed all chapters at upload instead of on first query
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '16'))  # Texts per embedding request
+SEARCH_UPLOAD_BATCH_SIZE = int(os.environ.get('SEARCH_UPLOAD_BATCH_SIZE', '500'))  # Documents per AI Search indexing request
+INDEXING_CONCURRENCY = int(os.environ.get('INDEXING_CONCURRENCY', '4'))  # Embedding/indexing requests in flight at once
+RETRIEVER_BACKEND = os.environ.get('RETRIEVER_BACKEND', 'azure')  # 'azure' (AI Search) or 'local' (in-process vectors)
+AI_SEARCH_MANAGE_INDEX = os.environ.get('AI_SEARCH_MANAGE_INDEX', 'false').lower() == 'true'  # Create/update the index schema on first upload
+EMBEDDING_DIMENSIONS = int(os.environ.get('EMBEDDING_DIMENSIONS', '1536'))  # Embedding size for the index schema
+PAGE_STORE_BLOCK_PAGES = int(os.environ.get('PAGE_STORE_BLOCK_PAGES', '8'))  # Pages compressed together in the page store
+KNOWLEDGE_MAP_CONCURRENCY = int(os.environ.get('KNOWLEDGE_MAP_CONCURRENCY', '4'))  # Chapter summaries requested at once
+KNOWLEDGE_MAP_TIMEOUT = float(os.environ.get('KNOWLEDGE_MAP_TIMEOUT', '120'))  # Seconds before a chapter summary is given up
+CHUNK_MAX_SIZE = int(os.environ.get('CHUNK_MAX_SIZE', '1000'))  # Maximum chunk size (characters, or tokens with CHUNK_ENCODING)
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '200'))  # Overlap between windows of oversized paragraphs/sections
+CHUNK_ENCODING = os.environ.get('CHUNK_ENCODING') or None  # tiktoken encoding for token-based sizing, e.g. 'cl100k_base' (unset = characters)
+EXTRACTOR = os.environ.get('EXTRACTOR', 'document_intelligence')  # 'document_intelligence' or 'local' (pypdf text layer, born-digital PDFs only)
+EXTRACTION_BATCH_PAGES = int(os.environ.get('EXTRACTION_BATCH_PAGES', '50'))  # Pages per extraction request
+EXTRACTION_CONCURRENCY = int(os.environ.get('EXTRACTION_CONCURRENCY', '4'))  # Page ranges analysed by Document Intelligence at once
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '900'))  # Seconds without a status update after which a job building some content counts as lost
+
+# Pages scanned for a table of contents (sections can only be fixed once these are extracted)
+TOC_SCAN_PAGES = 50
+
+# Set once the AI Search index schema has been ensured by this process
+_search_index_ready = False
+
+# Helper function to create or update the AI Search index schema once per process
+def ensure_chunk_index():
+    """
+    Makes sure the chunk index has filterable doc_id/section/chapter fields,
+    so chat queries can pre-filter by document and chapter.
+    """
+    global _search_index_ready
+    if not _search_index_ready:
+        index_client = get_search_index_client(AI_SEARCH_ENDPOINT, AI_SEARCH_KEY)
+        ensure_search_index(index_client, AI_SEARCH_INDEX, EMBEDDING_DIMENSIONS)
+        _search_index_ready = True
+
+# Helper function to create the extractor selected by EXTRACTOR
+def get_extractor(blob_client, blob_name, blob_url):
+    """
+    Returns the page extractor for a document.
+    Args:
+        blob_client: BlobServiceClient instance
+        blob_name: Name of the PDF blob
+        blob_url: URL of the PDF blob (read by Document Intelligence)
+    Returns:
+        DocumentIntelligenceExtractor or PdfTextExtractor
+    """
+    if EXTRACTOR == 'local':
+        blob = blob_client.get_container_client(BLOB_CONTAINER).get_blob_client(blob_name)
+        return PdfTextExtractor(blob.download_blob().readall(), batch_pages=EXTRACTION_BATCH_PAGES)
+    form_client = get_document_intelligence_client(FORMRECOGNIZER_ENDPOINT, FORMRECOGNIZER_KEY)
+    return DocumentIntelligenceExtractor(form_client, blob_url, batch_pages=EXTRACTION_BATCH_PAGES, max_workers=EXTRACTION_CONCURRENCY)
+
+# Runs (or resumes) an upload job
+def run_upload_job(job_id, final_attempt=True):
+    """
+    Processes the document of a queued job and records progress in the job record.
+    Stages finished by an earlier attempt are loaded from their checkpoints instead of being redone.
+    Spans are recorded in the caller's trace (a sync upload request), else in a trace of the job.
+    Args:
+        job_id: Id of the job (see jobs.create_job)
+        final_attempt: False if a failure will be retried (the job is then marked 'retrying', not 'failed')
+    Returns:
+        The final job dict, or None for an unknown job id
+    Raises:
+        The stage's exception if processing fails
+    """
+    trace = current_trace()
+    owned = trace is None
+    if owned:
+        trace = start_trace('upload_job', job_id=job_id)
+    try:
+        blob_client = get_blob_client(BLOB_CONN_STR)
+        job = load_job(blob_client, BLOB_CONTAINER, job_id)
+        if job is None or job['status'] == 'succeeded' or job.get('stale'):
+            # Unknown job, a duplicate delivery of a finished one, or a late delivery of one given up as lost
+            return job
+        tracker = JobTracker(blob_client, BLOB_CONTAINER, job)
+        tracker.start()
+        try:
+            result = run_upload_pipeline(tracker, blob_client, trace)
+        except Exception as e:
+            tracker.fail(str(e) or type(e).__name__, final=final_attempt)
+            if owned:
+                # Sync runs are logged by the upload request
+                logging.exception("Upload job %s failed in stage %s", job_id, trace.stage)
+                trace.finish(e)
+            raise
+        tracker.succeed(result)
+        delete_checkpoints(blob_client, BLOB_CONTAINER, job_id)
+        return tracker.job
+    finally:
+        if owned:
+            trace.finish()
+
+# Runs the upload stages of a job
+def run_upload_pipeline(tracker, blob_client, trace):
+    """
+    Pipeline stages:
+    0. deduplicate: Hash the document (checking a client-provided hash) and reuse its content if it
+       was processed before; the remaining stages are then skipped.
+    1. extract: Extract page texts in page-range batches (see shared/extraction.py).
+    2. analyze: Detect index (TOC) and page offset, or chapter headings, and segment the document.
+    3. summarize: Generate knowledge map using GPT-4, with summary embeddings for routing.
+    4. index: With EAGER_INDEXING, chunk and embed every chapter.
+    5. store: Store knowledge map and page store, invalidate cached answers and the old
+       chunk/embedding index, and publish the new one.
+    Summarize and index start on a chapter as soon as all its pages are extracted and its
+    boundaries cannot change anymore, so they overlap with extraction and with each other.
+    Args:
+        tracker: JobTracker of the job
+        blob_client: BlobServiceClient instance
+        trace: Trace receiving a span per stage (see shared/telemetry.py)
+    Returns:
+        Result dict (knowledge map metadata)
+    """
+    job = tracker.job
+    # Hashing streams the whole document, so it runs here rather than in the upload request
+    with trace.span('deduplicate', stage=True) as span:
+        result = _deduplicate_stage(tracker, blob_client)
+        span.set(hit=result is not None)
+    if result is not None:
+        return result
+    gpt_client = get_openai_client(OPENAI_API_KEY, OPENAI_ENDPOINT)
+    builder = None
+    if not tracker.is_done('summarize'):
+        builder = KnowledgeMapBuilder(
+            gpt_client, max_workers=KNOWLEDGE_MAP_CONCURRENCY, timeout=KNOWLEDGE_MAP_TIMEOUT,
+            on_progress=lambda done, total: tracker.stage_progress('summarize', done, total)
+        )
+    indexer = None
+    if EAGER_INDEXING and not tracker.is_done('index'):
+        indexer = ChapterIndexer(gpt_client, artifact_name(job))
+
+    def start_sections(sections, pages):
+        # Hand chapters whose pages are complete to the summarizer and the indexer
+        if builder is not None and sections:
+            tracker.start_stage('summarize', once=True)
+        if indexer is not None and sections:
+            tracker.start_stage('index', once=True)
+        for section in sections:
+            if builder is not None:
+                builder.submit(section, pages)
+            if indexer is not None:
+                indexer.submit(_chapter(section), pages)
+
+    # Summarize and index overlap extraction, so their spans only time the wait for the remaining chapters
+    with trace.span('extract', stage=True) as span:
+        pages, headings = _extract_stage(tracker, blob_client, start_sections)
+        span.set(pages=len(pages))
+    with trace.span('analyze', stage=True) as span:
+        sections = _analyze_stage(tracker, blob_client, pages, headings)
+        span.set(sections=len(sections))
+    with trace.span('summarize', stage=True):
+        knowledge_map = _summarize_stage(tracker, blob_client, gpt_client, builder, sections, pages)
+    if EAGER_INDEXING:
+        with trace.span('index', stage=True):
+            embedding_index = _index_stage(tracker, blob_client, indexer, sections, pages)
+    else:
+        embedding_index = None
+        tracker.skip_stage('index')
+    with trace.span('store', stage=True):
+        return _store_stage(tracker, blob_client, pages, knowledge_map, embedding_index)
+
+# Stage 0: hash the document, verify the client's hash and reuse content processed before
+def _deduplicate_stage(tracker, blob_client):
+    """
+    The upload request trusts a client-provided hash for its lookup; this stage checks it against
+    the blob. A wrong hash releases what the request set up under it (pointer, pending pointer,
+    reserved manifest) and the document is handled under its real hash.
+    Returns:
+        The job result if the content needs no processing (deduplicated), else None
+    """
+    job = tracker.job
+    if job.get('content_verified'):
+        return None
+    blob_name = job['blob_name']
+    claimed = job.get('content_hash')
+    sha256 = content_hash(blob_client, BLOB_CONTAINER, blob_name)
+    if claimed and claimed != sha256:
+        logging.warning("Upload job %s: the client's sha256 does not match %s", tracker.job_id, blob_name)
+        remove_pointer(blob_client, BLOB_CONTAINER, blob_name, claimed)
+        remove_pending_pointer(blob_client, BLOB_CONTAINER, claimed, blob_name)
+        release_manifest(blob_client, BLOB_CONTAINER, claimed, tracker.job_id)
+    manifest, running_job = (None, None) if job.get('force') else find_content(blob_client, BLOB_CONTAINER, sha256, JOB_STALE_SECONDS)
+    tracker.set_content(sha256, content_artifact_name(sha256))
+    result = {'file_name': blob_name, 'pdf_url': job['blob_url'], 'deduplicated': True, 'content_hash': sha256}
+    if manifest is not None and running_job is None:
+        # Already processed: no extraction or model calls
+        save_pointer(blob_client, BLOB_CONTAINER, blob_name, sha256)
+        result = dict(manifest['result'], **result)
+    elif running_job is not None and running_job['job_id'] != tracker.job_id:
+        # Another job is building the content: this blob gets its pointer when that job stores it
+        add_pending_pointer(blob_client, BLOB_CONTAINER, sha256, blob_name)
+        if (load_manifest(blob_client, BLOB_CONTAINER, sha256) or {}).get('status') == 'ready':
+            publish_pending_pointers(blob_client, BLOB_CONTAINER, sha256)
+        result['content_job_id'] = running_job['job_id']
+    else:
+        # Processed by this job; later uploads of the same bytes wait for it
+        if running_job is None:
+            save_manifest(blob_client, BLOB_CONTAINER, sha256, 'processing', job_id=tracker.job_id)
+        return None
+    for stage, _ in STAGES:
+        tracker.skip_stage(stage)
+    return result
+
+# Stage 1: extract page texts and layout headings (checkpointed as a page store under the job's prefix)
+def _extract_stage(tracker, blob_client, start_sections):
+    checkpoint = checkpoint_prefix(tracker.job_id) + 'document'
+    if tracker.is_done('extract'):
+        store = open_page_store(blob_client, BLOB_CONTAINER, checkpoint)
+        headings = load_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'headings.json') or {}
+        return store.read_range(0, len(store)), {int(page): texts for page, texts in headings.items()}
+    tracker.start_stage('extract')
+    extractor = get_extractor(blob_client, tracker.job['blob_name'], tracker.job['blob_url'])
+    detector = StructureDetector(TOC_SCAN_PAGES)
+
+    def on_batch(accumulator):
+        tracker.stage_progress('extract', accumulator.contiguous, extractor.page_count)
+        sections = stable_sections(accumulator, extractor.page_count, extractor.headings, detector)
+        if sections:
+            start_sections(sections, accumulator.prefix())
+
+    pages = extract_pages(extractor, on_batch)
+    save_page_store(blob_client, BLOB_CONTAINER, checkpoint, pages, PAGE_STORE_BLOCK_PAGES)
+    save_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'headings.json', extractor.headings)
+    tracker.finish_stage('extract')
+    return pages, extractor.headings
+
+# Returns the sections that are fully extracted and final while extraction is still running
+def stable_sections(accumulator, page_count=None, headings=None, detector=None):
+    """
+    A section is final once the TOC pages are extracted and its end does not depend on the
+    document length: every TOC (or heading) section but the last, or, with a known page count,
+    any section.
+    Args:
+        accumulator: PageAccumulator of the extracted pages
+        page_count: Total number of pages, if the extractor knows it up front
+        headings: Optional dict {page index: [heading texts]} from the layout model
+        detector: Optional StructureDetector reused across calls for the same document
+    Returns:
+        List of sections whose pages are all in the contiguous prefix
+    """
+    contiguous = accumulator.contiguous
+    if contiguous < TOC_SCAN_PAGES and contiguous != page_count:
+        return []
+    prefix = accumulator.prefix()
+    detector = detector or StructureDetector(TOC_SCAN_PAGES)
+    sections, source = detector.analyze(prefix, headings, page_count=page_count)
+    if source == 'synthetic' and page_count is None:
+        # Synthetic sections are sized by the document length
+        return []
+    if page_count is None:
+        sections = sections[:-1]
+    return [s for s in sections if s['start_page'] < s['end_page'] <= contiguous]
+
+# Stage 2: detect the TOC and segment the document into sections
+def _analyze_stage(tracker, blob_client, pages, headings):
+    if tracker.is_done('analyze'):
+        return load_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'sections.json')
+    tracker.start_stage('analyze')
+    # Scan up to 50 pages for multi-page TOC; its page refs are mapped to pages by the offset
+    # where its chapters actually start. Without a TOC, chapter headings are used.
+    sections, _ = analyze_structure(pages, headings, max_toc_pages=TOC_SCAN_PAGES)
+    save_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'sections.json', sections)
+    tracker.finish_stage('analyze')
+    return sections
+
+# Stage 3: generate the knowledge map (chapter summaries + summary embeddings)
+def _summarize_stage(tracker, blob_client, gpt_client, builder, sections, pages):
+    if tracker.is_done('summarize'):
+        return load_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'knowledge_map.json')
+    tracker.start_stage('summarize', once=True)
+    # Chapters started during extraction are reused if the final segmentation kept them
+    knowledge_map = builder.build(sections, pages)
+    # Embed chapter summaries once, so chat can route queries by similarity instead of a GPT-4 call
+    embed_knowledge_map(knowledge_map, gpt_client, batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY)
+    save_checkpoint(blob_client, BLOB_CONTAINER, tracker.job_id, 'knowledge_map.json', knowledge_map)
+    tracker.finish_stage('summarize')
+    return knowledge_map
+
+# Stage 4: chunk and embed every chapter (EAGER_INDEXING only)
+def _index_stage(tracker, blob_client, indexer, sections, pages):
+    checkpoint = checkpoint_prefix(tracker.job_id) + 'document'
+    if tracker.is_done('index'):
+        return load_embedding_index(blob_client, BLOB_CONTAINER, checkpoint)
+    tracker.start_stage('index', once=True)
+    embedding_index = indexer.build([_chapter(s) for s in sections], pages)
+    save_embedding_index(blob_client, BLOB_CONTAINER, checkpoint, embedding_index, replace=True)
+    tracker.finish_stage('index')
+    return embedding_index
+
+# Helper to turn a section into a knowledge-map-shaped chapter (the map itself may still be summarizing)
+def _chapter(section):
+    return {'chapter_name': section['title'], 'start_page': section['start_page'], 'end_page': section['end_page']}
+
+# Chunks and embeds chapters on a thread pool as they are submitted
+class ChapterIndexer:
+    """
+    Builds the chunk/embedding index chapter by chapter, so eager indexing can start on
+    early chapters while later pages are still being extracted. build() merges the chapters
+    of the final segmentation into one index.
+    """
+
+    def __init__(self, gpt_client, blob_name, max_workers=2):
+        self.gpt_client = gpt_client
+        self.blob_name = blob_name
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def submit(self, chapter, pages):
+        # Starts indexing a chapter unless it was already submitted; its pages must be available
+        key = (chapter['chapter_name'], section_key(chapter))
+        if key not in self._futures:
+            text, starts = join_pages(pages[chapter['start_page']:chapter['end_page']])
+            self._futures[key] = self._pool.submit(self._index, chapter, text, starts)
+
+    def build(self, chapters, pages):
+        # Waits for the given chapters (submitting any that are missing) and merges their indexes
+        for chapter in chapters:
+            self.submit(chapter, pages)
+        try:
+            embedding_index = empty_embedding_index(self.blob_name)
+            for chapter in chapters:
+                part = self._futures[(chapter['chapter_name'], section_key(chapter))].result()
+                embedding_index['sections'].update(part['sections'])
+                embedding_index['embeddings'].update(part['embeddings'])
+            return embedding_index
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # Helper indexing one chapter into its own index
+    def _index(self, chapter, text, starts):
+        index = empty_embedding_index(self.blob_name)
+        build_section_documents(
+            index, self.blob_name, [chapter], [text], self.gpt_client,
+            batch_size=EMBEDDING_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY, page_starts=[starts],
+            max_chunk_size=CHUNK_MAX_SIZE, chunk_overlap=CHUNK_OVERLAP, encoding=CHUNK_ENCODING
+        )
+        return index
+
+# Helper returning the base name of a job's derived artifacts
+def artifact_name(job):
+    # content/<sha256> for deduplicated uploads (see shared/content_store.py), else the blob name
+    return job.get('artifact_name') or job['blob_name']
+
+# Stage 5: publish the document's artifacts and invalidate those of any previous upload
+def _store_stage(tracker, blob_client, pages, knowledge_map, embedding_index):
+    tracker.start_stage('store')
+    job = tracker.job
+    blob_name = job['blob_name']
+    name = artifact_name(job)
+    # Store knowledge map and per-page text in Blob Storage
+    map_blob_name = name + '.knowledge_map.json'  # Name for the knowledge map blob
+    map_blob = blob_client.get_container_client(BLOB_CONTAINER).get_blob_client(map_blob_name)
+    map_blob.upload_blob(json.dumps(knowledge_map), overwrite=True)
+    # Store per-page text for later chapter extraction, as compressed blocks chat can range-read
+    pages_blob_name = save_page_store(blob_client, BLOB_CONTAINER, name, pages, PAGE_STORE_BLOCK_PAGES)
+
+    # Invalidate cached answers, and the chunk/embedding index (and vectors) of any previous upload.
+    # Other instances see a new knowledge map ETag and miss their caches.
+    answer_cache = existing_answer_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate(blob_name)
+        answer_cache.invalidate(name)
+    stale_ids = []
+    # Artifacts kept under the blob name by uploads before deduplication are replaced by the shared ones
+    for old_name in {name, blob_name}:
+        stale_ids.extend(invalidate_embedding_index(blob_client, BLOB_CONTAINER, old_name))
+        delete_vectors(blob_client, BLOB_CONTAINER, old_name)
+    search_client = get_search_client(AI_SEARCH_ENDPOINT, AI_SEARCH_KEY, AI_SEARCH_INDEX) if AI_SEARCH_ENDPOINT else None
+    if search_client is not None and AI_SEARCH_MANAGE_INDEX:
+        ensure_chunk_index()
+    if search_client is not None and stale_ids:
+        # Remove chunks of the previous version so they are not retrieved anymore
+        delete_search_documents(search_client, stale_ids, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY)
+    if embedding_index is not None:
+        # Publish the eagerly built index
+        save_embedding_index(blob_client, BLOB_CONTAINER, name, embedding_index, replace=True)
+        if RETRIEVER_BACKEND == 'local':
+            save_vectors(blob_client, BLOB_CONTAINER, name, build_vector_matrix(embedding_index))
+        elif search_client is not None:
+            docs = [d for entry in knowledge_map for d in get_section_documents(embedding_index, entry)]
+            upload_search_documents(search_client, docs, batch_size=SEARCH_UPLOAD_BATCH_SIZE, max_workers=INDEXING_CONCURRENCY)
+    result = {
+        'file_name': blob_name,
+        'pdf_url': job['blob_url'],
+        'knowledge_map_blob': map_blob_name,
+        'pages_blob': pages_blob_name,
+        'knowledge_map': strip_summary_embeddings(knowledge_map)
+    }
+    if job.get('content_hash'):
+        # Chat follows the pointer from now on; later uploads of the same bytes reuse these artifacts
+        save_pointer(blob_client, BLOB_CONTAINER, blob_name, job['content_hash'])
+        save_manifest(blob_client, BLOB_CONTAINER, job['content_hash'], 'ready', job_id=job['job_id'], result=result)
+        # Uploads of the same bytes that arrived while this job ran get their pointers now
+        publish_pending_pointers(blob_client, BLOB_CONTAINER, job['content_hash'])
+    tracker.finish_stage('store')
+    return result
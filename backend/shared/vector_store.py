@@ -0,0 +1,294 @@
+import io
+import os
+import tempfile
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError
+
+# Local directory where vector files are cached for memory mapping
+VECTOR_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'readpilot-vectors')
+# Row count from which 'auto' mode switches to approximate search
+APPROXIMATE_MIN_ROWS = 20000
+# Filtered row count from which approximate mode probes clusters instead of scoring the subset exactly
+APPROXIMATE_MIN_FILTERED_ROWS = 2048
+# Rows scored per block when assigning rows to clusters (bounds temporary memory)
+_BLOCK_ROWS = 8192
+# Clusterings of memory-mapped vector files, reused across queries in a warm process
+_IVF_CACHE = {}
+_IVF_CACHE_SIZE = 8
+
+# Helper to build the blob name of a document's vector file
+def vectors_blob_name(blob_name):
+    # The vector file lives next to the page store and .embeddings.json blobs
+    return blob_name + '.vectors.npy'
+
+# Lists the chunks of a chunk/embedding index in a stable row order
+def index_rows(index):
+    """
+    Returns the chunk metadata of an embedding index in the row order used by the vector file.
+    Sections are ordered by page range, chunks keep their order within a section.
+    Args:
+        index: Chunk/embedding index dict (see embedding_store)
+    Returns:
+        List of chunk metadata dicts
+    """
+    rows = []
+    for key in sorted(index['sections'], key=lambda k: tuple(int(p) for p in k.split('-'))):
+        rows.extend(index['sections'][key]['chunks'])
+    return rows
+
+# Builds the normalized embedding matrix of a chunk/embedding index
+def build_vector_matrix(index, rows=None):
+    """
+    Builds a float32 matrix with one L2-normalized embedding per row.
+    Args:
+        index: Chunk/embedding index dict
+        rows: Optional precomputed index_rows(index)
+    Returns:
+        NumPy array of shape (len(rows), dim)
+    """
+    rows = index_rows(index) if rows is None else rows
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.asarray([index['embeddings'][r['chunk_hash']] for r in rows], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# Saves a vector matrix to Blob Storage as a .npy file
+def save_vectors(blob_client, container, blob_name, matrix):
+    # The .npy format is compact (raw float32) and can be memory-mapped once downloaded
+    buffer = io.BytesIO()
+    np.save(buffer, matrix, allow_pickle=False)
+    blob = blob_client.get_container_client(container).get_blob_client(vectors_blob_name(blob_name))
+    blob.upload_blob(buffer.getvalue(), overwrite=True)
+
+# Deletes a document's vector file, e.g. when the document is re-uploaded
+def delete_vectors(blob_client, container, blob_name):
+    blob = blob_client.get_container_client(container).get_blob_client(vectors_blob_name(blob_name))
+    try:
+        blob.delete_blob()
+    except ResourceNotFoundError:
+        pass
+
+# Builds the per-row document id and section key arrays used to filter searches
+def row_filters(rows):
+    """
+    Args:
+        rows: Chunk metadata dicts in matrix row order (see index_rows)
+    Returns:
+        Tuple (doc_ids, sections) of NumPy string arrays aligned with the rows ('' for a missing doc_id)
+    """
+    doc_ids = np.asarray([row.get('doc_id') or '' for row in rows], dtype=str)
+    sections = np.asarray([row.get('section') or f"{row['start_page']}-{row['end_page']}" for row in rows], dtype=str)
+    return doc_ids, sections
+
+# Loads a document's vector file from Blob Storage as a memory-mapped matrix
+def load_vectors(blob_client, container, blob_name, cache_dir=VECTOR_CACHE_DIR):
+    """
+    Downloads the vector file to a local cache (once per blob version) and memory-maps it.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        cache_dir: Local directory for cached vector files
+    Returns:
+        Read-only memory-mapped NumPy array, or None if no vector file exists
+    """
+    blob = blob_client.get_container_client(container).get_blob_client(vectors_blob_name(blob_name))
+    try:
+        etag = blob.get_blob_properties().etag.strip('"')
+    except ResourceNotFoundError:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{vectors_blob_name(blob_name).replace('/', '_')}.{etag}")
+    if not os.path.exists(path):
+        # Write to a temporary name first so concurrent invocations never map a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            blob.download_blob().readinto(f)
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r', allow_pickle=False)
+
+# In-process vector search over one document's chunks
+class LocalVectorRetriever:
+    """
+    Exact or approximate top-k search over a matrix of normalized embeddings.
+    Exact mode scores every row with one matrix-vector product.
+    Approximate mode clusters rows (spherical k-means, IVF-style) and only scores
+    the rows of the n_probe clusters closest to the query.
+    Filtered searches probe too when the filtered subset is large, and keep the probed rows
+    inside the subset; small subsets are scored exactly. last_path records the path of the
+    last search: 'exact', 'approximate', 'filtered' or 'filtered+approximate'.
+    """
+
+    def __init__(self, matrix, rows, mode='auto', n_probe=8, min_filtered_rows=APPROXIMATE_MIN_FILTERED_ROWS, filters=None):
+        """
+        Args:
+            matrix: (n, dim) array of L2-normalized embeddings (may be memory-mapped)
+            rows: List of n chunk metadata dicts, aligned with matrix rows
+            mode: 'exact', 'approximate', or 'auto' (approximate from APPROXIMATE_MIN_ROWS rows)
+            n_probe: Number of clusters scored per query in approximate mode
+            min_filtered_rows: Filtered row count from which approximate mode probes clusters
+            filters: Optional precomputed row_filters(rows), e.g. from the artifact cache
+        """
+        if len(rows) != matrix.shape[0]:
+            raise ValueError("Vector matrix and row metadata are out of sync.")
+        self.matrix = matrix
+        self.rows = rows
+        self.doc_ids, self.sections = filters if filters is not None else row_filters(rows)
+        self.approximate = mode == 'approximate' or (mode == 'auto' and len(rows) >= APPROXIMATE_MIN_ROWS)
+        self.n_probe = n_probe
+        self.min_filtered_rows = min_filtered_rows
+        self.last_path = None
+        self._ivf = None
+
+    def index_documents(self, docs):
+        # Rows are derived from the chunk/embedding index, which is already updated and saved
+        return 0
+
+    def search(self, query_embedding, top=3, doc_id=None, sections=None):
+        """
+        Returns the top chunks for a query embedding, best first.
+        Filters are applied before scoring: only rows of the given document and sections are scored
+        (in approximate mode, only those that also fall into the probed clusters).
+        Args:
+            query_embedding: Query embedding (list of floats)
+            top: Number of results
+            doc_id: Document id to search in (None = all rows)
+            sections: Section keys to search in (None = all sections)
+        Returns:
+            List of dicts: [{id, chunk, chapter, section, doc_id, start_page, end_page, start_offset, end_offset, score}]
+        """
+        if not self.rows or top <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if doc_id is not None or sections is not None:
+            candidates = self._filter_rows(doc_id, sections)
+            self.last_path = 'filtered'
+            if self.approximate and len(candidates) >= self.min_filtered_rows:
+                # Probe the clusters, then keep the probed rows inside the filter; if too few
+                # remain for top results, the subset is scored exactly
+                allowed = np.zeros(len(self.rows), dtype=bool)
+                allowed[candidates] = True
+                probed = self._probe(query)
+                probed = probed[allowed[probed]]
+                if len(probed) >= top:
+                    candidates = np.sort(probed)
+                    self.last_path = 'filtered+approximate'
+            scores = self.matrix[candidates] @ query
+        elif self.approximate:
+            candidates = self._probe(query)
+            scores = self.matrix[candidates] @ query
+            self.last_path = 'approximate'
+        else:
+            candidates = None
+            scores = self.matrix @ query
+            self.last_path = 'exact'
+        if len(scores) == 0:
+            return []
+        k = min(top, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for i in best:
+            row = self.rows[int(candidates[i] if candidates is not None else i)]
+            results.append({
+                'id': row.get('id'),
+                'chunk': row['chunk'],
+                'chapter': row.get('chapter'),
+                'section': row.get('section') or f"{row['start_page']}-{row['end_page']}",
+                'doc_id': row.get('doc_id'),
+                'start_page': row.get('start_page'),
+                'end_page': row.get('end_page'),
+                'start_offset': row.get('start_offset'),
+                'end_offset': row.get('end_offset'),
+                'score': float(scores[i])
+            })
+        return results
+
+    # Helper returning the row ids matching a document and a set of sections
+    def _filter_rows(self, doc_id, sections):
+        mask = np.ones(len(self.rows), dtype=bool)
+        if doc_id is not None:
+            mask &= self.doc_ids == doc_id
+        if sections is not None:
+            mask &= np.isin(self.sections, np.asarray(list(sections), dtype=str))
+        return np.flatnonzero(mask)
+
+    # Helper returning the candidate row ids of the clusters closest to the query
+    def _probe(self, query):
+        if self._ivf is None:
+            # Memory-mapped files are versioned by name, so their clustering can be shared across queries
+            cache_key = getattr(self.matrix, 'filename', None)
+            self._ivf = _IVF_CACHE.get(cache_key) if cache_key else None
+            if self._ivf is None:
+                self._ivf = _build_ivf(self.matrix)
+                if cache_key:
+                    if len(_IVF_CACHE) >= _IVF_CACHE_SIZE:
+                        _IVF_CACHE.pop(next(iter(_IVF_CACHE)))
+                    _IVF_CACHE[cache_key] = self._ivf
+        centroids, order, bounds = self._ivf
+        probes = np.argsort(-(centroids @ query))[:self.n_probe]
+        return np.concatenate([order[bounds[c]:bounds[c+1]] for c in probes])
+
+# Helper to cluster rows into an inverted file (centroids + rows grouped by cluster)
+def _build_ivf(matrix, iterations=5, seed=0):
+    n = matrix.shape[0]
+    n_lists = max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    # Train centroids on a sample, then assign every row blockwise
+    sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, n_lists * 64), replace=False))])
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Keep the previous centroid for empty clusters
+        centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1.0), centroids)
+    assignments = np.concatenate([
+        np.argmax(np.asarray(matrix[i:i+_BLOCK_ROWS]) @ centroids.T, axis=1)
+        for i in range(0, n, _BLOCK_ROWS)
+    ])
+    order = np.argsort(assignments, kind='stable')
+    bounds = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+    return centroids, order, bounds
+
+# Opens a local retriever for a document, rebuilding its vector file when it is missing or stale
+def open_local_retriever(blob_client, container, blob_name, index, rebuild=False, mode='auto', cache=None):
+    """
+    Returns a LocalVectorRetriever over all chunks of a document's embedding index.
+    The stored vector file is reused (memory-mapped) when it matches the index; otherwise
+    the matrix is rebuilt from the index and saved next to the other document artifacts.
+    With an artifact cache, the matrix and its row filters are cached under the ETag of the
+    index they were built from, so warm queries neither request the vector file's properties
+    nor rebuild the filters.
+    Args:
+        blob_client: BlobServiceClient instance
+        container: Blob container name
+        blob_name: Name of the source document blob
+        index: Chunk/embedding index dict (its '_etag' versions the cache entry)
+        rebuild: Force a rebuild (e.g. the index just gained new sections)
+        mode: Search mode passed to LocalVectorRetriever
+        cache: ArtifactCache instance, or None
+    Returns:
+        LocalVectorRetriever instance
+    """
+    rows = index_rows(index)
+    version = index.get('_etag')
+    key = (container, vectors_blob_name(blob_name), version)
+    cached = cache.get(key) if cache is not None and version and not rebuild else None
+    if cached is not None and cached[0].shape[0] == len(rows):
+        matrix, filters = cached
+    else:
+        matrix = None if rebuild else load_vectors(blob_client, container, blob_name)
+        if matrix is None or matrix.shape[0] != len(rows):
+            matrix = build_vector_matrix(index, rows)
+            save_vectors(blob_client, container, blob_name, matrix)
+        filters = row_filters(rows)
+        if cache is not None and version:
+            cache.put(key, (matrix, filters), matrix.nbytes + filters[0].nbytes + filters[1].nbytes)
+    return LocalVectorRetriever(matrix, rows, mode=mode, filters=filters)
@@ -0,0 +1,44 @@
+import azure.functions as func
+import logging
+import os
+import json
+from ..shared.azure_clients import get_blob_client
+from ..shared.jobs import load_job, job_status
+from ..shared.telemetry import start_trace
+
+# Environment variables for Azure resources
+BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
+
+# Main Azure Function entry point
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    HTTP GET (or POST) endpoint returning the progress of an upload job.
+    Expects 'job_id' as a query parameter or in a JSON payload.
+    Returns the job's status ('queued', 'running', 'retrying', 'succeeded' or 'failed'),
+    current stage, overall progress (0-1) and per-stage states; once the job has
+    succeeded, 'result' holds the same knowledge map metadata a synchronous upload returns.
+    Failures return a JSON 500 {error, type, stage, trace_id}.
+    """
+    trace = start_trace('status')
+    try:
+        job_id = req.params.get('job_id')
+        if not job_id:
+            try:
+                job_id = (req.get_json() or {}).get('job_id')
+            except ValueError:
+                job_id = None
+        if not job_id:
+            return func.HttpResponse("Must provide 'job_id'.", status_code=400)
+
+        job = load_job(get_blob_client(BLOB_CONN_STR), BLOB_CONTAINER, job_id)
+        if job is None:
+            return func.HttpResponse("Unknown job.", status_code=404)
+        return func.HttpResponse(json.dumps(job_status(job)), mimetype="application/json", status_code=200)
+    except Exception as e:
+        # Log the traceback; the trace id matches the exported spans
+        logging.exception("Status request failed")
+        trace.finish(e)
+        return func.HttpResponse(json.dumps(trace.error_payload(e)), mimetype="application/json", status_code=500)
+    finally:
+        trace.finish()
@@ -0,0 +1,2 @@
+# Unit tests of the shared backend modules
+# Run with: python -m unittest discover -s backend/tests -t .
@@ -0,0 +1,41 @@
+import unittest
+from backend.shared.answer_cache import AnswerCache, query_terms
+
+# Embeddings with a cosine similarity of about 0.995, above the default threshold
+NEAR = [1.0, 0.1, 0.0]
+CACHED = [1.0, 0.0, 0.0]
+
+# Checks that near-duplicate questions only share answers when their key terms match
+class AnswerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = AnswerCache()
+
+    def test_near_miss_queries_do_not_hit(self):
+        for cached, query in [
+            ('Summarize chapter 3', 'Summarize chapter 4'),
+            ('What does Keynes say about inflation?', 'What does Hayek say about inflation?'),
+        ]:
+            self.cache.put('doc', 'v1', cached, CACHED, {'answer': cached})
+            self.assertEqual(self.cache.get('doc', 'v1', query, NEAR), (None, None))
+
+    def test_rephrased_query_with_same_terms_hits(self):
+        self.cache.put('doc', 'v1', 'Summarize chapter 3', CACHED, {'answer': 'a'})
+        self.assertEqual(self.cache.get('doc', 'v1', 'Give me a summary of chapter 3', NEAR), ({'answer': 'a'}, 'similar'))
+
+    def test_similarity_below_threshold_misses(self):
+        self.cache.put('doc', 'v1', 'Summarize chapter 3', CACHED, {'answer': 'a'})
+        self.assertEqual(self.cache.get('doc', 'v1', 'Summarize chapter 3 briefly', [1.0, 0.5, 0.0]), (None, None))
+
+    def test_other_version_misses(self):
+        self.cache.put('doc', 'v1', 'Summarize chapter 3', CACHED, {'answer': 'a'})
+        self.assertEqual(self.cache.get('doc', 'v2', 'summarize chapter 3', CACHED), (None, None))
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms('Summarize chapter three'), frozenset({'three'}))
+        self.assertEqual(query_terms('What is in Part IV about "supply chains"?'), frozenset({'part', 'iv', 'supply chains'}))
+        self.assertEqual(query_terms('What did I miss in 2023?'), frozenset({'2023'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
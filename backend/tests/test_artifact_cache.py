@@ -0,0 +1,78 @@
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared import azure_clients
+from backend.shared.artifact_cache import ArtifactCache, load_blob
+
+# Checks size-bounded LRU eviction and invalidation
+class ArtifactCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ArtifactCache(max_bytes=10)
+        cache.put(('c', 'a', 1), 'a', 4)
+        cache.put(('c', 'b', 1), 'b', 4)
+        cache.get(('c', 'a', 1))
+        cache.put(('c', 'd', 1), 'd', 4)
+        self.assertIsNone(cache.get(('c', 'b', 1)))
+        self.assertEqual((cache.get(('c', 'a', 1)), cache.get(('c', 'd', 1))), ('a', 'd'))
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+    def test_value_larger_than_cache_is_not_kept(self):
+        cache = ArtifactCache(max_bytes=10)
+        cache.put(('c', 'a', 1), 'a', 11)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_invalidate_drops_every_version_of_a_blob(self):
+        cache = ArtifactCache()
+        for key in [('c', 'a', 1), ('c', 'a', 2, 0, 10), ('c', 'b', 1)]:
+            cache.put(key, 'value', 1)
+        cache.invalidate('c', 'a')
+        self.assertEqual((cache.stats()['entries'], cache.stats()['bytes']), (1, 1))
+
+# Checks that blobs are downloaded once per ETag
+class LoadBlobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = ServiceStats()
+        self.blob_client = FakeBlobServiceClient(self.stats)
+        self.cache = ArtifactCache()
+
+    def downloads(self):
+        return self.stats.snapshot().get('blob.download', {}).get('calls', 0)
+
+    def test_unchanged_blob_is_served_from_cache(self):
+        self.blob_client.put('docs', 'map.json', b'{"a": 1}')
+        first, etag = load_blob(self.cache, self.blob_client, 'docs', 'map.json', len)
+        second, same_etag = load_blob(self.cache, self.blob_client, 'docs', 'map.json', len)
+        self.assertEqual((first, second, etag), (8, 8, same_etag))
+        self.assertEqual(self.downloads(), 1)
+
+    def test_rewritten_blob_is_downloaded_again(self):
+        self.blob_client.put('docs', 'map.json', b'old')
+        load_blob(self.cache, self.blob_client, 'docs', 'map.json')
+        self.blob_client.put('docs', 'map.json', b'newer')
+        self.assertEqual(load_blob(self.cache, self.blob_client, 'docs', 'map.json')[0], b'newer')
+        self.assertEqual(self.downloads(), 2)
+
+# Checks that clients are created once per configuration and reused
+class ClientPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+        azure_clients.override_clients({'blob': lambda conn_str: self.created.append(conn_str) or object()})
+        self.addCleanup(azure_clients.override_clients, {'blob': None})
+
+    def test_same_configuration_reuses_the_client(self):
+        first = azure_clients.get_blob_client('conn-a')
+        self.assertIs(azure_clients.get_blob_client('conn-a'), first)
+        self.assertIsNot(azure_clients.get_blob_client('conn-b'), first)
+        self.assertEqual(self.created, ['conn-a', 'conn-b'])
+
+    def test_reset_creates_new_clients(self):
+        first = azure_clients.get_blob_client('conn-a')
+        azure_clients.reset_clients()
+        self.assertIsNot(azure_clients.get_blob_client('conn-a'), first)
+        self.assertEqual(len(self.created), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import unittest
+import uuid
+import azure.functions as func
+from backend.benchmarks.fakes import FakeAzure
+from backend.batch_function import main as batch_function
+from backend.shared.chat_pipeline import BLOB_CONTAINER
+
+# Helper calling the batch function with a JSON payload
+def call_batch(payload):
+    request = func.HttpRequest('POST', '/api/batch', body=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    return batch_function.main(request)
+
+# Checks that repeated questions of a batch are answered once
+class BatchDeduplicationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeAzure().install()
+        self.addCleanup(self.fake.uninstall)
+        # A document without chapters: questions are answered without retrieval
+        self.blob_name = f"batch-{uuid.uuid4().hex}.pdf"
+        self.fake.blob.put(BLOB_CONTAINER, self.blob_name + '.knowledge_map.json', b'[]')
+
+    def run_batch(self, queries, cache=True):
+        response = call_batch({'queries': queries, 'blob_name': self.blob_name, 'cache': cache})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_body())
+
+    def chat_calls(self):
+        return self.fake.stats.snapshot().get('openai.chat', {}).get('calls', 0)
+
+    def test_normalized_duplicates_share_one_completion(self):
+        self.run_batch(['What is entropy?', 'Who wrote it?'], cache=False)
+        distinct_calls = self.chat_calls()
+        body = self.run_batch(['What is entropy?', 'what is  entropy', '  WHAT IS ENTROPY!', 'Who wrote it?'], cache=False)
+        self.assertEqual((body['batch']['unique_queries'], body['batch']['completions']), (2, 2))
+        # Routing and answering make the same calls as a batch of the two distinct questions
+        self.assertEqual(self.chat_calls(), 2 * distinct_calls)
+        self.assertEqual([r['query'] for r in body['results']], ['What is entropy?', 'what is  entropy', '  WHAT IS ENTROPY!', 'Who wrote it?'])
+        self.assertEqual(len({r['answer'] for r in body['results'][:3]}), 1)
+
+    def test_repeated_batch_is_answered_from_the_cache(self):
+        self.run_batch(['What is entropy?', 'Who wrote it?'])
+        body = self.run_batch(['what is entropy', 'Who wrote it?'])
+        self.assertEqual((body['batch']['cache_hits'], body['batch']['completions']), (2, 0))
+        self.assertTrue(all(r['cache']['hit'] for r in body['results']))
+
+    def test_invalid_queries_are_rejected(self):
+        self.assertEqual(call_batch({'queries': ['ok', ''], 'blob_name': self.blob_name}).status_code, 400)
+        self.assertEqual(call_batch({'queries': [], 'blob_name': self.blob_name}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
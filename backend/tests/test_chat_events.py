@@ -0,0 +1,59 @@
+import json
+import unittest
+from backend.chat_function.main import iter_answer_events, answer_response
+
+# Stand-in GPT client yielding answer deltas one by one and counting how many were produced
+class DeltaClient:
+
+    def __init__(self, deltas, fail_after=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+        self.produced = 0
+
+    def chat_completion(self, messages, model, stream=False):
+        for i, delta in enumerate(self.deltas):
+            if i == self.fail_after:
+                raise RuntimeError('connection reset')
+            self.produced += 1
+            yield delta
+
+# Helper splitting an event body into (event, data) pairs
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+# Checks that answer events are produced as the deltas arrive
+class AnswerEventsTest(unittest.TestCase):
+
+    def test_events_are_emitted_incrementally(self):
+        client = DeltaClient(['The ', 'answer', '.'])
+        events = iter_answer_events(client, [], [{'page': 1}], ['Intro'])
+        self.assertTrue(next(events).startswith('event: meta'))
+        self.assertEqual(client.produced, 0)
+        for produced, text in enumerate(['The ', 'answer', '.'], start=1):
+            event, data = parse_events(next(events))[0]
+            self.assertEqual((event, data['text']), ('token', text))
+            self.assertEqual(client.produced, produced)
+        self.assertEqual(parse_events(next(events))[0], ('done', {'answer': 'The answer.'}))
+
+    def test_failure_after_first_tokens_is_reported_in_band(self):
+        client = DeltaClient(['The ', 'answer'], fail_after=1)
+        answers = []
+        with self.assertLogs(level='ERROR'):
+            events = parse_events(''.join(iter_answer_events(client, [], [], [], on_answer=answers.append)))
+        self.assertEqual([event for event, _ in events], ['meta', 'token', 'error'])
+        self.assertEqual(answers, [])
+
+    def test_events_response_keeps_event_order(self):
+        response = answer_response(DeltaClient(['a', 'b']), [], [], ['Intro'], events=True)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = parse_events(response.get_body().decode('utf-8'))
+        self.assertEqual([event for event, _ in events], ['meta', 'token', 'token', 'done'])
+        self.assertEqual(events[0][1]['context_sections'], ['Intro'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from backend.shared.chunking import HEADER_PATTERN, adaptive_chunking, join_pages
+
+# Checks which lines count as headers
+class HeaderPatternTest(unittest.TestCase):
+
+    def test_keyword_headers_ignore_case(self):
+        self.assertEqual(len(HEADER_PATTERN.findall('Chapter 1\ntext\nSECTION 2\ntext\npart three')), 3)
+
+    def test_sentence_lines_are_not_headers(self):
+        text = 'Markets rose sharply in the spring\nThe committee met twice a year\nPartially done'
+        self.assertIsNone(HEADER_PATTERN.search(text))
+
+    def test_all_caps_line_is_a_header(self):
+        self.assertEqual([m.group() for m in HEADER_PATTERN.finditer('intro\nTHE FIRST YEARS\nbody')], ['THE FIRST YEARS'])
+
+# Checks that chunk offsets and pages point back into the source text
+class ChunkOffsetTest(unittest.TestCase):
+
+    def assert_offsets(self, text, chunks):
+        self.assertTrue(chunks)
+        for chunk in chunks:
+            self.assertEqual(text[chunk['start_offset']:chunk['end_offset']], chunk['chunk'])
+            self.assertEqual(chunk['chunk'], chunk['chunk'].strip())
+
+    def test_header_split_offsets(self):
+        text = 'Preface words.\nCHAPTER ONE\nFirst body.\n\nCHAPTER TWO\nSecond body.\n'
+        chunks = adaptive_chunking(text, max_chunk_size=100)
+        self.assert_offsets(text, chunks)
+        self.assertEqual([c['chunk'].split('\n')[0] for c in chunks], ['Preface words.', 'CHAPTER ONE', 'CHAPTER TWO'])
+
+    def test_paragraphs_are_packed_up_to_the_limit(self):
+        text = '\n\n'.join(f"Paragraph number {i} of the text." for i in range(10))
+        chunks = adaptive_chunking(text, max_chunk_size=80)
+        self.assert_offsets(text, chunks)
+        self.assertTrue(all(len(c['chunk']) <= 80 for c in chunks))
+        self.assertEqual(' '.join(c['chunk'] for c in chunks).count('Paragraph'), 10)
+
+    def test_oversized_piece_is_split_into_overlapping_windows(self):
+        text = 'word ' * 100
+        chunks = adaptive_chunking(text, max_chunk_size=100, overlap=20)
+        self.assert_offsets(text, chunks)
+        self.assertTrue(all(len(c['chunk']) <= 100 for c in chunks))
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertLess(chunk['start_offset'], previous['end_offset'])
+        self.assertEqual(chunks[-1]['end_offset'], len(text.rstrip()))
+
+    def test_pages_follow_offsets(self):
+        text, starts = join_pages(['First page text.', 'Second page text.', 'Third page text.'])
+        chunks = adaptive_chunking(text, max_chunk_size=20, overlap=0, page_offset=5, page_map=starts)
+        self.assert_offsets(text, chunks)
+        self.assertEqual((chunks[0]['start_page'], chunks[-1]['end_page']), (5, 7))
+        for chunk in chunks:
+            self.assertEqual(chunk['start_page'], 5 + max(i for i, s in enumerate(starts) if s <= chunk['start_offset']))
+
+
+if __name__ == '__main__':
+    unittest.main()
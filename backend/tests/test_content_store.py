@@ -0,0 +1,72 @@
+import hashlib
+import time
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared import content_store
+from backend.shared.jobs import create_job, load_job, save_job
+
+CONTAINER = 'docs'
+SHA = 'ab' * 32
+
+# Checks manifests, pointers and the lookup of processed or processing content
+class ContentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blob_client = FakeBlobServiceClient(ServiceStats())
+
+    def test_content_hash_streams_the_blob(self):
+        self.blob_client.put(CONTAINER, 'a.pdf', b'%PDF-1.7 bytes')
+        self.assertEqual(content_store.content_hash(self.blob_client, CONTAINER, 'a.pdf'), hashlib.sha256(b'%PDF-1.7 bytes').hexdigest())
+
+    def test_pending_pointers_are_published_once(self):
+        content_store.add_pending_pointer(self.blob_client, CONTAINER, SHA, 'a.pdf')
+        content_store.add_pending_pointer(self.blob_client, CONTAINER, SHA, 'b.pdf')
+        content_store.add_pending_pointer(self.blob_client, CONTAINER, SHA, 'b.pdf')
+        self.assertEqual(content_store.resolve_artifact_name(self.blob_client, CONTAINER, 'a.pdf'), 'a.pdf')
+        published = content_store.publish_pending_pointers(self.blob_client, CONTAINER, SHA)
+        self.assertEqual(sorted(published), ['a.pdf', 'b.pdf'])
+        for blob_name in ('a.pdf', 'b.pdf'):
+            self.assertEqual(content_store.resolve_artifact_name(self.blob_client, CONTAINER, blob_name), 'content/' + SHA)
+        self.assertEqual(content_store.publish_pending_pointers(self.blob_client, CONTAINER, SHA), [])
+
+    def test_removed_pending_pointer_is_not_published(self):
+        content_store.add_pending_pointer(self.blob_client, CONTAINER, SHA, 'a.pdf')
+        content_store.remove_pending_pointer(self.blob_client, CONTAINER, SHA, 'a.pdf')
+        self.assertEqual(content_store.publish_pending_pointers(self.blob_client, CONTAINER, SHA), [])
+
+    def test_remove_pointer_only_removes_matching_content(self):
+        content_store.save_pointer(self.blob_client, CONTAINER, 'a.pdf', SHA)
+        content_store.remove_pointer(self.blob_client, CONTAINER, 'a.pdf', 'cd' * 32)
+        self.assertEqual(content_store.resolve_artifact_name(self.blob_client, CONTAINER, 'a.pdf'), 'content/' + SHA)
+        content_store.remove_pointer(self.blob_client, CONTAINER, 'a.pdf', SHA)
+        self.assertEqual(content_store.resolve_artifact_name(self.blob_client, CONTAINER, 'a.pdf'), 'a.pdf')
+
+    def test_find_content_returns_ready_manifest(self):
+        content_store.save_manifest(self.blob_client, CONTAINER, SHA, 'ready', job_id='j', result={'file_name': 'a.pdf'})
+        manifest, job = content_store.find_content(self.blob_client, CONTAINER, SHA, stale_after=60)
+        self.assertEqual((manifest['status'], job), ('ready', None))
+
+    def test_find_content_returns_live_job(self):
+        job = create_job(self.blob_client, CONTAINER, 'a.pdf', 'url', content_hash=SHA)
+        content_store.save_manifest(self.blob_client, CONTAINER, SHA, 'processing', job_id=job['job_id'])
+        manifest, running = content_store.find_content(self.blob_client, CONTAINER, SHA, stale_after=60)
+        self.assertEqual(running['job_id'], job['job_id'])
+
+    def test_find_content_fails_stale_job(self):
+        job = create_job(self.blob_client, CONTAINER, 'a.pdf', 'url', content_hash=SHA)
+        save_job(self.blob_client, CONTAINER, dict(job, status='running', updated_at=time.time() - 120))
+        content_store.save_manifest(self.blob_client, CONTAINER, SHA, 'processing', job_id=job['job_id'])
+        self.assertEqual(content_store.find_content(self.blob_client, CONTAINER, SHA, stale_after=60), (None, None))
+        stale = load_job(self.blob_client, CONTAINER, job['job_id'])
+        self.assertEqual((stale['status'], stale['stale']), ('failed', True))
+
+    def test_release_manifest_keeps_other_jobs_manifest(self):
+        content_store.save_manifest(self.blob_client, CONTAINER, SHA, 'processing', job_id='other')
+        content_store.release_manifest(self.blob_client, CONTAINER, SHA, 'mine')
+        self.assertIsNotNone(content_store.load_manifest(self.blob_client, CONTAINER, SHA))
+        content_store.release_manifest(self.blob_client, CONTAINER, SHA, 'other')
+        self.assertIsNone(content_store.load_manifest(self.blob_client, CONTAINER, SHA))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from backend.shared import context_assembly
+from backend.shared.context_assembly import assemble_context, token_counter
+
+TEXT = ' '.join(f"word{i}" for i in range(200))
+
+# Helper building a retriever result for a slice of TEXT
+def result(start, end, score, section='1-5', page=1):
+    return {
+        'chunk': TEXT[start:end], 'chapter': 'One', 'section': section, 'start_page': page, 'end_page': page,
+        'score': score, 'start_offset': start, 'end_offset': end
+    }
+
+# Checks how overlapping and adjacent chunks are merged
+class MergeChunksTest(unittest.TestCase):
+
+    def test_overlapping_windows_join_without_repeating_text(self):
+        passages = context_assembly._merge_chunks([result(100, 300, 0.5), result(0, 160, 0.9)])
+        self.assertEqual(len(passages), 1)
+        self.assertEqual(passages[0]['chunk'], TEXT[0:300])
+        self.assertEqual((passages[0]['chunks'], passages[0]['score'], passages[0]['rank']), (2, 0.9, 0))
+
+    def test_contained_chunk_keeps_the_outer_text(self):
+        passages = context_assembly._merge_chunks([result(0, 300, 0.5), result(50, 100, 0.9)])
+        self.assertEqual((passages[0]['chunk'], passages[0]['end_offset']), (TEXT[0:300], 300))
+
+    def test_adjacent_chunks_are_separated(self):
+        first, second = result(0, 5, 0.9), result(6, 11, 0.8)
+        passages = context_assembly._merge_chunks([first, second])
+        self.assertEqual(passages[0]['chunk'], TEXT[0:5] + context_assembly.PASSAGE_SEPARATOR + TEXT[6:11])
+
+    def test_distant_or_other_section_chunks_stay_apart(self):
+        passages = context_assembly._merge_chunks([
+            result(0, 50, 0.9), result(500, 550, 0.8), result(40, 90, 0.7, section='6-9')
+        ])
+        self.assertEqual([p['rank'] for p in passages], [0, 1, 2])
+
+    def test_chunks_without_offsets_are_kept(self):
+        passages = context_assembly._merge_chunks([dict(result(0, 50, 0.9), start_offset=None), result(0, 50, 0.8)])
+        self.assertEqual(len(passages), 2)
+
+# Checks cutting passages to a token budget
+class TruncateTest(unittest.TestCase):
+
+    def test_cut_at_a_word_boundary_within_budget(self):
+        count_tokens = token_counter()
+        truncated = context_assembly._truncate(TEXT, 20, count_tokens)
+        self.assertLessEqual(count_tokens(truncated), 20)
+        self.assertTrue(TEXT.startswith(truncated))
+        self.assertEqual(TEXT[len(truncated)], ' ')
+
+    def test_text_within_budget_is_unchanged(self):
+        self.assertEqual(context_assembly._truncate('short text', 100, token_counter()), 'short text')
+
+# Checks packing passages into the token budget
+class AssembleContextTest(unittest.TestCase):
+
+    def test_budget_holds_with_truncation(self):
+        results = [result(0, 400, 0.9), result(600, 1000, 0.8)]
+        passages, report = assemble_context(results, 'word5', token_budget=200)
+        self.assertLessEqual(report['tokens'], 200)
+        self.assertEqual((report['passages'], report['truncated']), (2, 1))
+        self.assertTrue(passages[1]['truncated'])
+
+    def test_small_remainder_is_skipped(self):
+        results = [result(0, 400, 0.9), result(600, 1000, 0.8)]
+        passages, report = assemble_context(results, 'word5', token_budget=120)
+        self.assertEqual((report['passages'], report['truncated']), (1, 0))
+
+    def test_duplicate_passage_is_dropped(self):
+        results = [result(0, 400, 0.9), dict(result(0, 400, 0.8, section='6-9'), chunk=TEXT[0:400])]
+        _, report = assemble_context(results, 'word5')
+        self.assertEqual(report['duplicates'], 1)
+
+    def test_passages_are_returned_in_document_order(self):
+        results = [result(600, 700, 0.9, page=3), result(0, 100, 0.8, page=1)]
+        passages, _ = assemble_context(results, 'word5')
+        self.assertEqual([p['start_page'] for p in passages], [1, 3])
+
+    def test_unknown_rerank_mode(self):
+        with self.assertRaises(ValueError):
+            assemble_context([], 'q', rerank='semantic')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from backend.shared import document_analysis
+
+# A 10-page book: TOC on page 0, preface on page 1, printed page 1 is page index 2
+BOOK = [
+    'Contents\nChapter 1 Beginnings ..... 1\nChapter 2 Middle ..... 4\nChapter 3 End ..... 7',
+    'Preface\nWhy this book was written.',
+    'Chapter 1 Beginnings\nIt started.', 'text', 'text',
+    'Chapter 2 Middle\nIt went on.', 'text', 'text',
+    'Chapter 3 End\nIt ended.', 'text',
+]
+
+# Checks table of contents detection
+class DetectIndexTest(unittest.TestCase):
+
+    def test_entries_with_leaders(self):
+        index = document_analysis.detect_index(BOOK)
+        self.assertEqual([(e['title'], e['page_ref'], e['toc_page']) for e in index], [
+            ('Chapter 1 Beginnings', 1, 1), ('Chapter 2 Middle', 4, 1), ('Chapter 3 End', 7, 1)
+        ])
+
+    def test_numbers_in_sentences_are_not_entries(self):
+        pages = ['In 2019 sales rose by 15\nSee Figure3\nVersion v2', 'Revenue grew 12 percent over 10']
+        self.assertEqual(document_analysis.detect_index(pages), [])
+
+    def test_backward_page_refs_are_dropped(self):
+        toc = 'Chapter 1 A ..... 1\nChapter 2 B ..... 9\nChapter 3 C ..... 3\nChapter 4 D ..... 12'
+        index = document_analysis.detect_index([toc])
+        self.assertEqual([e['page_ref'] for e in index], [1, 3, 12])
+
+    def test_subsections_get_deeper_levels(self):
+        toc = 'Part I Origins ..... 1\n1 Start ..... 1\n1.1 Detail ..... 2\n2 Next ..... 5'
+        levels = [e['level'] for e in document_analysis.detect_index([toc])]
+        self.assertEqual(levels, [0, 1, 2, 1])
+
+# Checks how a document is cut into sections
+class AnalyzeStructureTest(unittest.TestCase):
+
+    def test_toc_sections_use_the_page_offset(self):
+        index = document_analysis.detect_index(BOOK)
+        self.assertEqual(document_analysis.detect_page_offset(BOOK, index), 1)
+        sections, source = document_analysis.analyze_structure(BOOK)
+        self.assertEqual(source, 'toc')
+        self.assertEqual([(s['start_page'], s['end_page']) for s in sections], [(2, 5), (5, 8), (8, 10)])
+
+    def test_headings_without_toc(self):
+        pages = ['Chapter One\ntext', 'Chapter One\nrunning header', 'Chapter Two\ntext', 'text']
+        sections, source = document_analysis.analyze_structure(pages)
+        self.assertEqual(source, 'headings')
+        self.assertEqual([(s['title'], s['start_page'], s['end_page']) for s in sections], [
+            ('Chapter One', 0, 2), ('Chapter Two', 2, 4)
+        ])
+
+    def test_layout_headings_take_precedence(self):
+        pages = ['intro', 'text', '3 Methods\ntext', 'text', '4 Results\ntext']
+        sections, source = document_analysis.analyze_structure(pages, headings={2: ['3 Methods'], 4: ['4 Results']})
+        self.assertEqual(source, 'headings')
+        self.assertEqual([s['start_page'] for s in sections], [2, 4])
+
+    def test_synthetic_sections_cover_every_page(self):
+        sections, source = document_analysis.analyze_structure(['plain text'] * 23)
+        self.assertEqual(source, 'synthetic')
+        self.assertEqual((sections[0]['start_page'], sections[-1]['end_page']), (0, 23))
+        for previous, section in zip(sections, sections[1:]):
+            self.assertEqual(previous['end_page'], section['start_page'])
+
+    def test_incremental_detection_matches_one_pass(self):
+        detector = document_analysis.StructureDetector(max_toc_pages=3)
+        for end in range(1, len(BOOK) + 1):
+            result = detector.analyze(BOOK[:end], page_count=len(BOOK))
+        self.assertEqual(result, document_analysis.analyze_structure(BOOK, max_toc_pages=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import re
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared.embedding_store import chunk_id, empty_embedding_index, load_embedding_index, save_embedding_index
+
+# Characters Azure AI Search accepts in a document key
+SEARCH_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-=]+$')
+
+# Checks that chunk ids are valid AI Search keys
+class ChunkIdTest(unittest.TestCase):
+
+    def test_deduplicated_names_give_valid_keys(self):
+        section = {'start_page': 3, 'end_page': 7}
+        for blob_name in ('content/' + 'ab' * 32, 'My Book (2nd ed.).pdf', 'book.pdf'):
+            self.assertRegex(chunk_id(blob_name, section, 120), SEARCH_KEY_PATTERN)
+
+    def test_ids_are_distinct_per_chunk(self):
+        section = {'start_page': 3, 'end_page': 7}
+        ids = {chunk_id('content/x', section, offset) for offset in (0, 1000, 2000)}
+        ids.add(chunk_id('content/y', section, 0))
+        self.assertEqual(len(ids), 4)
+
+
+# Helper adding a section with one chunk to an index
+def add_section(index, key, embedding):
+    index['sections'][key] = {'chapter': key, 'chunks': [{'id': key, 'chunk_hash': key, 'chunk': key}]}
+    index['embeddings'][key] = embedding
+
+# Checks that saved indexes round-trip and that concurrent saves keep each other's sections
+class SaveEmbeddingIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blob_client = FakeBlobServiceClient(ServiceStats())
+
+    def test_round_trip_packs_embeddings(self):
+        index = empty_embedding_index('book.pdf')
+        add_section(index, '0-5', [0.25, -1.5, 3.0])
+        save_embedding_index(self.blob_client, 'docs', 'book.pdf', index)
+        data, _ = self.blob_client.read('docs', 'book.pdf.embeddings.json')
+        self.assertNotIn(b'0.25', data)
+        loaded = load_embedding_index(self.blob_client, 'docs', 'book.pdf')
+        self.assertEqual(loaded['embeddings']['0-5'], [0.25, -1.5, 3.0])
+        self.assertEqual(list(loaded['sections']), ['0-5'])
+
+    def test_concurrent_saves_merge_sections(self):
+        save_embedding_index(self.blob_client, 'docs', 'book.pdf', empty_embedding_index('book.pdf'))
+        first = load_embedding_index(self.blob_client, 'docs', 'book.pdf')
+        second = load_embedding_index(self.blob_client, 'docs', 'book.pdf')
+        add_section(first, '0-5', [1.0])
+        add_section(second, '5-9', [2.0])
+        save_embedding_index(self.blob_client, 'docs', 'book.pdf', first)
+        saved = save_embedding_index(self.blob_client, 'docs', 'book.pdf', second)
+        self.assertEqual(sorted(saved['sections']), ['0-5', '5-9'])
+        stored = load_embedding_index(self.blob_client, 'docs', 'book.pdf')
+        self.assertEqual(sorted(stored['sections']), ['0-5', '5-9'])
+        self.assertEqual(stored['embeddings'], {'0-5': [1.0], '5-9': [2.0]})
+
+    def test_first_saves_of_a_new_index_merge(self):
+        first, second = empty_embedding_index('book.pdf'), empty_embedding_index('book.pdf')
+        add_section(first, '0-5', [1.0])
+        add_section(second, '5-9', [2.0])
+        save_embedding_index(self.blob_client, 'docs', 'book.pdf', first)
+        save_embedding_index(self.blob_client, 'docs', 'book.pdf', second)
+        self.assertEqual(sorted(load_embedding_index(self.blob_client, 'docs', 'book.pdf')['sections']), ['0-5', '5-9'])
+
+
+if __name__ == '__main__':
+    unittest.main()
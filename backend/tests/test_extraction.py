@@ -0,0 +1,88 @@
+import io
+import unittest
+from azure.core.exceptions import HttpResponseError
+from backend.benchmarks.fakes import FakeBlobServiceClient, FakeDocumentAnalysisClient, ServiceStats, encode_synthetic_pdf
+from backend.shared import extraction
+
+DOCUMENT_URL = 'https://account.blob.core.windows.net/docs/book.pdf'
+
+# Document Intelligence client failing the analysis of one page range
+class FailingRangeClient:
+
+    def __init__(self, client, failing_range):
+        self.client = client
+        self.failing_range = failing_range
+
+    def begin_analyze_document_from_url(self, model, document_url, pages=None, **kwargs):
+        if pages == self.failing_range:
+            error = HttpResponseError(message='InternalServerError')
+            error.status_code = 500
+            raise error
+        return self.client.begin_analyze_document_from_url(model, document_url, pages=pages, **kwargs)
+
+# Checks concurrent page-range extraction with an unknown page count
+class DocumentIntelligenceExtractorTest(unittest.TestCase):
+
+    def setUp(self):
+        stats = ServiceStats()
+        self.blob_client = FakeBlobServiceClient(stats)
+        self.form_client = FakeDocumentAnalysisClient(stats, self.blob_client)
+
+    def store(self, page_count, headings=None):
+        pages = [f"page {i}\nline two" for i in range(page_count)]
+        self.blob_client.put('docs', 'book.pdf', encode_synthetic_pdf(pages, headings))
+        return pages
+
+    def test_pages_are_assembled_in_order(self):
+        pages = self.store(10, headings={'0': ['Preface'], '7': ['Chapter 2']})
+        extractor = extraction.DocumentIntelligenceExtractor(self.form_client, DOCUMENT_URL, batch_pages=3, max_workers=3)
+        self.assertEqual(extraction.extract_pages(extractor), pages)
+        self.assertEqual(extractor.page_count, 10)
+        self.assertEqual(extractor.headings, {0: ['Preface'], 7: ['Chapter 2']})
+
+    def test_document_ending_at_a_range_boundary(self):
+        pages = self.store(9)
+        extractor = extraction.DocumentIntelligenceExtractor(self.form_client, DOCUMENT_URL, batch_pages=3, max_workers=2)
+        self.assertEqual(extraction.extract_pages(extractor), pages)
+        self.assertEqual(extractor.page_count, 9)
+
+    def test_failed_range_inside_the_document_is_raised(self):
+        self.store(10)
+        extractor = extraction.DocumentIntelligenceExtractor(FailingRangeClient(self.form_client, '4-6'), DOCUMENT_URL, batch_pages=3)
+        with self.assertRaises(HttpResponseError):
+            extraction.extract_pages(extractor)
+
+    def test_batches_report_the_contiguous_prefix(self):
+        self.store(10)
+        prefixes = []
+        extractor = extraction.DocumentIntelligenceExtractor(self.form_client, DOCUMENT_URL, batch_pages=4, max_workers=1)
+        extraction.extract_pages(extractor, on_batch=lambda pages: prefixes.append(pages.contiguous))
+        self.assertEqual(prefixes, [4, 8, 10])
+
+# Checks the contiguous prefix of out-of-order batches
+class PageAccumulatorTest(unittest.TestCase):
+
+    def test_out_of_order_batches(self):
+        accumulator = extraction.PageAccumulator()
+        self.assertEqual(accumulator.add(2, ['c', 'd']), 0)
+        self.assertEqual(accumulator.add(0, ['a', 'b']), 4)
+        self.assertEqual(accumulator.add(5, ['f']), 4)
+        self.assertEqual((accumulator.prefix(), len(accumulator)), (['a', 'b', 'c', 'd'], 5))
+
+# Checks local text-layer extraction
+@unittest.skipIf(extraction.pypdf is None, 'pypdf is not installed')
+class PdfTextExtractorTest(unittest.TestCase):
+
+    def test_pages_are_batched(self):
+        writer = extraction.pypdf.PdfWriter()
+        for _ in range(5):
+            writer.add_blank_page(width=200, height=200)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        extractor = extraction.PdfTextExtractor(buffer.getvalue(), batch_pages=2)
+        self.assertEqual([(start, len(pages)) for start, pages in extractor.iter_batches()], [(0, 2), (2, 2), (4, 1)])
+        self.assertEqual(extractor.page_count, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import threading
+import unittest
+from types import SimpleNamespace
+from backend.shared.indexing import embed_texts, upload_search_documents, delete_search_documents
+
+# Throttling error as raised by the SDKs, asking for an immediate retry
+class ThrottledError(Exception):
+
+    def __init__(self):
+        super().__init__('429 Too Many Requests')
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429, headers={'retry-after-ms': '0'})
+
+# Stand-in embedding client recording its requests; the first `throttle` requests are throttled
+class EmbeddingClient:
+
+    def __init__(self, throttle=0):
+        self.throttle = throttle
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def create_embeddings(self, texts):
+        with self._lock:
+            self.requests.append(list(texts))
+            if self.throttle > 0:
+                self.throttle -= 1
+                raise ThrottledError()
+        return [[float(len(t))] for t in texts]
+
+# Stand-in embedding client without multi-input requests
+class SingleEmbeddingClient:
+
+    def __init__(self):
+        self.requests = []
+
+    def create_embedding(self, text):
+        self.requests.append([text])
+        return [float(len(text))]
+
+# Stand-in search client recording its indexing requests
+class SearchClient:
+
+    def __init__(self):
+        self.uploads = []
+        self.deletes = []
+        self._lock = threading.Lock()
+
+    def merge_or_upload_documents(self, documents):
+        with self._lock:
+            self.uploads.append(documents)
+
+    def delete_documents(self, documents):
+        with self._lock:
+            self.deletes.append(documents)
+
+# Checks batching, ordering and throttling retries of embedding requests
+class EmbedTextsTest(unittest.TestCase):
+
+    def test_texts_are_batched_in_order(self):
+        client = EmbeddingClient()
+        texts = ['a' * i for i in range(1, 11)]
+        embeddings = embed_texts(client, texts, batch_size=4, max_workers=3)
+        self.assertEqual(embeddings, [[float(i)] for i in range(1, 11)])
+        self.assertEqual(sorted(len(r) for r in client.requests), [2, 4, 4])
+
+    def test_throttled_batch_is_retried(self):
+        client = EmbeddingClient(throttle=2)
+        self.assertEqual(embed_texts(client, ['ab', 'c'], batch_size=8), [[2.0], [1.0]])
+        self.assertEqual(len(client.requests), 3)
+
+    def test_retries_are_bounded(self):
+        with self.assertRaises(ThrottledError):
+            embed_texts(EmbeddingClient(throttle=5), ['a'], max_retries=2)
+
+    def test_single_input_fallback(self):
+        client = SingleEmbeddingClient()
+        self.assertEqual(embed_texts(client, ['a', 'bb', 'ccc'], batch_size=2), [[1.0], [2.0], [3.0]])
+        self.assertEqual([len(r) for r in client.requests], [1, 1, 1])
+
+    def test_no_texts(self):
+        self.assertEqual(embed_texts(EmbeddingClient(), []), [])
+
+# Checks the bulk batches sent to AI Search
+class SearchBatchTest(unittest.TestCase):
+
+    def test_documents_are_uploaded_in_batches(self):
+        client = SearchClient()
+        docs = [{'id': str(i)} for i in range(7)]
+        self.assertEqual(upload_search_documents(client, docs, batch_size=3, max_workers=2), 7)
+        self.assertEqual(sorted(len(b) for b in client.uploads), [1, 3, 3])
+        self.assertEqual(sorted(d['id'] for b in client.uploads for d in b), sorted(d['id'] for d in docs))
+
+    def test_documents_are_deleted_by_id(self):
+        client = SearchClient()
+        self.assertEqual(delete_search_documents(client, ['a', 'b', 'c'], batch_size=2, max_workers=1), 3)
+        self.assertEqual(client.deletes, [[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}]])
+
+
+if __name__ == '__main__':
+    unittest.main()
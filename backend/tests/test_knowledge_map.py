@@ -0,0 +1,37 @@
+import time
+import unittest
+from backend.shared.knowledge_map import generate_knowledge_map
+
+# Stand-in GPT client whose summaries of 'slow' pages take `delay` seconds
+class SlowClient:
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def chat_completion(self, messages, model):
+        if 'slow' in messages[-1]['content']:
+            time.sleep(self.delay)
+        return 'summary'
+
+# Checks that the per-section timeout holds when sections are summarized one by one
+class SequentialTimeoutTest(unittest.TestCase):
+
+    def test_timed_out_section_degrades_without_blocking(self):
+        pages = ['slow page'] * 3 + ['fast page'] * 3
+        sections = [{'title': 'a', 'start_page': 0, 'end_page': 3}, {'title': 'b', 'start_page': 3, 'end_page': 6}]
+        started = time.monotonic()
+        knowledge_map = generate_knowledge_map(sections, pages, SlowClient(1.0), max_workers=1, timeout=0.2)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertIn('summary_error', knowledge_map[0])
+        self.assertTrue(knowledge_map[0]['summary'].startswith('slow page'))
+        self.assertEqual(knowledge_map[1]['summary'], 'summary')
+        self.assertNotIn('summary_error', knowledge_map[1])
+
+    def test_single_section_respects_timeout(self):
+        pages = ['slow page'] * 2
+        knowledge_map = generate_knowledge_map([{'title': 'a', 'start_page': 0, 'end_page': 2}], pages, SlowClient(1.0), max_workers=4, timeout=0.2)
+        self.assertIn('summary_error', knowledge_map[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
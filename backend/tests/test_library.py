@@ -0,0 +1,58 @@
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared import library as library_store
+
+# Helper building a library document entry from chapter embeddings
+def entry(doc_name, embeddings):
+    return {
+        'doc_name': doc_name, 'map_etag': 'etag',
+        'chapters': [{'chapter_name': f"c{i}", 'start_page': i, 'end_page': i + 1, 'embedding': e} for i, e in enumerate(embeddings)]
+    }
+
+# Helper building a library of three documents
+def make_library():
+    library = library_store.empty_library('library-1')
+    library['documents'] = {
+        'a.pdf': entry('a.pdf', [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]),
+        'b.pdf': entry('b.pdf', [[0.0, 0.0, 1.0], [0.6, 0.8, 0.0]]),
+        'c.pdf': entry('c.pdf', [[0.0, 0.0, 2.0]]),
+    }
+    return library
+
+# Checks the document ranking of library search
+class ScoreDocumentsTest(unittest.TestCase):
+
+    def test_documents_are_ranked_by_their_best_chapter(self):
+        ranked = library_store.score_documents(make_library(), [0.0, 1.0, 0.0])
+        self.assertEqual([(blob_name, round(score, 3)) for score, blob_name, _ in ranked], [('a.pdf', 1.0), ('b.pdf', 0.8), ('c.pdf', 0.0)])
+        self.assertEqual([index for _, index in ranked[1][2]], [1, 0])
+
+    def test_top_documents_and_min_similarity(self):
+        ranked = library_store.score_documents(make_library(), [0.0, 0.0, 5.0], top_documents=2)
+        self.assertEqual([blob_name for _, blob_name, _ in ranked], ['b.pdf', 'c.pdf'])
+        ranked = library_store.score_documents(make_library(), [1.0, 0.0, 0.0], min_similarity=0.5)
+        self.assertEqual([blob_name for _, blob_name, _ in ranked], ['a.pdf', 'b.pdf'])
+
+    def test_empty_library(self):
+        self.assertEqual(library_store.score_documents(library_store.empty_library(), [1.0, 0.0]), [])
+
+# Checks that stored libraries round trip without their cached matrix
+class LibraryStoreTest(unittest.TestCase):
+
+    def test_round_trip_drops_internal_keys(self):
+        blob_client = FakeBlobServiceClient(ServiceStats())
+        library = make_library()
+        library_store.score_documents(library, [1.0, 0.0, 0.0])
+        self.assertIn('_matrix', library)
+        library_store.save_library(blob_client, 'docs', library)
+        loaded = library_store.load_library(blob_client, 'docs', 'library-1')
+        self.assertNotIn('_matrix', loaded)
+        self.assertEqual(loaded['documents'], make_library()['documents'])
+
+    def test_unknown_library_is_empty(self):
+        blob_client = FakeBlobServiceClient(ServiceStats())
+        self.assertEqual(library_store.load_library(blob_client, 'docs', 'library-2')['documents'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared.artifact_cache import ArtifactCache
+from backend.shared import page_store
+
+PAGES = [f"Page {i} text" for i in range(20)]
+
+# Byte source over bytes recording the ranges read
+class RecordingSource(page_store.BytesSource):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, offset, length):
+        self.reads.append((offset, length))
+        return super().read(offset, length)
+
+# Checks the page store format and its range reads
+class PageStoreFormatTest(unittest.TestCase):
+
+    def test_ranges_match_list_slices(self):
+        store = page_store.PageStore(page_store.BytesSource(page_store.encode_page_store(PAGES, pages_per_block=3)))
+        self.assertEqual(len(store), 20)
+        for start, end in [(0, 20), (0, 1), (2, 7), (5, 6), (18, 25), (-3, 2), (7, 7), (30, 40)]:
+            self.assertEqual(store.read_range(start, end), PAGES[max(0, start):end], (start, end))
+
+    def test_range_read_fetches_only_covering_blocks(self):
+        data = page_store.encode_page_store(PAGES, pages_per_block=4)
+        source = RecordingSource(data)
+        store = page_store.PageStore(source)
+        source.reads.clear()
+        store.read_range(5, 7)
+        self.assertEqual(source.reads, [(store.offsets[1], store.offsets[2] - store.offsets[1])])
+
+    def test_offset_table_larger_than_prefetch(self):
+        pages = [str(i) for i in range(3000)]
+        store = page_store.PageStore(page_store.BytesSource(page_store.encode_page_store(pages, pages_per_block=1)))
+        self.assertEqual(store.read_range(2998, 3000), ['2998', '2999'])
+
+    def test_other_data_is_rejected(self):
+        with self.assertRaises(ValueError):
+            page_store.PageStore(page_store.BytesSource(b'%PDF-1.7' + bytes(64)))
+
+    def test_local_file_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'book.pages.bin')
+            with open(path, 'wb') as f:
+                f.write(page_store.encode_page_store(PAGES))
+            store = page_store.open_local_page_store(path)
+            self.assertEqual(store.read_range(9, 11), PAGES[9:11])
+            store.source.close()
+
+# Checks opening page stores from Blob Storage
+class OpenPageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = ServiceStats()
+        self.blob_client = FakeBlobServiceClient(self.stats)
+
+    def test_blob_round_trip_with_cache(self):
+        page_store.save_page_store(self.blob_client, 'docs', 'book.pdf', PAGES, pages_per_block=4)
+        cache = ArtifactCache()
+        self.assertEqual(page_store.open_page_store(self.blob_client, 'docs', 'book.pdf', cache).read_range(3, 9), PAGES[3:9])
+        before = self.stats.snapshot()
+        self.assertEqual(page_store.open_page_store(self.blob_client, 'docs', 'book.pdf', cache).read_range(3, 9), PAGES[3:9])
+        self.assertNotIn('blob.download', ServiceStats.diff(self.stats.snapshot(), before))
+
+    def test_legacy_pages_are_read_and_migrated(self):
+        self.blob_client.put('docs', 'book.pdf.pages.json', json.dumps(PAGES).encode('utf-8'))
+        legacy = page_store.open_page_store(self.blob_client, 'docs', 'book.pdf')
+        self.assertIsInstance(legacy, page_store.ListPageStore)
+        self.assertEqual(legacy.read_range(0, 2), PAGES[:2])
+        page_store.migrate_pages_blob(self.blob_client, 'docs', 'book.pdf')
+        migrated = page_store.open_page_store(self.blob_client, 'docs', 'book.pdf')
+        self.assertIsInstance(migrated, page_store.PageStore)
+        self.assertEqual(migrated.read_range(0, 20), PAGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
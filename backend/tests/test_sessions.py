@@ -0,0 +1,130 @@
+import tempfile
+import time
+import unittest
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared import sessions
+
+SESSION_ID = 'session-1'
+
+# Stand-in GPT client recording the summary prompts it receives
+class SummaryClient:
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat_completion(self, prompt, model):
+        self.prompts.append(prompt)
+        return f" summary {len(self.prompts)} "
+
+# Helper building a session with a number of recorded turns
+def session_with_turns(count):
+    session = sessions.new_session(SESSION_ID, 'doc.pdf')
+    for i in range(count):
+        sessions.record_turn(session, f"question {i}", f"answer {i}", [f"section {i}"])
+    return session
+
+# Checks the round trip and expiry of the three session stores
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.stores = {
+            'memory': sessions.MemorySessionStore(ttl_seconds=60),
+            'file': sessions.FileSessionStore(self.directory.name, ttl_seconds=60),
+            'blob': sessions.BlobSessionStore(FakeBlobServiceClient(ServiceStats()), 'docs', ttl_seconds=60),
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                session = session_with_turns(2)
+                store.save(session)
+                self.assertEqual(store.load(SESSION_ID), session)
+                store.delete(SESSION_ID)
+                self.assertIsNone(store.load(SESSION_ID))
+
+    def test_expired_session_is_not_loaded(self):
+        for name, store in self.stores.items():
+            with self.subTest(store=name):
+                session = session_with_turns(1)
+                session['updated_at'] = time.time() - 120
+                store.save(session)
+                self.assertIsNone(store.load(SESSION_ID))
+
+    def test_memory_store_returns_copies(self):
+        store = self.stores['memory']
+        store.save(session_with_turns(1))
+        store.load(SESSION_ID)['turns'].clear()
+        self.assertEqual(len(store.load(SESSION_ID)['turns']), 1)
+
+    def test_memory_store_evicts_least_recently_used(self):
+        store = sessions.MemorySessionStore(max_sessions=2)
+        for session_id in ('session-a', 'session-b'):
+            store.save(sessions.new_session(session_id, 'doc.pdf'))
+        store.load('session-a')
+        store.save(sessions.new_session('session-c', 'doc.pdf'))
+        self.assertIsNone(store.load('session-b'))
+        self.assertIsNotNone(store.load('session-a'))
+        self.assertIsNotNone(store.load('session-c'))
+
+    def test_open_session_starts_over_for_another_document(self):
+        store = self.stores['memory']
+        store.save(session_with_turns(2))
+        self.assertEqual(len(sessions.open_session(store, SESSION_ID, 'doc.pdf')['turns']), 2)
+        switched = sessions.open_session(store, SESSION_ID, 'other.pdf', 'other.pdf')
+        self.assertEqual((switched['doc_id'], switched['turns']), ('other.pdf', []))
+
+# Checks when a follow-up reuses the last retrieval of its session
+class ReusableRetrievalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = sessions.new_session(SESSION_ID, 'doc.pdf')
+        sessions.save_retrieval(self.session, 'v1', ['Intro'], [1.0, 0.0], [{'id': 'c1'}])
+
+    def test_similar_query_reuses_retrieval(self):
+        retrieval, similarity = sessions.reusable_retrieval(self.session, 'v1', [0.9, 0.1], min_similarity=0.8)
+        self.assertEqual(retrieval['sections'], ['Intro'])
+        self.assertGreaterEqual(similarity, 0.8)
+
+    def test_query_below_threshold_retrieves_again(self):
+        retrieval, similarity = sessions.reusable_retrieval(self.session, 'v1', [0.5, 0.5], min_similarity=0.8)
+        self.assertIsNone(retrieval)
+        self.assertAlmostEqual(similarity, 0.7071, places=3)
+
+    def test_new_document_version_invalidates_retrieval(self):
+        self.assertEqual(sessions.reusable_retrieval(self.session, 'v2', [1.0, 0.0]), (None, None))
+
+# Checks how many turns are folded into the summary
+class CompressHistoryTest(unittest.TestCase):
+
+    def test_short_history_is_kept(self):
+        client = SummaryClient()
+        session = session_with_turns(6)
+        self.assertEqual(sessions.compress_history(session, client, max_turns=6), 0)
+        self.assertEqual((len(session['turns']), client.prompts), (6, []))
+
+    def test_older_turns_are_folded(self):
+        client = SummaryClient()
+        session = session_with_turns(7)
+        self.assertEqual(sessions.compress_history(session, client, max_turns=6), 4)
+        self.assertEqual([t['query'] for t in session['turns']], ['question 4', 'question 5', 'question 6'])
+        self.assertEqual((session['summary'], session['summarized_turns']), ('summary 1', 4))
+        self.assertIn('question 3', client.prompts[0])
+        self.assertNotIn('question 4', client.prompts[0])
+
+    def test_next_compression_includes_previous_summary(self):
+        client = SummaryClient()
+        session = session_with_turns(7)
+        sessions.compress_history(session, client, max_turns=6)
+        for i in range(7, 11):
+            sessions.record_turn(session, f"question {i}", f"answer {i}")
+        self.assertEqual(sessions.compress_history(session, client, max_turns=6), 4)
+        self.assertIn('Earlier summary:\nsummary 1', client.prompts[1])
+        self.assertEqual(session['summarized_turns'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import json
+import unittest
+from unittest import mock
+import azure.functions as func
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.status_function import main as status_function
+
+# Helper building a status request for a job id
+def status_request(job_id):
+    return func.HttpRequest('GET', '/api/status', params={'job_id': job_id}, body=b'')
+
+# Checks the responses of the job status endpoint
+class StatusFunctionTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(status_function, 'get_blob_client', return_value=FakeBlobServiceClient(ServiceStats()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unknown_job(self):
+        self.assertEqual(status_function.main(status_request('missing')).status_code, 404)
+
+    def test_failure_returns_json_error(self):
+        with mock.patch.object(status_function, 'load_job', side_effect=RuntimeError('storage down')):
+            with self.assertLogs(level='ERROR'):
+                response = status_function.main(status_request('job'))
+        self.assertEqual((response.status_code, response.mimetype), (500, 'application/json'))
+        body = json.loads(response.get_body())
+        self.assertEqual((body['error'], body['type']), ('storage down', 'RuntimeError'))
+        self.assertIn('trace_id', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import uuid
+from unittest import mock
+from backend.benchmarks.fakes import FakeAzure, encode_synthetic_pdf
+from backend.benchmarks.pipeline import synthetic_book
+from backend.shared import upload_pipeline
+from backend.shared.jobs import checkpoint_prefix, create_job, load_job
+
+CONTAINER = upload_pipeline.BLOB_CONTAINER
+
+# Checks that a retried upload job resumes from the checkpoints of the failed attempt
+class CheckpointResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeAzure().install()
+        self.addCleanup(self.fake.uninstall)
+        # A unique document, so the content of other tests is never deduplicated against
+        pages, headings, _ = synthetic_book(30, seed=uuid.uuid4().int % 1000)
+        pages[0] += '\n' + uuid.uuid4().hex
+        self.blob_name = f"upload-{uuid.uuid4().hex}.pdf"
+        self.fake.blob.put(CONTAINER, self.blob_name, encode_synthetic_pdf(pages, headings))
+        self.job = create_job(self.fake.blob, CONTAINER, self.blob_name, f"https://account.blob.core.windows.net/{CONTAINER}/{self.blob_name}")
+
+    def calls(self, op):
+        return self.fake.stats.snapshot().get(op, {}).get('calls', 0)
+
+    def test_retry_skips_finished_stages(self):
+        with mock.patch.object(self.fake.openai, 'create_embeddings', side_effect=RuntimeError('embeddings down')):
+            with self.assertRaises(RuntimeError), self.assertLogs(level='ERROR'):
+                upload_pipeline.run_upload_job(self.job['job_id'], final_attempt=False)
+        failed = load_job(self.fake.blob, CONTAINER, self.job['job_id'])
+        self.assertEqual((failed['status'], failed['error']), ('retrying', 'embeddings down'))
+        self.assertEqual(
+            {stage: failed['stages'][stage]['status'] for stage in ('extract', 'analyze', 'summarize')},
+            {'extract': 'done', 'analyze': 'done', 'summarize': 'failed'}
+        )
+        analyzed = self.calls('document_intelligence.analyze')
+
+        job = upload_pipeline.run_upload_job(self.job['job_id'])
+        self.assertEqual((job['status'], job['attempts']), ('succeeded', 2))
+        self.assertEqual(self.calls('document_intelligence.analyze'), analyzed)
+        self.assertEqual(list(self.fake.blob.get_container_client(CONTAINER).list_blobs(name_starts_with=checkpoint_prefix(job['job_id']))), [])
+        self.assertTrue(job['result']['knowledge_map'])
+
+    def test_unknown_or_finished_job_is_not_run_again(self):
+        self.assertIsNone(upload_pipeline.run_upload_job('missing'))
+        job = upload_pipeline.run_upload_job(self.job['job_id'])
+        analyzed = self.calls('document_intelligence.analyze')
+        self.assertEqual(upload_pipeline.run_upload_job(self.job['job_id'])['status'], 'succeeded')
+        self.assertEqual((self.calls('document_intelligence.analyze'), job['attempts']), (analyzed, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
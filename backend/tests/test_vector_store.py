@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+from backend.benchmarks.fakes import FakeBlobServiceClient, ServiceStats
+from backend.shared import vector_store
+from backend.shared.artifact_cache import ArtifactCache
+from backend.shared.vector_store import LocalVectorRetriever
+
+# Helper building a retriever over random normalized rows split into sections of a single document
+def make_retriever(mode, section_sizes, dimensions=16, min_filtered_rows=1000):
+    rows = []
+    for s, size in enumerate(section_sizes):
+        rows += [{'doc_id': 'book', 'section': f"s{s}", 'id': f"s{s}_{i}", 'chunk': '', 'start_page': 1, 'end_page': 1} for i in range(size)]
+    matrix = np.random.default_rng(0).standard_normal((len(rows), dimensions)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return LocalVectorRetriever(matrix, rows, mode=mode, min_filtered_rows=min_filtered_rows)
+
+# Checks which search path runs for filtered and unfiltered queries
+class SearchPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.query = np.random.default_rng(1).standard_normal(16).tolist()
+
+    def test_unfiltered_search_follows_mode(self):
+        retriever = make_retriever('exact', [500])
+        retriever.search(self.query, top=5)
+        self.assertEqual(retriever.last_path, 'exact')
+        retriever = make_retriever('approximate', [500])
+        retriever.search(self.query, top=5)
+        self.assertEqual(retriever.last_path, 'approximate')
+
+    def test_large_filtered_subset_is_probed(self):
+        retriever = make_retriever('approximate', [4000, 100])
+        results = retriever.search(self.query, top=5, doc_id='book', sections=['s0'])
+        self.assertEqual(retriever.last_path, 'filtered+approximate')
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r['id'].startswith('s0_') for r in results))
+
+    def test_small_filtered_subset_is_scored_exactly(self):
+        retriever = make_retriever('approximate', [4000, 100])
+        results = retriever.search(self.query, top=5, doc_id='book', sections=['s1'])
+        self.assertEqual(retriever.last_path, 'filtered')
+        self.assertTrue(all(r['id'].startswith('s1_') for r in results))
+
+    def test_exact_mode_never_probes_filtered_subsets(self):
+        retriever = make_retriever('exact', [4000])
+        retriever.search(self.query, top=5, doc_id='book', sections=['s0'])
+        self.assertEqual(retriever.last_path, 'filtered')
+
+    def test_filters_match_document_and_sections(self):
+        retriever = make_retriever('exact', [3, 3, 3])
+        self.assertEqual(retriever._filter_rows('book', ['s0', 's2']).tolist(), [0, 1, 2, 6, 7, 8])
+        self.assertEqual(retriever._filter_rows('other', None).tolist(), [])
+        self.assertEqual(retriever._filter_rows(None, ['missing']).tolist(), [])
+
+# Helper building a chunk/embedding index with two sections of a document
+def make_index(etag):
+    chunks = {
+        '1-2': [{'id': 'a', 'chunk': 'a', 'chunk_hash': 'ha', 'doc_id': 'book', 'start_page': 1, 'end_page': 2}],
+        '3-4': [{'id': 'b', 'chunk': 'b', 'chunk_hash': 'hb', 'doc_id': 'book', 'start_page': 3, 'end_page': 4}],
+    }
+    return {
+        'sections': {key: {'chunks': rows} for key, rows in chunks.items()},
+        'embeddings': {'ha': [1.0, 0.0], 'hb': [0.0, 1.0]},
+        '_etag': etag
+    }
+
+# Checks that warm retrievers come from the artifact cache without requests for the vector file
+class OpenLocalRetrieverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = ServiceStats()
+        self.blob_client = FakeBlobServiceClient(self.stats)
+        self.cache = ArtifactCache()
+
+    def open(self, index, rebuild=False):
+        return vector_store.open_local_retriever(self.blob_client, 'docs', 'book.pdf', index, rebuild=rebuild, mode='exact', cache=self.cache)
+
+    def test_cached_matrix_skips_blob_requests(self):
+        self.open(make_index('v1'), rebuild=True)
+        before = self.stats.snapshot()
+        retriever = self.open(make_index('v1'))
+        self.assertEqual(ServiceStats.diff(self.stats.snapshot(), before), {})
+        self.assertEqual(retriever.search([0.0, 1.0], top=1, doc_id='book', sections=['3-4'])[0]['id'], 'b')
+
+    def test_new_index_version_reloads_vectors(self):
+        self.open(make_index('v1'), rebuild=True)
+        before = self.stats.snapshot()
+        self.open(make_index('v2'))
+        self.assertIn('blob.properties', ServiceStats.diff(self.stats.snapshot(), before))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,31 @@
 import azure.functions as func
 import os
 import json
-from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import ResourceExistsError
-from ..shared.azure_clients import get_document_intelligence_client, get_blob_client, get_openai_client
-from ..shared.document_analysis import detect_index, calculate_page_offset, segment_document
-from ..shared.knowledge_map import generate_knowledge_map
+import re
+import logging
+from ..shared.azure_clients import get_blob_client, get_queue_client
+from ..shared.jobs import create_job, AzureJobQueue, get_local_job_queue
+from ..shared.content_store import (
+    content_artifact_name, find_content, load_manifest, save_manifest, save_pointer, add_pending_pointer, publish_pending_pointers
+)
+from ..shared.upload_pipeline import run_upload_job, JOB_STALE_SECONDS
+from ..shared.telemetry import start_trace
 
 # Environment variables for Azure resources (to be set in Azure or local.settings.json)
+# Processing settings (Document Intelligence, OpenAI, AI Search, indexing) are read by shared/upload_pipeline.py
 BLOB_CONN_STR = os.environ.get('BLOB_CONN_STR')  # Connection string for Azure Blob Storage
 BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'readpilot-docs')  # Default container name
-FORMRECOGNIZER_ENDPOINT = os.environ.get('FORMRECOGNIZER_ENDPOINT')  # Document Intelligence endpoint
-FORMRECOGNIZER_KEY = os.environ.get('FORMRECOGNIZER_KEY')  # Document Intelligence key
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')  # Azure OpenAI key
-OPENAI_ENDPOINT = os.environ.get('OPENAI_ENDPOINT')  # Azure OpenAI endpoint
 BLOB_ACCOUNT_URL = os.environ.get('BLOB_ACCOUNT_URL')  # e.g., https://<account>.blob.core.windows.net
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'azure')  # 'azure' (Storage queue + upload_worker_function) or 'local' (in-process thread)
+JOB_QUEUE_NAME = os.environ.get('JOB_QUEUE_NAME', 'readpilot-upload-jobs')  # Storage queue the worker function is triggered by
+JOB_QUEUE_CONN_STR = os.environ.get('JOB_QUEUE_CONN_STR') or os.environ.get('AzureWebJobsStorage')  # Storage account of the job queue
+LOCAL_JOB_CONCURRENCY = int(os.environ.get('LOCAL_JOB_CONCURRENCY', '1'))  # Jobs processed at once by the local queue
+
+# Client-provided content hashes (hex SHA-256)
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Job queue of this process, created on first use
+_job_queue = None
 
 # Helper function to construct blob URL from blob name
 def construct_blob_url(blob_name):
@@ -27,39 +38,42 @@ def construct_blob_url(blob_name):
     """
     return f"{BLOB_ACCOUNT_URL}/{BLOB_CONTAINER}/{blob_name}"
 
-# Helper function to extract text and structure from PDF using Azure Document Intelligence
-def extract_document_text(form_client, pdf_url):
+# Helper function to return the job queue selected by JOB_QUEUE_BACKEND
+def get_job_queue():
     """
-    Uses Azure Document Intelligence to extract text and structure from the PDF.
-    Args:
-        form_client: DocumentAnalysisClient instance
-        pdf_url: URL of the PDF in Blob Storage
     Returns:
-        List of page texts (one string per page)
+        AzureJobQueue (consumed by upload_worker_function) or LocalJobQueue (runs jobs in this process)
     """
-    # Start the analysis job using the prebuilt-layout model
-    poller = form_client.begin_analyze_document_from_url("prebuilt-layout", pdf_url)
-    result = poller.result()
-    pages = []
-    for page in result.pages:
-        # Concatenate all lines on the page into a single string
-        page_text = "\n".join([line.content for line in page.lines])
-        pages.append(page_text)
-    return pages
+    global _job_queue
+    if _job_queue is None:
+        if JOB_QUEUE_BACKEND == 'local':
+            _job_queue = get_local_job_queue(run_upload_job, LOCAL_JOB_CONCURRENCY)
+        else:
+            _job_queue = AzureJobQueue(get_queue_client(JOB_QUEUE_CONN_STR, JOB_QUEUE_NAME))
+    return _job_queue
 
 # Main Azure Function entry point
 def main(req: func.HttpRequest) -> func.HttpResponse:
     """
-    HTTP POST endpoint for knowledge map creation from a PDF in Blob Storage.
+    HTTP POST endpoint that starts knowledge map creation for a PDF in Blob Storage.
     Expects JSON payload with either 'blob_url' or 'blob_name'.
     Steps:
     1. Parse JSON payload and determine PDF location.
-    2. Use Document Intelligence to extract text/structure.
-    3. Detect index (TOC), calculate page offset, segment document.
-    4. Generate knowledge map using GPT-4.
-    5. Store knowledge map and per-page text in Blob Storage.
-    6. Return knowledge map metadata as JSON.
+    2. Look up the client-side "sha256" of the document, if given. Content processed before is not
+       processed again: the blob is pointed at the shared artifacts and the knowledge map is returned
+       at once (200, "deduplicated": true); content still being processed returns the running job (202).
+       The request never downloads the document: a job hashes it and verifies the client's hash
+       (a wrong hash undoes the pointer and the document is processed under its real hash).
+       "force": true always processes the document.
+    3. Create a job record (jobs/<job_id>.json) for the document.
+    4. Enqueue the job and return 202 with its id; progress is polled from the status endpoint.
+       With "sync": true the job runs inside this request and the knowledge map is returned (200).
+       Without a client hash, the job's first stage deduplicates the document.
+    The processing stages themselves are in shared/upload_pipeline.py.
+    With "timings": true the response adds a "timings" block (with the pipeline stages for sync runs,
+    see shared/telemetry.py). Failures return a JSON 500 {error, type, stage, trace_id}.
     """
+    trace = start_trace('upload')
     try:
         # 1. Parse JSON payload
         try:
@@ -67,6 +81,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         except ValueError:
             # If the request body is not valid JSON, return an error
             return func.HttpResponse("Invalid JSON payload.", status_code=400)
+        if data.get('timings'):
+            trace.record_timings()
 
         # Determine PDF location: blob_url or blob_name
         blob_url = data.get('blob_url')
@@ -81,44 +97,85 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             # If only blob_url is provided, extract the blob name from the URL
             blob_name = blob_url.split('/')[-1]
 
-        # 2. Extract text/structure using Document Intelligence
-        form_client = get_document_intelligence_client(FORMRECOGNIZER_ENDPOINT, FORMRECOGNIZER_KEY)
-        pages = extract_document_text(form_client, blob_url)
+        # 2. Look the client's hash up; it is only trusted for the lookup, and the job verifies it
+        claimed = str(data.get('sha256') or '').lower() or None
+        if claimed and not SHA256_PATTERN.match(claimed):
+            return func.HttpResponse("'sha256' must be a hex SHA-256 digest.", status_code=400)
+        force = bool(data.get('force'))
+        blob_client = get_blob_client(BLOB_CONN_STR)
+        manifest, running_job = None, None
+        if claimed and not force:
+            with trace.span('deduplicate', stage=True) as span:
+                manifest, running_job = find_content(blob_client, BLOB_CONTAINER, claimed, JOB_STALE_SECONDS)
+                span.set(hit=manifest is not None)
 
-        # 3. Detect index (TOC), calculate page offset, segment document
-        # Scan up to 50 pages for multi-page TOC
-        index = detect_index(pages, max_toc_pages=50)
-        # Assume first chapter starts at the first non-empty page after TOC
-        actual_first_chapter_page = next((i for i, p in enumerate(pages) if p.strip()), 0)
-        page_offset = calculate_page_offset(index, actual_first_chapter_page)
-        sections = segment_document(pages, index)
+        # 3. Create the job record; its artifacts are stored under the content hash and shared by later uploads
+        with trace.span('create_job', stage=True):
+            artifact = content_artifact_name(claimed) if claimed else None
+            job = create_job(blob_client, BLOB_CONTAINER, blob_name, blob_url, content_hash=claimed, artifact_name=artifact, force=force)
+            if claimed and manifest is None:
+                # Reserve the content, so uploads of the same bytes wait for this job; the blob is pointed at
+                # the content once the job has stored it, so earlier artifacts keep serving chat until then
+                save_manifest(blob_client, BLOB_CONTAINER, claimed, 'processing', job_id=job['job_id'])
 
-        # 4. Generate knowledge map using GPT-4
-        gpt_client = get_openai_client(OPENAI_API_KEY, OPENAI_ENDPOINT)
-        knowledge_map = generate_knowledge_map(sections, pages, gpt_client)
+        if manifest is not None:
+            # The job only verifies the hash (and processes the document if the hash was wrong)
+            with trace.span('enqueue', stage=True):
+                get_job_queue().enqueue(job['job_id'])
+            if running_job is None:
+                # Already processed: no extraction or model calls
+                save_pointer(blob_client, BLOB_CONTAINER, blob_name, claimed)
+                result = dict(
+                    manifest['result'], file_name=blob_name, pdf_url=blob_url, deduplicated=True, content_hash=claimed,
+                    verification_job_id=job['job_id']
+                )
+                return func.HttpResponse(json.dumps(trace.attach(result)), mimetype="application/json", status_code=200)
+            # The content has no artifacts yet: the job's store stage writes this blob's pointer
+            # (or this request does, if the job finished in the meantime)
+            add_pending_pointer(blob_client, BLOB_CONTAINER, claimed, blob_name)
+            if (load_manifest(blob_client, BLOB_CONTAINER, claimed) or {}).get('status') == 'ready':
+                publish_pending_pointers(blob_client, BLOB_CONTAINER, claimed)
+            return func.HttpResponse(
+                json.dumps(trace.attach({
+                    'job_id': running_job['job_id'],
+                    'status': running_job['status'],
+                    'file_name': blob_name,
+                    'status_url': f"/api/status?job_id={running_job['job_id']}",
+                    'deduplicated': True,
+                    'content_hash': claimed,
+                    'verification_job_id': job['job_id']
+                })),
+                mimetype="application/json",
+                status_code=202
+            )
 
-        # 5. Store knowledge map and per-page text in Blob Storage (as JSON)
-        blob_client = get_blob_client(BLOB_CONN_STR)
-        map_blob_name = blob_name + '.knowledge_map.json'  # Name for the knowledge map blob
-        map_blob = blob_client.get_container_client(BLOB_CONTAINER).get_blob_client(map_blob_name)
-        map_blob.upload_blob(json.dumps(knowledge_map), overwrite=True)
-        # Store per-page text for later chapter extraction
-        pages_blob_name = blob_name + '.pages.json'
-        pages_blob = blob_client.get_container_client(BLOB_CONTAINER).get_blob_client(pages_blob_name)
-        pages_blob.upload_blob(json.dumps(pages), overwrite=True)
+        if data.get('sync'):
+            # Small documents (or callers that cannot poll) can still wait for the result; the job's stages join this trace
+            job = run_upload_job(job['job_id'])
+            return func.HttpResponse(
+                json.dumps(trace.attach(dict(job['result'], job_id=job['job_id'], content_hash=job['content_hash']))),
+                mimetype="application/json",
+                status_code=200
+            )
 
-        # 6. Return knowledge map metadata
+        # 4. Enqueue and return the job id at once
+        with trace.span('enqueue', stage=True):
+            get_job_queue().enqueue(job['job_id'])
         return func.HttpResponse(
-            json.dumps({
+            json.dumps(trace.attach({
+                'job_id': job['job_id'],
+                'status': job['status'],
                 'file_name': blob_name,
-                'pdf_url': blob_url,
-                'knowledge_map_blob': map_blob_name,
-                'pages_blob': pages_blob_name,
-                'knowledge_map': knowledge_map
-            }),
+                'status_url': f"/api/status?job_id={job['job_id']}",
+                'content_hash': claimed
+            })),
             mimetype="application/json",
-            status_code=200
+            status_code=202
         )
     except Exception as e:
-        # Return error details for debugging
-        return func.HttpResponse(f"Error: {str(e)}", status_code=500) 
\ No newline at end of file
+        # Log the traceback and report the failing stage; the trace id matches the exported spans
+        logging.exception("Upload request failed in stage %s", trace.stage)
+        trace.finish(e)
+        return func.HttpResponse(json.dumps(trace.error_payload(e)), mimetype="application/json", status_code=500)
+    finally:
+        trace.finish()
@@ -0,0 +1,23 @@
+import azure.functions as func
+import os
+import json
+from ..shared.upload_pipeline import run_upload_job
+
+# Environment variables (Azure resources are configured for shared/upload_pipeline.py, see README)
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_JOB_MAX_ATTEMPTS', '5'))  # Keep equal to the queue's maxDequeueCount in host.json
+
+# Main Azure Function entry point (queue trigger on JOB_QUEUE_NAME)
+def main(msg: func.QueueMessage) -> None:
+    """
+    Processes one upload job message ({"job_id": ...}) enqueued by the upload function.
+    If processing fails before the last attempt, the exception is re-raised so the queue
+    delivers the message again; the retry resumes from the job's last checkpoint.
+    On the last attempt the job is marked 'failed' and the message is consumed.
+    """
+    job_id = json.loads(msg.get_body().decode('utf-8'))['job_id']
+    final_attempt = (msg.dequeue_count or 1) >= UPLOAD_JOB_MAX_ATTEMPTS
+    try:
+        run_upload_job(job_id, final_attempt=final_attempt)
+    except Exception:
+        if not final_attempt:
+            raise
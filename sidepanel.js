@@ -10,6 +10,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
   let shifted = false; // Tracks if the UI has shifted after first message
   let currentPDFBlob = null; // Will hold the current PDF as a Blob for upload
+  let currentBlobName = null; // Blob name of the uploaded PDF, sent with chat queries
+  // Conversation id: follow-up questions are answered with the earlier turns as context
+  let sessionId = crypto.randomUUID();
 
   // On load, try to fetch the current PDF from Chrome storage and upload it to Azure
   fetchAndUploadPDF();
@@ -33,15 +36,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
     try {
       // Send the query to the backend API (update the endpoint as needed)
+      // JSON is the default: the backend cannot stream the body, so events would arrive all at once
       const response = await fetch('https://your-azure-api-endpoint', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ query }),
+        body: JSON.stringify({ query, session_id: sessionId, blob_name: currentBlobName }),
       });
-      // Parse the backend's response (should include answer and references)
-      const data = await response.json();
-      // Display the AI's answer and any references in the chat UI
-      appendMessage('ReadPilot', data.answer, false, data.references);
+      if (!response.ok) throw new Error('Chat request failed');
+      const contentType = response.headers.get('Content-Type') || '';
+      if (contentType.includes('text/event-stream') && response.body) {
+        // Event responses (payload "events": true) render references first, then the answer tokens
+        await renderEventAnswer(response);
+      } else {
+        // Parse the backend's response (should include answer and references)
+        const data = await response.json();
+        // Display the AI's answer and any references in the chat UI
+        appendMessage('ReadPilot', data.answer, false, data.references);
+      }
     } catch (error) {
       // Show an error message if the backend call fails
       appendMessage('ReadPilot', 'Error: Unable to fetch response.', false);
@@ -65,6 +76,19 @@ document.addEventListener('DOMContentLoaded', () => {
     messageDiv.innerHTML = `<strong>${sender}:</strong> ${text}`;
 
     // If the backend provided references, display them below the answer
+    renderReferences(messageDiv, references);
+
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageDiv;
+  }
+
+  /**
+   * Renders a list of references below a chat message.
+   * @param {HTMLElement} messageDiv - The message element to attach references to
+   * @param {Array|null} references - Optional array of reference objects
+   */
+  function renderReferences(messageDiv, references) {
     if (references && references.length > 0) {
       const refsDiv = document.createElement('div');
       refsDiv.classList.add('references');
@@ -86,9 +110,60 @@ document.addEventListener('DOMContentLoaded', () => {
         '</ul>';
       messageDiv.appendChild(refsDiv);
     }
+  }
 
-    messagesContainer.appendChild(messageDiv);
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  /**
+   * Renders a server-sent event response from the chat endpoint as its events are read.
+   * Events: 'meta' (references, context_sections), 'token' (text), 'done' (answer), 'error'.
+   * @param {Response} response - The fetch response with a text/event-stream body
+   */
+  async function renderEventAnswer(response) {
+    // Create the message up front with an empty answer that tokens are appended to
+    const messageDiv = appendMessage('ReadPilot', '', false);
+    const answerSpan = document.createElement('span');
+    messageDiv.appendChild(answerSpan);
+    let references = null;
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      // Events are separated by a blank line; keep any incomplete event in the buffer
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      for (const rawEvent of events) {
+        const { event, data } = parseSSEEvent(rawEvent);
+        if (event === 'meta') {
+          references = data.references;
+          renderReferences(messageDiv, references);
+        } else if (event === 'token') {
+          answerSpan.textContent += data.text;
+        } else if (event === 'done') {
+          answerSpan.textContent = data.answer;
+        } else if (event === 'error') {
+          answerSpan.textContent = 'Error: ' + data.message;
+        }
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+      }
+    }
+  }
+
+  /**
+   * Parses one server-sent event block into its event name and JSON data.
+   * @param {string} rawEvent - Lines of a single event (without the trailing blank line)
+   * @returns {{event: string, data: Object}}
+   */
+  function parseSSEEvent(rawEvent) {
+    let event = 'message';
+    let dataText = '';
+    for (const line of rawEvent.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+    }
+    return { event, data: dataText ? JSON.parse(dataText) : {} };
   }
 
   /**
@@ -134,11 +209,88 @@ document.addEventListener('DOMContentLoaded', () => {
       // Upload the PDF Blob to Azure Blob Storage
       const uploadResponse = await uploadToAzure(currentPDFBlob, filename);
       console.log('PDF uploaded:', uploadResponse);
+
+      // A new document starts a new conversation
+      currentBlobName = filename;
+      sessionId = crypto.randomUUID();
+
+      // Ask the backend to analyze the PDF; this returns a job id at once (or the result, if seen before)
+      await analyzeUploadedPDF(filename, await sha256Hex(currentPDFBlob));
     } catch (error) {
       console.error('PDF upload failed:', error);
     }
   }
 
+  /**
+   * Starts knowledge map creation for an uploaded PDF and shows its progress until the job finishes.
+   * @param {string} blobName - The name of the uploaded blob
+   * @param {string} sha256 - Hex SHA-256 of the PDF; the backend uses it for the lookup and a job verifies it against the uploaded bytes
+   */
+  async function analyzeUploadedPDF(blobName, sha256) {
+    // The upload endpoint (update as needed) queues the job and answers 202 with its id,
+    // or 200 if the same PDF was already analyzed
+    const response = await fetch('https://your-azure-upload-endpoint', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ blob_name: blobName, sha256 }),
+    });
+    if (!response.ok) throw new Error('Upload analysis request failed');
+    if (response.status === 200) {
+      appendMessage('ReadPilot', 'Document ready. Ask me anything about it!', false);
+      return;
+    }
+    const { job_id: jobId } = await response.json();
+
+    const statusDiv = appendMessage('ReadPilot', 'Analyzing document…', false);
+    const job = await pollJobStatus(jobId, (status) => {
+      const percent = Math.round((status.progress || 0) * 100);
+      setStatusText(statusDiv, `Analyzing document… ${percent}%` + (status.stage ? ` (${status.stage})` : ''));
+    });
+    setStatusText(statusDiv, job.status === 'succeeded'
+      ? 'Document ready. Ask me anything about it!'
+      : `Document analysis failed: ${job.error || 'unknown error'}`);
+  }
+
+  /**
+   * Replaces the text of a ReadPilot status message.
+   * The text is set as plain text, since job errors may contain text from the document or backend.
+   * @param {HTMLElement} statusDiv - The message element returned by appendMessage
+   * @param {string} text - The status text
+   */
+  function setStatusText(statusDiv, text) {
+    statusDiv.innerHTML = '<strong>ReadPilot:</strong> ';
+    statusDiv.appendChild(document.createTextNode(text));
+  }
+
+  /**
+   * Computes the SHA-256 of a Blob.
+   * @param {Blob} blob - The PDF Blob
+   * @returns {Promise<string>} Lowercase hex digest
+   */
+  async function sha256Hex(blob) {
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  /**
+   * Polls the status endpoint until a job has succeeded or failed.
+   * @param {string} jobId - The id returned by the upload endpoint
+   * @param {function(Object)} onProgress - Called with each status response
+   * @param {number} intervalMs - Delay between two polls
+   * @returns {Promise<Object>} The final job status
+   */
+  async function pollJobStatus(jobId, onProgress, intervalMs = 2000) {
+    while (true) {
+      // Update the status endpoint URL as needed
+      const response = await fetch(`https://your-azure-status-endpoint?job_id=${encodeURIComponent(jobId)}`);
+      if (!response.ok) throw new Error('Job status request failed');
+      const status = await response.json();
+      onProgress(status);
+      if (status.status === 'succeeded' || status.status === 'failed') return status;
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  }
+
   /**
    * Uploads a Blob to Azure Blob Storage using a SAS URL.
    * @param {Blob} blob - The PDF file as a Blob